@@ -1,4 +1,17 @@
 import argparse
+import os
+
+
+def tile_size(value: str) -> int:
+    """
+    Parse a tile size which TIFF requires to be a positive multiple of 16.
+    """
+    size = int(value)
+    if size <= 0 or size % 16 != 0:
+        raise argparse.ArgumentTypeError(
+            f"tile size has to be a positive multiple of 16, got {size}"
+        )
+    return size
 
 
 parser = argparse.ArgumentParser(
@@ -11,16 +24,79 @@ parser.add_argument(
 parser.add_argument(
     "--segment_anything", action="store_true", help="start the GUI in segmentation mode"
 )
+parser.add_argument(
+    "--profile",
+    type=str,
+    default=None,
+    help="profile recomputes of states and write a report to <PROFILE>.txt and <PROFILE>.dot",
+)
+subparsers = parser.add_subparsers(dest="command")
+
+batch_parser = subparsers.add_parser(
+    "batch",
+    help="segment and evaluate all images in a directory with SAM",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+batch_parser.add_argument("directory", type=str, help="directory containing images")
+batch_parser.add_argument(
+    "--workers", type=int, default=os.cpu_count(), help="number of worker processes"
+)
+batch_parser.add_argument(
+    "--threads", type=int, default=1, help="number of torch threads per worker"
+)
+batch_parser.add_argument(
+    "--grid", type=int, default=10, help="number of grid points per dimension"
+)
+batch_parser.add_argument(
+    "-o", "--output", type=str, default=None, help="file to write measures to"
+)
+
+ingest_parser = subparsers.add_parser(
+    "ingest",
+    help="convert all images in a directory into a cached multi-resolution representation",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+ingest_parser.add_argument("directory", type=str, help="directory containing images")
+ingest_parser.add_argument(
+    "--workers", type=int, default=os.cpu_count(), help="number of worker processes"
+)
+ingest_parser.add_argument(
+    "--tile_size", type=tile_size, default=256, help="size of tiles (multiple of 16)"
+)
 args = parser.parse_args()
 
-if args.segment_anything:
+if args.profile is not None:
+    from .state.profiler import PROFILER
+
+    PROFILER.enable()
+
+if args.command == "ingest":
+    from .ingest import run_ingest
+
+    run_ingest(args.directory, n_workers=args.workers, tile_size=args.tile_size)
+elif args.command == "batch":
+    from .sam.batch import run_batch
+
+    run_batch(
+        args.directory,
+        n_workers=args.workers,
+        n_threads=args.threads,
+        n_points=args.grid,
+        output=args.output,
+    )
+elif args.segment_anything:
     from .sam.app import App
     from .sam.state import app_state
 
     app_state.filename.set(args.image)
 
     app = App()
-    app.mainloop()
+    # the app may also be quit with exit, so the report is written in any case
+    try:
+        app.mainloop()
+    finally:
+        if args.profile is not None:
+            PROFILER.dump(args.profile)
 else:
     from .views.app import App
     from .views.app.state import app_state
@@ -28,4 +104,8 @@ else:
     app_state.filename_state.set(args.image)
 
     app = App()
-    app.mainloop()
+    try:
+        app.mainloop()
+    finally:
+        if args.profile is not None:
+            PROFILER.dump(args.profile)
@@ -0,0 +1,113 @@
+"""
+Cache of images converted into a tiled, multi-resolution representation.
+
+The cache of a directory is its sub-directory `.vesseval`. For each image, it
+contains a pyramidal TIFF file and a JSON sidecar with metadata (e.g., the
+pixel size), both named by the hash of the image content. An index maps the
+filenames of the directory to their hashes, sizes and modification times so
+that a lookup does not have to read the image.
+
+The cache is built by `python -m vesseval ingest <directory>`.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+from typing import Any, Optional
+
+CACHE_DIRECTORY = ".vesseval"
+INDEX_FILE = "index.json"
+
+
+@dataclass
+class CacheEntry:
+    """
+    A cached image: the path of its pyramidal TIFF file and its metadata.
+    """
+
+    image: str
+    metadata: dict[str, Any]
+
+
+def cache_directory(directory: str) -> str:
+    return os.path.join(directory, CACHE_DIRECTORY)
+
+
+def content_hash(filename: str, chunk_size: int = 16 * 1024**2) -> str:
+    """
+    Hash the content of a file without reading it into memory at once.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filename, mode="rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_key(filename: str) -> dict[str, int]:
+    """
+    Get the size and modification time of a file to detect if it changed.
+    """
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def cache_files(directory: str, digest: str) -> tuple[str, str]:
+    """
+    Get the paths of the pyramid and the sidecar of an image in the cache.
+    """
+    _dir = cache_directory(directory)
+    return os.path.join(_dir, f"{digest}.tif"), os.path.join(_dir, f"{digest}.json")
+
+
+def read_index(directory: str) -> dict[str, dict[str, Any]]:
+    try:
+        with open(os.path.join(cache_directory(directory), INDEX_FILE), mode="r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_json(filename: str, data: Any) -> None:
+    # write to a temporary file first so that readers never see a partial file
+    with open(filename + ".tmp", mode="w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(filename + ".tmp", filename)
+
+
+def write_index(directory: str, index: dict[str, dict[str, Any]]) -> None:
+    os.makedirs(cache_directory(directory), exist_ok=True)
+    write_json(os.path.join(cache_directory(directory), INDEX_FILE), index)
+
+
+def lookup(filename: str) -> Optional[CacheEntry]:
+    """
+    Look up the cached version of an image.
+
+    Returns
+    -------
+    CacheEntry, optional
+        the cache entry or None if the image is not cached or has
+        changed since it was cached
+    """
+    directory, basename = os.path.split(os.path.abspath(filename))
+    entry = read_index(directory).get(basename)
+    if entry is None:
+        return None
+
+    try:
+        if file_key(filename) != {"size": entry["size"], "mtime": entry["mtime"]}:
+            return None
+
+        image, sidecar = cache_files(directory, entry["hash"])
+        with open(sidecar, mode="r") as f:
+            metadata = json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if not os.path.isfile(image):
+        return None
+    return CacheEntry(image=image, metadata=metadata)
@@ -0,0 +1,418 @@
+"""
+Lazy access to the pixels of (large) images.
+
+Scans of whole slides can have billions of pixels so that decoding them
+completely exhausts the memory. An `ImageSource` only reads the pixels of a
+requested region at a requested resolution. Tiled and pyramidal TIFF files
+are read segment by segment from the resolution level that fits best and
+uncompressed TIFF files are memory-mapped. Other formats are decoded once
+with OpenCV and served from memory.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+import os
+import threading
+from typing import Optional
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+from PIL import Image
+import tifffile
+
+from .image_cache import file_key, lookup
+
+IMAGE_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
+TIFF_EXTENSIONS = (".tif", ".tiff", ".svs", ".ome.tif", ".ome.tiff")
+
+# length units of pixel sizes in meters (the same units as reported by diplib)
+LENGTH_UNITS = [("m", 1.0), ("mm", 1e-3), ("μm", 1e-6), ("nm", 1e-9)]
+# length of the TIFF resolution units inch and centimeter in meters
+RESOLUTION_UNITS = {2: 0.0254, 3: 0.01}
+
+
+def to_rgb(image: NDArray) -> NDArray:
+    """
+    Convert an image to 8-bit RGB.
+
+    Images that already are 8-bit RGB are returned without a copy.
+    """
+    if image.dtype != np.uint8:
+        if np.issubdtype(image.dtype, np.integer):
+            image = cv.convertScaleAbs(image, alpha=255 / np.iinfo(image.dtype).max)
+        else:
+            image = (np.clip(image, 0.0, 1.0) * 255).astype(np.uint8)
+
+    if image.ndim == 2 or image.shape[2] == 1:
+        return cv.cvtColor(image, cv.COLOR_GRAY2RGB)
+    if image.shape[2] > 3:
+        return np.ascontiguousarray(image[..., :3])
+    return image
+
+
+def fit_region(
+    width: int, height: int, resolution: Optional[tuple[int, int]]
+) -> tuple[int, int]:
+    if resolution is None:
+        return width, height
+    return max(int(resolution[0]), 1), max(int(resolution[1]), 1)
+
+
+class ImageSource:
+    """
+    Base class of image sources.
+
+    An image source provides one or more resolution levels. Level 0 is the
+    full resolution and all coordinates are given in its pixels.
+    """
+
+    def __init__(self, filename: str = "") -> None:
+        self.filename = filename
+        # resolution (width, height) of each level starting with the largest
+        self.levels: list[tuple[int, int]] = []
+
+    @property
+    def resolution(self) -> tuple[int, int]:
+        return self.levels[0]
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory of pixels held by the source (memory-mapped pixels do not count).
+        """
+        return 0
+
+    def level_for(self, downsample: float) -> int:
+        """
+        Get the smallest level whose resolution is not lower than
+        the full resolution divided by `downsample`.
+        """
+        width = self.resolution[0]
+        level = 0
+        for i, (level_width, _) in enumerate(self.levels):
+            if level_width * downsample >= width:
+                level = i
+        return level
+
+    def read(self, resolution: Optional[tuple[int, int]] = None) -> NDArray:
+        """
+        Read the complete image, optionally resized to `resolution` (width, height).
+        """
+        return self.read_region(0, 0, *self.resolution, resolution=resolution)
+
+    def read_region(
+        self,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        resolution: Optional[tuple[int, int]] = None,
+    ) -> NDArray:
+        """
+        Read a region of the image as an RGB image.
+
+        Parameters
+        ----------
+        x, y, width, height: int
+            the region in full resolution coordinates
+        resolution: tuple of int, optional
+            resolution (width, height) the region is resized to
+
+        Returns
+        -------
+        NDArray
+            the region at the requested resolution
+        """
+        out_width, out_height = fit_region(width, height, resolution)
+
+        level = self.level_for(min(width / out_width, height / out_height))
+        level_width, level_height = self.levels[level]
+        scale_x = level_width / self.resolution[0]
+        scale_y = level_height / self.resolution[1]
+
+        x1, y1 = int(x * scale_x), int(y * scale_y)
+        x2 = min(max(round((x + width) * scale_x), x1 + 1), level_width)
+        y2 = min(max(round((y + height) * scale_y), y1 + 1), level_height)
+
+        return to_rgb(
+            self._read_level_region(
+                level, x1, y1, x2 - x1, y2 - y1, (out_width, out_height)
+            )
+        )
+
+    def _read_level_region(
+        self,
+        level: int,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        resolution: tuple[int, int],
+    ) -> NDArray:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def resize(image: NDArray, resolution: tuple[int, int]) -> NDArray:
+    if image.shape[1] == resolution[0] and image.shape[0] == resolution[1]:
+        return image
+
+    # skip rows and columns before resizing so that only a fraction
+    # of a (memory-mapped) image has to be touched
+    step = int(min(image.shape[1] / resolution[0], image.shape[0] / resolution[1]))
+    if step > 1:
+        image = image[::step, ::step]
+
+    return cv.resize(
+        np.ascontiguousarray(image), resolution, interpolation=cv.INTER_AREA
+    )
+
+
+class ArrayImageSource(ImageSource):
+    """
+    Image source of an image in memory.
+    """
+
+    def __init__(self, image: NDArray, filename: str = "") -> None:
+        super().__init__(filename)
+
+        self.image = image
+        self.levels = [image.shape[:2][::-1]]
+
+    @property
+    def nbytes(self) -> int:
+        return self.image.nbytes
+
+    def _read_level_region(self, level, x, y, width, height, resolution):
+        return resize(self.image[y : y + height, x : x + width], resolution)
+
+
+class TiffImageSource(ImageSource):
+    """
+    Image source that reads a TIFF file lazily.
+
+    Uncompressed, contiguous levels are memory-mapped (copy-on-write so that
+    modifications never reach the file). Other levels are read and decoded
+    segment (tile or strip) by segment and only segments which intersect
+    a requested region are touched.
+
+    Closing the source releases its file handle and memory maps. They are
+    opened again if the source is read afterwards, so that a source can be
+    closed (e.g., when it is dropped from a cache) while it is still in use.
+    """
+
+    def __init__(self, filename: str) -> None:
+        super().__init__(filename)
+
+        self._tif = tifffile.TiffFile(filename)
+        self._lock = threading.Lock()
+        self._memmaps: dict[int, np.memmap] = {}
+
+        self._pages = [level.keyframe for level in self._tif.series[0].levels]
+        for page in self._pages:
+            if page.axes not in ("YX", "YXS"):
+                self._tif.close()
+                raise ValueError(
+                    f"Unsupported layout <{page.axes}> of TIFF file {filename}"
+                )
+
+        self.levels = [(page.imagewidth, page.imagelength) for page in self._pages]
+
+        # fail early if the compression is not supported (e.g., codec not installed)
+        if not self._pages[-1].is_memmappable:
+            try:
+                self._read_segment(self._pages[-1], 0)
+            except (ValueError, NotImplementedError) as e:
+                self._tif.close()
+                raise ValueError(f"Unable to decode TIFF file {filename}: {e}")
+
+    def _memmap(self, level: int) -> Optional[np.memmap]:
+        page = self._pages[level]
+        if not page.is_memmappable:
+            return None
+
+        if level not in self._memmaps:
+            self._memmaps[level] = np.memmap(
+                self.filename,
+                dtype=page.dtype.newbyteorder(self._tif.byteorder),
+                mode="c",
+                offset=page.dataoffsets[0],
+                shape=page.shape,
+            )
+        return self._memmaps[level]
+
+    def _read_segment(self, page: tifffile.TiffPage, index: int) -> NDArray:
+        offset, bytecount = page.dataoffsets[index], page.databytecounts[index]
+
+        data = None
+        if offset > 0 and bytecount > 0:
+            with self._lock:
+                filehandle = self._tif.filehandle
+                # re-open the file if the source has been closed
+                filehandle.open()
+                filehandle.seek(offset)
+                data = filehandle.read(bytecount)
+
+        segment, _, shape = page.decode(data, index, jpegtables=page.jpegtables)
+        if segment is None:
+            segment = np.zeros(shape, page.dtype)
+        return segment.reshape(shape[1:3] + page.shape[2:])
+
+    def _read_level_region(self, level, x, y, width, height, resolution):
+        memmap = self._memmap(level)
+        if memmap is not None:
+            return resize(memmap[y : y + height, x : x + width], resolution)
+
+        page = self._pages[level]
+        segment_height, segment_width = page.chunks[:2]
+        n_columns = page.chunked[1]
+
+        out_width, out_height = resolution
+        scale_x, scale_y = out_width / width, out_height / height
+        out = np.zeros((out_height, out_width) + page.shape[2:], page.dtype)
+
+        for row in range(y // segment_height, (y + height - 1) // segment_height + 1):
+            for column in range(
+                x // segment_width, (x + width - 1) // segment_width + 1
+            ):
+                segment = self._read_segment(page, row * n_columns + column)
+                seg_x, seg_y = column * segment_width, row * segment_height
+
+                # intersection of the segment with the region
+                x1, y1 = max(x, seg_x), max(y, seg_y)
+                x2 = min(x + width, seg_x + segment.shape[1])
+                y2 = min(y + height, seg_y + segment.shape[0])
+
+                dx1, dx2 = round((x1 - x) * scale_x), round((x2 - x) * scale_x)
+                dy1, dy2 = round((y1 - y) * scale_y), round((y2 - y) * scale_y)
+                if dx2 <= dx1 or dy2 <= dy1:
+                    continue
+
+                part = segment[y1 - seg_y : y2 - seg_y, x1 - seg_x : x2 - seg_x]
+                out[dy1:dy2, dx1:dx2] = resize(part, (dx2 - dx1, dy2 - dy1)).reshape(
+                    out[dy1:dy2, dx1:dx2].shape
+                )
+
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            self._memmaps.clear()
+            self._tif.close()
+
+
+def list_images(directory: str) -> list[str]:
+    return sorted(
+        os.path.join(directory, f)
+        for f in os.listdir(directory)
+        if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS
+    )
+
+
+def open_image(filename: str, use_cache: bool = True) -> ImageSource:
+    """
+    Open an image file as an image source.
+
+    If the image has been ingested (see `vesseval.ingest`), its cached pyramid
+    is opened instead. TIFF files are read lazily. If this is not possible
+    (e.g., because of an unsupported layout), the image is decoded
+    completely with OpenCV.
+    """
+    entry = lookup(filename) if use_cache else None
+    if entry is not None:
+        return TiffImageSource(entry.image)
+
+    if filename.lower().endswith(TIFF_EXTENSIONS):
+        try:
+            return TiffImageSource(filename)
+        except (tifffile.TiffFileError, ValueError, NotImplementedError):
+            pass
+
+    image = cv.imread(filename)
+    if image is None:
+        raise ValueError(f"Unable to read image {filename}")
+    return ArrayImageSource(cv.cvtColor(image, cv.COLOR_BGR2RGB), filename=filename)
+
+
+def to_length_unit(length: float) -> tuple[float, str]:
+    """
+    Express a length in meters with an SI prefix.
+
+    Like diplib, the prefix is chosen so that the magnitude is in [0.1, 100).
+    """
+    thousands = int(np.floor(np.log10(length) / 3 + 1 / 3))
+    unit, factor = LENGTH_UNITS[min(max(-thousands, 0), len(LENGTH_UNITS) - 1)]
+    return length / factor, unit
+
+
+def tiff_pixel_size(page: tifffile.TiffPage) -> tuple[float, float, str]:
+    """
+    Get the pixel size of a TIFF page from its resolution tags.
+    """
+    if "XResolution" not in page.tags:
+        return 1.0, 1.0, "px"
+
+    x_numerator, x_denominator = page.tags["XResolution"].value
+    y_numerator, y_denominator = page.tags.get(
+        "YResolution", page.tags["XResolution"]
+    ).value
+    size_x = x_denominator / x_numerator
+    size_y = y_denominator / y_numerator
+
+    resolution_unit = page.tags.get("ResolutionUnit")
+    unit_length = RESOLUTION_UNITS.get(
+        int(resolution_unit.value) if resolution_unit is not None else 2
+    )
+    if unit_length is None:
+        return size_x, size_y, "px"
+
+    size_x, unit = to_length_unit(size_x * unit_length)
+    size_y = size_y * unit_length / dict(LENGTH_UNITS)[unit]
+    return size_x, size_y, unit
+
+
+@lru_cache(maxsize=256)
+def _read_pixel_size(filename: str, size: int, mtime: int) -> tuple[float, float, str]:
+    # size and modification time are part of the key so that
+    # changed files are read again
+    if filename.lower().endswith(TIFF_EXTENSIONS):
+        try:
+            with tifffile.TiffFile(filename) as tif:
+                return tiff_pixel_size(tif.pages[0])
+        except tifffile.TiffFileError:
+            pass
+
+    with Image.open(filename) as image:
+        dpi = image.info.get("dpi")
+    if dpi is None:
+        return 1.0, 1.0, "px"
+
+    size_x, unit = to_length_unit(RESOLUTION_UNITS[2] / float(dpi[0]))
+    size_y = RESOLUTION_UNITS[2] / float(dpi[1]) / dict(LENGTH_UNITS)[unit]
+    return size_x, size_y, unit
+
+
+def read_pixel_size(filename: str, use_cache: bool = True) -> tuple[float, float, str]:
+    """
+    Read the pixel size of an image file.
+
+    Only the header of the file is parsed (no pixel data is decoded) and the
+    result is cached per file. The pixel size of an ingested image is read
+    from its sidecar.
+
+    Returns
+    -------
+    tuple of float, float, str
+        the pixel size in x and y and its unit
+    """
+    entry = lookup(filename) if use_cache else None
+    if entry is not None:
+        pixel_size_x, pixel_size_y, pixel_unit = entry.metadata["pixel_size"]
+        return pixel_size_x, pixel_size_y, pixel_unit
+
+    key = file_key(filename)
+    return _read_pixel_size(os.path.abspath(filename), key["size"], key["mtime"])
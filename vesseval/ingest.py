@@ -0,0 +1,162 @@
+"""
+Ingest a directory of images into the image cache.
+
+Each image is decoded once and written as a tiled, pyramidal TIFF file
+together with a sidecar of its metadata (see `image_cache`). Afterwards,
+the GUI, batch processing and evaluation only read the tiles and levels
+they need. Images are processed in parallel and images whose content
+is already cached are skipped.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+from typing import Any
+
+import cv2 as cv
+from numpy.typing import NDArray
+import tifffile
+
+from .image_cache import (
+    cache_directory,
+    cache_files,
+    content_hash,
+    file_key,
+    read_index,
+    write_index,
+    write_json,
+)
+from .image_source import list_images, open_image, read_pixel_size
+
+# levels are halved until the image fits this size
+# (the internal resolution of the SAM app)
+MIN_LEVEL_SIZE = 1024
+
+
+def build_levels(image: NDArray, min_size: int = MIN_LEVEL_SIZE) -> list[NDArray]:
+    """
+    Build a pyramid of an image by halving its resolution until it fits `min_size`.
+    """
+    levels = [image]
+    while max(levels[-1].shape[:2]) > min_size:
+        height, width = levels[-1].shape[:2]
+        levels.append(
+            cv.resize(
+                levels[-1],
+                ((width + 1) // 2, (height + 1) // 2),
+                interpolation=cv.INTER_AREA,
+            )
+        )
+    return levels
+
+
+def write_pyramid(filename: str, levels: list[NDArray], tile_size: int) -> None:
+    """
+    Write levels as a tiled TIFF file with the reduced levels as sub-images.
+    """
+    options = {
+        "tile": (tile_size, tile_size),
+        "compression": "zlib",
+        "photometric": "rgb",
+    }
+    with tifffile.TiffWriter(
+        filename + ".tmp", bigtiff=levels[0].nbytes >= 2**31
+    ) as tif:
+        tif.write(levels[0], subifds=len(levels) - 1, **options)
+        for level in levels[1:]:
+            tif.write(level, subfiletype=1, **options)
+    os.replace(filename + ".tmp", filename)
+
+
+def ingest_image(filename: str, tile_size: int = 256) -> tuple[str, bool]:
+    """
+    Add an image to the cache of its directory.
+
+    Returns
+    -------
+    tuple of str, bool
+        the hash of the image content and if a new cache entry was created
+    """
+    digest = content_hash(filename)
+    pyramid, sidecar = cache_files(os.path.dirname(os.path.abspath(filename)), digest)
+    if os.path.isfile(pyramid) and os.path.isfile(sidecar):
+        return digest, False
+
+    image_source = open_image(filename, use_cache=False)
+    levels = build_levels(image_source.read())
+    image_source.close()
+
+    pixel_size_x, pixel_size_y, pixel_unit = read_pixel_size(filename, use_cache=False)
+
+    write_pyramid(pyramid, levels, tile_size)
+    write_json(
+        sidecar,
+        {
+            "filename": os.path.basename(filename),
+            "resolution": list(levels[0].shape[:2][::-1]),
+            "levels": [list(level.shape[:2][::-1]) for level in levels],
+            "pixel_size": [pixel_size_x, pixel_size_y, str(pixel_unit)],
+        },
+    )
+    return digest, True
+
+
+def _ingest_image(filename: str, tile_size: int) -> tuple[str, Any, Any]:
+    try:
+        return filename, *ingest_image(filename, tile_size)
+    except Exception as e:
+        return filename, None, f"{type(e).__name__}: {e}"
+
+
+def run_ingest(
+    directory: str, n_workers: int = os.cpu_count(), tile_size: int = 256
+) -> None:
+    """
+    Ingest all images of a directory with a pool of workers.
+
+    Images which are unchanged since they were indexed are skipped
+    without hashing them again. The tile size has to be a positive
+    multiple of 16 as required by TIFF.
+    """
+    if tile_size <= 0 or tile_size % 16 != 0:
+        raise ValueError(f"Tile size has to be a positive multiple of 16: {tile_size}")
+
+    filenames = list_images(directory)
+    if len(filenames) == 0:
+        print(f"No images found in {directory}")
+        return
+
+    os.makedirs(cache_directory(directory), exist_ok=True)
+    index = read_index(directory)
+
+    pending = []
+    for filename in filenames:
+        entry = index.get(os.path.basename(filename))
+        if entry is not None and file_key(filename) == {
+            "size": entry["size"],
+            "mtime": entry["mtime"],
+        }:
+            pyramid, sidecar = cache_files(directory, entry["hash"])
+            if os.path.isfile(pyramid) and os.path.isfile(sidecar):
+                continue
+        pending.append(filename)
+    print(f"{len(filenames) - len(pending)} of {len(filenames)} images are cached")
+
+    since = time.time()
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = [
+            executor.submit(_ingest_image, filename, tile_size) for filename in pending
+        ]
+        for future in as_completed(futures):
+            filename, digest, created = future.result()
+            if digest is None:
+                print(f"Ingesting {filename} failed: {created}")
+                continue
+
+            index[os.path.basename(filename)] = {"hash": digest, **file_key(filename)}
+            # the index is written after each image so that an interrupted
+            # run is not lost
+            write_index(directory, index)
+            print(f"{'Ingested' if created else 'Found cached'} {filename}")
+
+    print(f"Ingested {len(pending)} images in {time.time() - since:.1f}s")
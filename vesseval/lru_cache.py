@@ -0,0 +1,181 @@
+"""
+A least recently used cache bounded by the memory of its values.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+
+def nbytes(value: Any) -> int:
+    """
+    Estimate the memory of a value in bytes.
+
+    Arrays and tensors report their `nbytes`, containers are traversed and
+    everything else is counted as zero. Objects referenced multiple times
+    are only counted once.
+    """
+    seen = set()
+
+    def _nbytes(_value: Any) -> int:
+        if id(_value) in seen:
+            return 0
+        seen.add(id(_value))
+
+        if isinstance(_value, dict):
+            return sum(map(_nbytes, _value.values()))
+        if isinstance(_value, (list, tuple)):
+            return sum(map(_nbytes, _value))
+
+        size = getattr(_value, "nbytes", 0)
+        return size if isinstance(size, int) else 0
+
+    return _nbytes(value)
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    entries: int
+    bytes: int
+    max_bytes: int
+
+    def __str__(self) -> str:
+        requests = max(self.hits + self.misses, 1)
+        return (
+            f"{self.entries} entries, {self.bytes / 1024**2:.1f}"
+            f" of {self.max_bytes / 1024**2:.1f} MiB,"
+            f" {self.hits} hits, {self.misses} misses"
+            f" ({100 * self.hits / requests:.0f}% hit rate)"
+        )
+
+
+class LRUCache:
+    """
+    Cache that drops the least recently used values once the memory
+    of all values exceeds `max_bytes` (or it holds more than `max_entries`).
+
+    The cache can be used by multiple threads.
+
+    Parameters
+    ----------
+    max_bytes: int
+        memory budget of the cache in bytes
+    size_of: callable
+        function estimating the memory of a value in bytes
+    max_entries: int, optional
+        maximum number of values
+    on_evict: callable, optional
+        function called with the key and value of each value the cache drops
+        (because of its budget, a replacement or `clear`, but not `pop`),
+        e.g., to release resources held by the value
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        size_of: Callable[[Any], int] = nbytes,
+        max_entries: Optional[int] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ) -> None:
+        self.max_bytes = max_bytes
+        self.size_of = size_of
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+
+        self._values: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._values
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get a value (and mark it as recently used) or None if it is not cached.
+        """
+        with self._lock:
+            if key not in self._values:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            self._values.move_to_end(key)
+            return self._values[key][0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Add a value to the cache.
+
+        Values larger than the memory budget are not cached.
+        """
+        size = self.size_of(value)
+        with self._lock:
+            evicted = self._remove(key)
+            if size <= self.max_bytes:
+                self._values[key] = (value, size)
+                self._bytes += size
+                evicted.extend(self._evict())
+        self._on_evict([item for item in evicted if item[1] is not value])
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            value = self._values[key][0] if key in self._values else None
+            self._remove(key)
+            return value
+
+    def _remove(self, key: Hashable) -> list[tuple[Hashable, Any]]:
+        if key not in self._values:
+            return []
+
+        value, size = self._values.pop(key)
+        self._bytes -= size
+        return [(key, value)]
+
+    def resize(self, max_bytes: int) -> None:
+        """
+        Change the memory budget and drop values until it is met.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            evicted = self._evict()
+        self._on_evict(evicted)
+
+    def _evict(self) -> list[tuple[Hashable, Any]]:
+        evicted = []
+        while self._bytes > self.max_bytes or (
+            self.max_entries is not None and len(self._values) > self.max_entries
+        ):
+            evicted.extend(self._remove(next(iter(self._values))))
+        return evicted
+
+    def _on_evict(self, evicted: list[tuple[Hashable, Any]]) -> None:
+        # called without holding the lock so that the hook may use the cache
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            evicted = [(key, value) for key, (value, _) in self._values.items()]
+            self._values.clear()
+            self._bytes = 0
+        self._on_evict(evicted)
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                entries=len(self._values),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+            )
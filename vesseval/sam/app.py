@@ -2,20 +2,30 @@ import cv2 as cv
 import tkinter as tk
 
 from ..state import PointState, BoundingBoxState
-from ..widgets.canvas import Image, Circle, CircleState, BoundingBox
+from ..state.processing import SCHEDULER
+from ..widgets.canvas import Image, Circle, CircleState, BoundingBox, ZoomPan
 
 from .menu import MenuBar
 from .mode import PointMode, BoxMode, GridMode
+from .overlay import RegionOverlay, RegionOverlayState
 from .region import RegionView
-from .state import app_state, RegionState
+from .state import app_state, RegionState, IMAGE_PREDICTOR
 from .toolbar import Toolbar
+from .worklist import worklist
+
+TITLE = "VessEval - SAM"
+# interval in milliseconds in which the embedding status is shown in the title
+STATUS_INTERVAL = 250
+
 
 class App(tk.Tk):
 
     def __init__(self):
         super().__init__()
-        self.title("VessEval - SAM")
+        self.title(TITLE)
         self.configure(bg="#757575")
+        # results of background computations are delivered on the GUI thread
+        SCHEDULER.attach(self)
 
         self.state = app_state
 
@@ -41,10 +51,25 @@ class App(tk.Tk):
         self.grid_mode = GridMode(self.canvas, self.toolbar.state.grid_mode)
 
         self.image = Image(self.canvas, app_state.display_image)
+        self.zoom_pan = ZoomPan(self.canvas, app_state.display_image)
+        self.region_overlay = RegionOverlay(
+            self.canvas,
+            RegionOverlayState(
+                app_state.regions,
+                app_state.selected_region_index,
+                app_state.display_image,
+            ),
+            self.image,
+        )
 
         self.fg_circle = None
         self.bg_circles = []
         self.fg_box = None
+        # functions moving the markers of the selected region to their display
+        # coordinates - they are called if the view changes
+        self.fg_updates = []
+        self.bg_updates = []
+        app_state.display_image.view.on_change(lambda _: self.update_markers())
 
         self.state.selected_region_index.on_change(lambda _: self.on_select_region())
 
@@ -52,6 +77,21 @@ class App(tk.Tk):
         self.region_view.grid(row=1, column=1, sticky="nswe")
 
         self.bind("<Key-q>", lambda event: exit(0))
+        self.bind("<Next>", lambda event: worklist.next())
+        self.bind("<Prior>", lambda event: worklist.previous())
+
+        self.update_status()
+
+    def update_status(self):
+        # the embedding is computed in the background - show while it is not ready
+        status = IMAGE_PREDICTOR.embedding_status()
+        if status.ready:
+            self.title(TITLE)
+        elif status.done:
+            self.title(f"{TITLE} (computing embedding failed)")
+        else:
+            self.title(f"{TITLE} (computing embedding ...)")
+        self.after(STATUS_INTERVAL, self.update_status)
 
     def on_select_region(self):
         self.clear_selected_region_markers()
@@ -67,8 +107,13 @@ class App(tk.Tk):
             lambda _: self.redraw_background_points(), trigger=True
         )
 
+    def update_markers(self):
+        for update in self.fg_updates + self.bg_updates:
+            update()
+
     def clear_selected_region_markers(self):
         # clear markers
+        self.fg_updates.clear()
         if self.fg_circle is not None:
             self.fg_circle.delete()
             self.fg_circle = None
@@ -80,6 +125,7 @@ class App(tk.Tk):
         self.clear_background_circles()
 
     def clear_background_circles(self):
+        self.bg_updates.clear()
         for circle in self.bg_circles:
             circle.delete()
         self.bg_circles.clear()
@@ -87,12 +133,13 @@ class App(tk.Tk):
     def draw_foregound_circle(self, selected_region: RegionState) -> None:
         # initialize position of circle and react to selected_region changes
         circle_center = PointState(0, 0)
-        selected_region.foreground_point.on_change(
-            lambda state: circle_center.set(
-                *self.state.display_image.to_display(*state.values())
-            ),
-            trigger=True,
+        update = lambda *_: circle_center.set(
+            *self.state.display_image.to_display(
+                *selected_region.foreground_point.values()
+            )
         )
+        selected_region.foreground_point.on_change(update, trigger=True)
+        self.fg_updates.append(update)
 
         # draw circle
         self.fg_circle = Circle(
@@ -121,18 +168,23 @@ class App(tk.Tk):
         # initialize bounding box and react to selected_region changes
         top_left = PointState(0, 0)
         bottom_right = PointState(0, 0)
+        update_top_left = lambda *_: top_left.set(
+            *self.state.display_image.to_display(
+                *selected_region.foreground_box.top_left().values()
+            )
+        )
+        update_bottom_right = lambda *_: bottom_right.set(
+            *self.state.display_image.to_display(
+                *selected_region.foreground_box.bottom_right().values()
+            )
+        )
         selected_region.foreground_box.top_left().on_change(
-            lambda state: top_left.set(
-                *self.state.display_image.to_display(*state.values())
-            ),
-            trigger=True,
+            update_top_left, trigger=True
         )
         selected_region.foreground_box.bottom_right().on_change(
-            lambda state: bottom_right.set(
-                *self.state.display_image.to_display(*state.values())
-            ),
-            trigger=True,
+            update_bottom_right, trigger=True
         )
+        self.fg_updates.extend([update_top_left, update_bottom_right])
 
         self.fg_box = BoundingBox(
             self.canvas,
@@ -178,12 +230,11 @@ class App(tk.Tk):
         selected_region = self.state.regions[self.state.selected_region_index.value]
         for i, background_point in enumerate(selected_region.background_points):
             circle_center = PointState(0, 0)
-            background_point.on_change(
-                lambda state: circle_center.set(
-                    *self.state.display_image.to_display(*state.values())
-                ),
-                trigger=True,
+            update = lambda *_, point=background_point, center=circle_center: (
+                center.set(*self.state.display_image.to_display(*point.values()))
             )
+            background_point.on_change(update, trigger=True)
+            self.bg_updates.append(update)
 
             background_circle = Circle(
                 self.canvas,
@@ -0,0 +1,169 @@
+"""
+Batch segmentation and evaluation of many images.
+
+The SAM model is loaded once in the parent process. Afterwards, worker
+processes are forked so that they share the model weights copy-on-write.
+Each worker handles whole images (embedding, grid decoding and evaluation)
+and limits the number of threads torch uses. This way, throughput scales with
+the number of cores instead of relying on intra-op threading of a single predictor.
+
+Note: forking requires a POSIX system. The parent must not run inference
+before forking because the OpenMP thread pool of torch does not survive a fork.
+"""
+
+import multiprocessing as mp
+import os
+import time
+from typing import Any, Optional
+
+import numpy as np
+
+from ..image_source import list_images, open_image, read_pixel_size
+from .evaluation import TABLE_KEYS, eval_contours, table_to_rows
+from .util import fit_resolution
+
+# the predictor is created in the parent and inherited by forked workers
+_PREDICTOR = None
+
+
+def private_memory() -> int:
+    """
+    Get the memory (in bytes) that is private to the current process.
+
+    Memory shared copy-on-write with the parent (e.g., the model weights)
+    is not counted.
+    """
+    try:
+        with open("/proc/self/smaps_rollup", mode="r") as f:
+            fields = dict(
+                (line.split(":")[0], line.split()[1]) for line in f if ":" in line
+            )
+        return (int(fields["Private_Clean"]) + int(fields["Private_Dirty"])) * 1024
+    except (OSError, KeyError):
+        return 0
+
+
+def grid_points(width: int, height: int, n_points: int) -> list[tuple[int, int]]:
+    """
+    Create a regular grid of prompt points inside an image.
+    """
+    xs = np.linspace(0, width, n_points + 2)[1:-1].round().astype(int).tolist()
+    ys = np.linspace(0, height, n_points + 2)[1:-1].round().astype(int).tolist()
+    return [(x, y) for y in ys for x in xs]
+
+
+def init_worker(n_threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(n_threads)
+
+
+def process_image(
+    filename: str, n_points: int = 10, max_size: int = 1024
+) -> tuple[dict[str, list[Any]], dict[str, Any]]:
+    """
+    Segment an image with a grid of prompts and evaluate the resulting regions.
+
+    Returns
+    -------
+    tuple of dict, dict
+        the table of measures and statistics of the worker
+    """
+    since = time.time()
+
+    image_source = open_image(filename)
+    original_resolution = image_source.resolution
+    image = image_source.read(fit_resolution(original_resolution, max_size))
+    image_source.close()
+
+    _PREDICTOR.set_image(image)
+    _, contours = _PREDICTOR.predict_multiple_as_contour(
+        grid_points(image.shape[1], image.shape[0], n_points)
+    )
+
+    table = eval_contours(
+        contours,
+        image_shape=image.shape,
+        original_resolution=original_resolution,
+        pixel_size=read_pixel_size(filename),
+        filename=filename,
+    )
+    stats = {
+        "pid": os.getpid(),
+        "private_memory": private_memory(),
+        "duration": time.time() - since,
+    }
+    return table, stats
+
+
+def _process_image(args: tuple[str, int, int]) -> tuple[str, Any, Any]:
+    filename = args[0]
+    try:
+        return filename, *process_image(*args)
+    except Exception as e:
+        return filename, None, f"{type(e).__name__}: {e}"
+
+
+def run_batch(
+    directory: str,
+    n_workers: int = os.cpu_count(),
+    n_threads: int = 1,
+    n_points: int = 10,
+    output: Optional[str] = None,
+) -> None:
+    """
+    Segment and evaluate all images in a directory with a pool of workers.
+
+    Measures are written as tab-separated rows to `output` (or printed) and
+    per-worker memory overhead and the throughput are reported.
+    """
+    global _PREDICTOR
+    from .sam import ImagePredictor
+
+    filenames = list_images(directory)
+    if len(filenames) == 0:
+        print(f"No images found in {directory}")
+        return
+
+    # load the model before forking so that its weights are shared - embeddings
+    # are not cached because each image is embedded once by a single worker
+    _PREDICTOR = ImagePredictor(cache_embeddings=False, prefetch=False)
+    _PREDICTOR.init_thread.join()
+
+    rows = []
+    worker_memory: dict[int, int] = {}
+    n_processed = 0
+
+    since = time.time()
+    context = mp.get_context("fork")
+    with context.Pool(
+        n_workers, initializer=init_worker, initargs=(n_threads,)
+    ) as pool:
+        tasks = [(filename, n_points, 1024) for filename in filenames]
+        for filename, table, stats in pool.imap_unordered(_process_image, tasks):
+            if table is None:
+                print(f"Processing {filename} failed: {stats}")
+                continue
+
+            rows.extend(table_to_rows(table))
+            n_processed += 1
+            worker_memory[stats["pid"]] = max(
+                worker_memory.get(stats["pid"], 0), stats["private_memory"]
+            )
+            print(
+                f"Processed {filename} in {stats['duration']:.1f}s "
+                f"({len(table['index'])} regions)"
+            )
+    duration = time.time() - since
+
+    txt = "\n".join(["\t".join(TABLE_KEYS), *rows])
+    if output is None:
+        print(txt)
+    else:
+        with open(output, mode="w") as f:
+            f.write(txt + "\n")
+
+    print()
+    print(f"Images/minute: {n_processed / duration * 60:.1f}")
+    for pid, memory in sorted(worker_memory.items()):
+        print(f"Worker {pid}: {memory / 1024**2:.1f} MiB private memory")
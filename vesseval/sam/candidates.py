@@ -0,0 +1,125 @@
+"""
+Coarse detection of vessel candidates on a whole slide.
+
+Instead of prompting the SAM model with a dense grid, a cheap pass over a
+low resolution version of the slide proposes candidate locations. A vessel
+shows up as a lumen - a bright, roughly round blob enclosed by tissue - that
+is surrounded by a ring of stained wall. Only these candidates are passed
+as prompts to the SAM model.
+"""
+
+from dataclasses import dataclass
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+
+from .util import fit_resolution
+
+
+@dataclass
+class Candidate:
+    """
+    A vessel candidate in image coordinates.
+
+    The box encloses the lumen and its surrounding wall.
+    """
+
+    point: tuple[int, int]
+    box: tuple[int, int, int, int]
+    score: float
+
+
+def detect_vessel_candidates(
+    image: NDArray,
+    max_size: int = 512,
+    min_area: float = 0.00005,
+    max_area: float = 0.05,
+    min_circularity: float = 0.3,
+    min_wall_ratio: float = 0.5,
+) -> list[Candidate]:
+    """
+    Detect vessel candidates in an RGB image.
+
+    Parameters
+    ----------
+    image: NDArray
+        the image to be searched
+    max_size: int
+        the image is downscaled to this size for detection
+    min_area: float
+        minimal area of a lumen relative to the image area
+    max_area: float
+        maximal area of a lumen relative to the image area
+    min_circularity: float
+        minimal circularity (4*pi*area/perimeter²) of a lumen
+    min_wall_ratio: float
+        minimal ratio of tissue pixels in a ring around a lumen
+
+    Returns
+    -------
+    list of Candidate
+        candidates sorted by their score (best first)
+    """
+    width, height = fit_resolution(image.shape[:2][::-1], max_size)
+    scale = image.shape[1] / width
+
+    small = cv.resize(image, (width, height), interpolation=cv.INTER_AREA)
+    gray = cv.cvtColor(small, cv.COLOR_RGB2GRAY)
+    gray = cv.GaussianBlur(gray, (5, 5), 0)
+
+    # tissue is darker than lumens and the background
+    _, tissue = cv.threshold(gray, 0, 255, cv.THRESH_BINARY_INV + cv.THRESH_OTSU)
+    tissue = cv.morphologyEx(tissue, cv.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+
+    # lumens are bright components which are enclosed by tissue
+    n_labels, labels, stats, centroids = cv.connectedComponentsWithStats(
+        cv.bitwise_not(tissue), connectivity=4
+    )
+
+    candidates = []
+    for label in range(1, n_labels):
+        x, y, w, h, area = stats[label]
+
+        # components touching the border belong to the background
+        if x == 0 or y == 0 or x + w >= width or y + h >= height:
+            continue
+
+        if not (min_area * width * height <= area <= max_area * width * height):
+            continue
+
+        lumen = (labels[y : y + h, x : x + w] == label).astype(np.uint8)
+        cnts, _ = cv.findContours(lumen, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
+        perimeter = cv.arcLength(max(cnts, key=cv.contourArea), closed=True)
+        circularity = 4 * np.pi * area / max(perimeter**2, 1e-6)
+        if circularity < min_circularity:
+            continue
+
+        # the wall is a ring of tissue around the lumen
+        thickness = max(round(0.5 * np.sqrt(area / np.pi)), 2)
+        x1, y1 = max(x - thickness, 0), max(y - thickness, 0)
+        x2, y2 = min(x + w + thickness, width), min(y + h + thickness, height)
+
+        lumen_region = (labels[y1:y2, x1:x2] == label).astype(np.uint8)
+        ring = cv.dilate(lumen_region, np.ones((2 * thickness + 1,) * 2, np.uint8))
+        ring[lumen_region > 0] = 0
+        n_ring = max(int(ring.sum()), 1)
+        wall_ratio = (tissue[y1:y2, x1:x2][ring > 0] > 0).sum() / n_ring
+        if wall_ratio < min_wall_ratio:
+            continue
+
+        cx, cy = centroids[label]
+        candidates.append(
+            Candidate(
+                point=(round(cx * scale), round(cy * scale)),
+                box=(
+                    round(x1 * scale),
+                    round(y1 * scale),
+                    round(x2 * scale),
+                    round(y2 * scale),
+                ),
+                score=float(circularity * wall_ratio),
+            )
+        )
+
+    return sorted(candidates, key=lambda candidate: candidate.score, reverse=True)
@@ -0,0 +1,149 @@
+"""
+Evaluation of region statistics.
+
+The functions are independent of the app state so that they can
+be used by the GUI and by batch processing.
+"""
+
+from typing import Any, Optional
+
+import cv2 as cv
+import diplib as dip
+import numpy as np
+from numpy.typing import NDArray
+
+TABLE_KEYS = [
+    "index",
+    "category",
+    "area",
+    "perimeter",
+    "cut_off",
+    "roundness",
+    "circularity",
+    "feret_max",
+    "feret_min",
+    "feret_perp_min",
+    "feret_max_angle",
+    "feret_min_angle",
+    "filename",
+]
+
+
+def eval_contours(
+    contours: list[NDArray],
+    image_shape: tuple[int, ...],
+    original_resolution: tuple[int, int],
+    pixel_size: tuple[float, float, str],
+    filename: str,
+    categories: Optional[list[Optional[str]]] = None,
+    refined_contours: Optional[list[Optional[NDArray]]] = None,
+) -> dict[str, list[Any]]:
+    """
+    Measure regions defined by contours.
+
+    Parameters
+    ----------
+    contours: list of NDArray
+        contours of the regions in the coordinates of the processed image
+    image_shape: tuple of int
+        shape of the processed image
+    original_resolution: tuple of int
+        width and height of the original image
+    pixel_size: tuple of float, float, str
+        pixel size in x and y and its unit
+    filename: str
+        filename of the image added to each row
+    categories: list of str, optional
+        category of each region
+    refined_contours: list of NDArray, optional
+        contours in original image coordinates used instead of
+        the scaled contours for regions that have been refined
+
+    Returns
+    -------
+    dict[str, list]
+        table of measures with one row per contour
+    """
+    categories = categories if categories is not None else [None] * len(contours)
+    refined_contours = (
+        refined_contours if refined_contours is not None else [None] * len(contours)
+    )
+    width, height = original_resolution
+    pixel_size_x, pixel_size_y, pixel_unit = pixel_size
+
+    scale_y = height / image_shape[0]
+    scale_x = width / image_shape[1]
+
+    table = dict([(key, []) for key in TABLE_KEYS])
+    for i, contour in enumerate(contours, start=1):
+        cut_off_min = (contour <= 0).any()
+        cut_off_max_x = (contour[:, 0].max() >= (image_shape[1] - 1)).any()
+        cut_off_max_y = (contour[:, 1].max() >= (image_shape[0] - 1)).any()
+        cut_off = cut_off_min or cut_off_max_x or cut_off_max_y
+
+        if refined_contours[i - 1] is not None:
+            contour = refined_contours[i - 1]
+        else:
+            contour[:, 0] = np.rint(contour[:, 0] * scale_x)
+            contour[:, 1] = np.rint(contour[:, 1] * scale_y)
+
+        # the region is drawn into an image of its bounding box (with a border of
+        # one pixel) instead of an image of the original (possibly huge) size
+        x, y, w, h = cv.boundingRect(contour.astype(np.int32))
+        x1, y1 = max(x - 1, 0), max(y - 1, 0)
+        x2, y2 = min(x + w + 1, width), min(y + h + 1, height)
+
+        label = 1
+        label_img = np.zeros((max(y2 - y1, 1), max(x2 - x1, 1)), dtype=np.uint8)
+        label_img = cv.drawContours(
+            label_img,
+            [contour.astype(np.int32)],
+            contourIdx=-1,
+            color=label,
+            thickness=-1,
+            offset=(-x1, -y1),
+        )
+
+        # convert image to dip and configure pixel size
+        _img = dip.Image(label_img)
+        _img.SetPixelSize(
+            dip.PixelSize(
+                (
+                    pixel_size_x * dip.PhysicalQuantity(pixel_unit),
+                    pixel_size_y * dip.PhysicalQuantity(pixel_unit),
+                )
+            )
+        )
+        label_img = dip.Label(_img > 0)
+
+        measures = dip.MeasurementTool.Measure(
+            label_img,
+            features=["Size", "Perimeter", "Feret", "Roundness", "Circularity"],
+        )
+
+        table["filename"].append(filename)
+        table["index"].append(i)
+        table["category"].append(categories[i - 1])
+        table["area"].append(measures[label]["Size"][0])
+        table["perimeter"].append(measures[label]["Perimeter"][0])
+        table["cut_off"].append(cut_off)
+        table["roundness"].append(measures[label]["Roundness"][0])
+        table["circularity"].append(measures[label]["Circularity"][0])
+        table["feret_max"].append(measures[label]["Feret"][0])
+        table["feret_min"].append(measures[label]["Feret"][1])
+        table["feret_perp_min"].append(measures[label]["Feret"][2])
+        table["feret_max_angle"].append(measures[label]["Feret"][3])
+        table["feret_min_angle"].append(measures[label]["Feret"][4])
+
+    return table
+
+
+def table_to_rows(table: dict[str, list[Any]]) -> list[str]:
+    """
+    Format a table of measures as tab-separated rows (e.g., to paste into Excel).
+    """
+    rows = []
+    for i in range(len(table["filename"])):
+        row = list(map(lambda key: str(table[key][i]), table.keys()))
+        rows.append("\t".join(row))
+    return rows
@@ -0,0 +1,192 @@
+"""
+Scheduling of the work of the SAM predictor.
+
+Embeddings
+----------
+Every change of the displayed image (e.g., opening a document or adding a
+preprocessing stage) requests a new embedding. Running the encoder for each
+of them wastes seconds of CPU on images which are not displayed anymore.
+Therefore, images are submitted to a single background thread and an image
+submitted while another one waits replaces it ("latest wins"). Each image is
+identified by a version so that predictions can wait for the embedding of
+the latest image.
+
+Priorities
+----------
+Interactive requests (e.g., the contour of a region whose prompt is moved)
+and bulk work (e.g., grid predictions and refinement) share the predictor.
+Bulk work is split into small requests and all requests acquire the predictor
+with a `PriorityLock`. Thus, an interactive request only waits for the
+current chunk of a bulk job, which resumes afterwards.
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+import heapq
+import itertools
+import threading
+from typing import Any, Callable, Iterator, Optional
+
+# priorities of requests - lower values are served first
+INTERACTIVE = 0
+BULK = 1
+
+
+@dataclass
+class EmbeddingStatus:
+    # version of the latest submitted image
+    version: int
+    # version of the latest image whose embedding is done
+    embedded_version: int
+    # number of images which were replaced before they were embedded
+    skipped: int
+    # error if computing the embedding of the latest embedded image failed
+    error: Optional[str] = None
+
+    @property
+    def done(self) -> bool:
+        return self.embedded_version == self.version
+
+    @property
+    def ready(self) -> bool:
+        return self.done and self.error is None
+
+    def __str__(self) -> str:
+        if not self.done:
+            state = "computing"
+        else:
+            state = "ready" if self.error is None else f"failed ({self.error})"
+        return (
+            f"embedding {state} (version {self.embedded_version} of {self.version},"
+            f" {self.skipped} skipped)"
+        )
+
+
+class EmbeddingJobs:
+    """
+    Run `embed` for the latest submitted arguments in a background thread.
+
+    Parameters
+    ----------
+    embed: callable
+        function computing the embedding of an image
+    name: str
+        name of the background thread
+    """
+
+    def __init__(self, embed: Callable[..., Any], name: str = "Embed Image") -> None:
+        self.embed = embed
+        self.name = name
+
+        self.version = 0
+        self.embedded_version = 0
+        self.skipped = 0
+        self.error: Optional[str] = None
+
+        self._pending: Optional[tuple[int, tuple, dict]] = None
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def superseded(self) -> bool:
+        """
+        If a newer image is waiting - a running job can stop early.
+        """
+        return self._pending is not None
+
+    def submit(self, *args: Any, **kwargs: Any) -> int:
+        """
+        Request the embedding of an image and replace a waiting request.
+
+        Returns
+        -------
+        int
+            the version of the image
+        """
+        with self._condition:
+            if self._pending is not None:
+                self.skipped += 1
+
+            self.version += 1
+            self._pending = (self.version, args, kwargs)
+            self._condition.notify_all()
+
+            # started lazily (and again after a fork) because threads are not inherited
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._thread.start()
+            return self.version
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                version, args, kwargs = self._pending
+                self._pending = None
+
+            error = None
+            try:
+                self.embed(*args, **kwargs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Computing the embedding failed: {error}")
+
+            with self._condition:
+                self.embedded_version = version
+                self.error = error
+                self._condition.notify_all()
+
+    def wait(self) -> None:
+        """
+        Wait until the embedding of the latest image is done (or failed).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.embedded_version == self.version)
+
+    def status(self) -> EmbeddingStatus:
+        with self._condition:
+            return EmbeddingStatus(
+                version=self.version,
+                embedded_version=self.embedded_version,
+                skipped=self.skipped,
+                error=self.error,
+            )
+
+
+class PriorityLock:
+    """
+    Lock that is passed to waiting threads in the order of their priority.
+
+    Threads with the same priority acquire the lock in the order of their arrival.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._locked = False
+        self._waiting: list[tuple[int, int]] = []
+        self._tickets = itertools.count()
+
+    def acquire(self, priority: int = INTERACTIVE) -> None:
+        with self._condition:
+            entry = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, entry)
+            self._condition.wait_for(
+                lambda: not self._locked and self._waiting[0] == entry
+            )
+            heapq.heappop(self._waiting)
+            self._locked = True
+
+    def release(self) -> None:
+        with self._condition:
+            self._locked = False
+            self._condition.notify_all()
+
+    @contextmanager
+    def hold(self, priority: int = INTERACTIVE) -> Iterator[None]:
+        self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
@@ -3,19 +3,34 @@ Components of the menu bar.
 """
 
 import os
+from threading import Thread
 import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 
-import cv2 as cv
-import numpy as np
-from widget_state import StringState
+from widget_state import BoolState, IntState, StringState
 
+from ..lru_cache import CacheStats
+from ..state.processing import BLOCKING_SCHEDULER, SCHEDULER
+from ..state.profiler import PROFILER
 from ..state.util import to_tk_string_var
 from ..views.dialog.open import OpenFileDialog, SaveAsFileDialog
-from ..widgets.textfield import FloatTextField
+from ..widgets import Checkbox, CheckboxState
+from ..widgets.util import FRAME_SCHEDULER
+from ..widgets.textfield import FloatTextField, IntTextField
 from ..widgets.label import Label
+from .evaluation import table_to_rows
+from .preprocessing import (
+    CHANNELS,
+    CLAHE,
+    STAINS,
+    Channel,
+    EqualizeHistogram,
+    Normalize,
+    Stain,
+)
 from .state import app_state
+from .worklist import worklist
 
 
 class MenuFile(tk.Menu):
@@ -36,6 +51,14 @@ class MenuFile(tk.Menu):
         self.add_command(label="Save As", command=self.save_as)
         self.add_separator()
         self.add_command(label="Load", command=self.load)
+        self.add_separator()
+        self.add_command(label="Open Folder", command=self.open_folder)
+        self.add_command(
+            label="Next Image", command=worklist.next, accelerator="Page Down"
+        )
+        self.add_command(
+            label="Previous Image", command=worklist.previous, accelerator="Page Up"
+        )
 
         app_state.filename_save.on_change(
             lambda state: self.entryconfigure(
@@ -49,7 +72,17 @@ class MenuFile(tk.Menu):
         Open a new image with a user dialog.
         """
         # OpenFileDialog(app_state.filename, label="Image")
-        app_state.filename.set(filedialog.askopenfilename())
+        filename = filedialog.askopenfilename()
+        if filename:
+            app_state.open_document(filename)
+
+    def open_folder(self):
+        """
+        Open a folder of images as a worklist with a user dialog.
+        """
+        directory = filedialog.askdirectory()
+        if directory:
+            worklist.directory.set(directory)
 
     def save_as(self):
         SaveAsFileDialog(app_state.filename_save)
@@ -78,17 +111,20 @@ class MenuTools(tk.Menu):
         # add commands
         self.add_command(label="Eval", command=self.eval)
         self.add_separator()
-        self.add_command(label="Normalize", command=self.normalize)
-        self.add_command(label="Equalize Histogram", command=self.equalize_hist)
+        self.add_command(label="Refine Selected Region", command=self.refine_selected)
+        self.add_command(label="Refine All Regions", command=self.refine_all)
+        self.add_command(label="Detect Vessels", command=self.detect)
+        self.add_separator()
+        MenuPreprocessing(self)
+        self.add_separator()
+        self.add_command(label="Cache Statistics", command=self.cache_stats)
+        self.add_command(label="Memory Usage", command=self.memory_usage)
+        self.add_command(label="State Profile", command=self.state_profile)
 
     def eval(self):
         table = app_state.eval_regions()
 
-        rows = []
-        for i in range(len(table["filename"])):
-            row = list(map(lambda key: str(table[key][i]), table.keys()))
-            rows.append("\t".join(row))
-        txt = "\n".join(rows)
+        txt = "\n".join(table_to_rows(table))
         print("\t".join(list(table.keys())))
         print(txt)
         print()
@@ -96,18 +132,128 @@ class MenuTools(tk.Menu):
         self.clipboard_clear()
         self.clipboard_append(txt)
 
-    def normalize(self):
-        _img = cv.cvtColor(app_state.original_image.value, cv.COLOR_BGR2GRAY)
-        _img = (_img - _img.min()) / (_img.max() - _img.min())
-        _img = (255 * _img).astype(np.uint8)
-        _img = cv.cvtColor(_img, cv.COLOR_GRAY2BGR)
-        app_state.original_image.value = _img
+    def refine_selected(self):
+        if app_state.selected_region_index.value < 0:
+            return
+
+        # refinement runs in the background because it computes new embeddings
+        Thread(
+            target=app_state.refine_regions,
+            args=([app_state.get_selected_region()],),
+            name="Refine Regions",
+        ).start()
+
+    def refine_all(self):
+        Thread(
+            target=app_state.refine_regions,
+            args=(list(app_state.regions),),
+            name="Refine Regions",
+        ).start()
+
+    def detect(self):
+        # candidates are segmented coarsely and then refined at original resolution
+        Thread(
+            target=app_state.detect_regions,
+            kwargs={"refine": True},
+            name="Detect Vessels",
+        ).start()
+
+    def cache_stats(self):
+        for name, stats in app_state.cache_stats().items():
+            print(f"{name.capitalize()}: {CacheStats(**stats)}")
+        print(f"Background tasks: {SCHEDULER.stats()}")
+        print(f"Blocking background tasks: {BLOCKING_SCHEDULER.stats()}")
+        print(f"Redraws: {FRAME_SCHEDULER.stats()}")
+
+    def state_profile(self):
+        # recomputes are only recorded if the app is started with `--profile`
+        if not PROFILER.enabled:
+            print("State profiling is disabled (start with --profile)")
+            return
+        print(PROFILER.report())
+
+    def memory_usage(self):
+        usage = app_state.memory_usage()
+        for name, nbytes in usage.items():
+            print(f"{name}: {nbytes / 1024**2:.1f} MiB")
+        print(f"total: {sum(usage.values()) / 1024**2:.1f} MiB")
+
+
+class MenuPreprocessing(tk.Menu):
+    """
+    The Preprocessing sub-menu of the Tools menu to chain preprocessing stages.
 
-    def equalize_hist(self):
-        _img = cv.cvtColor(app_state.original_image.value, cv.COLOR_BGR2GRAY)
-        _img = cv.equalizeHist(_img)
-        _img = cv.cvtColor(_img, cv.COLOR_GRAY2BGR)
-        app_state.original_image.value = _img
+    Stages are not applied destructively so that they can be undone
+    and the applied stages are shown at the end of the menu.
+    """
+
+    def __init__(self, menu_tools):
+        super().__init__(menu_tools)
+
+        menu_tools.add_cascade(menu=self, label="Preprocessing")
+
+        for stage in [
+            Normalize(),
+            EqualizeHistogram(),
+            CLAHE(),
+            *map(Channel, CHANNELS),
+            *map(Stain, STAINS),
+        ]:
+            self.add_command(
+                label=stage.label,
+                command=lambda stage=stage: app_state.add_preprocessing(stage),
+            )
+        self.add_separator()
+        self.add_command(label="Undo", command=app_state.undo_preprocessing)
+        self.add_command(label="Reset", command=lambda: app_state.preprocessing.set(()))
+        self._n_entries = self.index(tk.END) + 1
+
+        app_state.preprocessing.on_change(lambda _: self.update_entries(), trigger=True)
+
+    def update_entries(self):
+        if self.index(tk.END) + 1 > self._n_entries:
+            self.delete(self._n_entries, tk.END)
+
+        if len(app_state.preprocessing.value) == 0:
+            return
+
+        self.add_separator()
+        for i, stage in enumerate(app_state.preprocessing.value):
+            self.add_command(label=f"{i + 1}. {stage.label}", state=tk.DISABLED)
+
+
+class MenuDocuments(tk.Menu):
+    """
+    The Documents menu listing all open documents to switch between them.
+    """
+
+    def __init__(self, menu_bar):
+        super().__init__(menu_bar)
+
+        menu_bar.add_cascade(menu=self, label="Documents")
+
+        self.current = tk.StringVar(value=app_state.filename.value)
+
+        app_state.documents.on_change(lambda _: self.update_entries(), trigger=True)
+        app_state.filename.on_change(lambda state: self.current.set(state.value))
+
+    def update_entries(self):
+        self.delete(0, tk.END)
+
+        self.add_command(
+            label="Close Document",
+            command=lambda: app_state.close_document(app_state.filename.value),
+        )
+        self.add_separator()
+        for document in app_state.documents:
+            self.add_radiobutton(
+                label=os.path.basename(document.value),
+                value=document.value,
+                variable=self.current,
+                command=lambda filename=document.value: app_state.open_document(
+                    filename
+                ),
+            )
 
 
 class MenuOptions(tk.Menu):
@@ -142,9 +288,35 @@ class MenuOptions(tk.Menu):
 
         unit_dropdown = tk.OptionMenu(config_view, to_tk_string_var(app_state.pixel_unit), *units)
         unit_dropdown.grid(row=0, column=2, rowspan=2)
-        
-        button = ttk.Button(config_view, text="Save", command=lambda *_: config_view.destroy())
-        button.grid(row=2, column=0, columnspan=3, pady=5)
+
+        # tiling is only applied on save because it recomputes the embedding
+        tiled_inference = BoolState(app_state.tiled_inference.value)
+        tile_size = IntState(app_state.tile_size.value)
+
+        tiled_checkbox = Checkbox(config_view, CheckboxState(tiled_inference))
+        tiled_checkbox.grid(row=2, column=1, sticky="w", padx=(2, 10))
+        tiled_label = Label(config_view, StringState("Tiled Inference:"))
+        tiled_label.grid(row=2, column=0, sticky="w", padx=(10, 2))
+
+        tile_size_text_field = IntTextField(config_view, tile_size)
+        tile_size_text_field.grid(row=3, column=1, padx=(2, 10), pady=5)
+        tile_size_label = Label(config_view, StringState("Tile Size:"))
+        tile_size_label.grid(row=3, column=0, sticky="w", padx=(10, 2))
+
+        memory_budget = BoolState(app_state.memory_budget.value)
+        memory_budget_checkbox = Checkbox(config_view, CheckboxState(memory_budget))
+        memory_budget_checkbox.grid(row=4, column=1, sticky="w", padx=(2, 10))
+        memory_budget_label = Label(config_view, StringState("Memory Budget:"))
+        memory_budget_label.grid(row=4, column=0, sticky="w", padx=(10, 2))
+
+        def save(*_):
+            app_state.tile_size.value = max(tile_size.value, 256)
+            app_state.tiled_inference.value = tiled_inference.value
+            app_state.memory_budget.value = memory_budget.value
+            config_view.destroy()
+
+        button = ttk.Button(config_view, text="Save", command=save)
+        button.grid(row=5, column=0, columnspan=3, pady=5)
 
 
 class MenuBar(tk.Menu):
@@ -159,5 +331,6 @@ class MenuBar(tk.Menu):
         root["menu"] = self
 
         self.menu_file = MenuFile(self)
+        self.menu_documents = MenuDocuments(self)
         self.menu_tools = MenuTools(self)
         self.menu_options = MenuOptions(self)
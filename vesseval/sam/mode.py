@@ -8,6 +8,7 @@ when the mode becomes active.
 Different modes can be activated using the toolbar.
 """
 
+from threading import Thread
 from typing import Callable
 
 import cv2 as cv
@@ -16,12 +17,13 @@ from tkinter import ttk
 from widget_state import BoolState, HigherOrderState, StringState
 
 from ..state import PointState, BoundingBoxState
+from ..util import transform_contour
 from ..widgets.canvas import BoundingBox, Circle, CircleState
 from ..widgets.canvas.grid import Grid, GridState
 from ..widgets.label import Label
 from ..widgets.textfield import IntTextField
 
-from .state import app_state, RegionState, PointState, IMAGE_PREDICTOR
+from .state import app_state, RegionState, PointState
 
 
 class AbstractMode:
@@ -189,21 +191,18 @@ class GridConfigView(tk.Toplevel):
         self.bind("<Key-q>", lambda event: exit(0))
 
     def on_confirm(self, *args) -> None:
-        coords = []
-        for pt in self.grid.points:
-            c = app_state.display_image.to_image_coords(pt.state.center.x.value, pt.state.center.y.value)
-            
-            img_shape = app_state.display_image.image_state.value.shape
-            if c[0] < 0 or c[1] < 0 or c[0] > img_shape[1] or c[1] > img_shape[0]:
-                continue
-
-            coords.append(c)
-            pt.delete()
+        coords = transform_contour(self.grid.state.coords(), app_state.display_image)
         self.grid.delete()
 
-        points, contours = IMAGE_PREDICTOR.predict_multiple_as_contour(coords) 
-        for pt, cnt in zip(points, contours):
-            app_state.add_region(RegionState(pt=pt, cnt=cnt))
+        img_shape = app_state.display_image.image_state.value.shape
+        inside = (coords >= 0).all(axis=1)
+        inside &= (coords[:, 0] <= img_shape[1]) & (coords[:, 1] <= img_shape[0])
+        coords = list(map(tuple, coords[inside].tolist()))
+
+        # the grid is segmented in the background - interactive edits are served first
+        Thread(
+            target=app_state.add_grid_regions, args=(coords,), name="Grid Prediction"
+        ).start()
 
         self.withdraw()
         self.destroy()
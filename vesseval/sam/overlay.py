@@ -0,0 +1,186 @@
+import threading
+from typing import Callable
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+import tkinter as tk
+from widget_state import HigherOrderState, IntState, ListState, State
+
+from ..state import DisplayImageState
+from ..widgets.canvas import Image
+from ..widgets.util import stateful
+
+from .state import COLOR_PALETTE, RegionState
+
+# maximum deviation in display pixels of simplified region outlines
+LOD_TOLERANCE = 1.0
+# stipple pattern approximating the transparency of region fills
+STIPPLE = "gray50"
+
+
+def lod_level(scale: float) -> int:
+    """
+    Get the level of detail for a display scale.
+
+    Levels change with every doubling of the scale, so that outlines are not
+    simplified again for small zoom steps.
+    """
+    return int(np.floor(np.log2(scale)))
+
+
+def simplify(contour: NDArray, level: int) -> NDArray:
+    """
+    Simplify a contour in image coordinates for the display at a level of detail.
+    """
+    contour = contour.reshape(-1, 1, 2).astype(np.float32)
+    if len(contour) < 3:
+        return contour
+
+    epsilon = LOD_TOLERANCE / 2.0**level
+    return cv.approxPolyDP(contour, epsilon, closed=True)
+
+
+def to_hex(color: tuple[int, int, int]) -> str:
+    return "#{:02x}{:02x}{:02x}".format(*color)
+
+
+class RegionOverlayState(HigherOrderState):
+
+    def __init__(
+        self,
+        regions: ListState,
+        selected_region_index: IntState,
+        display_image: DisplayImageState,
+    ):
+        """
+        State of the regions drawn on top of the displayed image.
+        """
+        super().__init__()
+
+        self.regions = regions
+        self.selected_region_index = selected_region_index
+        self.display_image = display_image
+
+
+@stateful
+class RegionOverlay:
+    """
+    Regions drawn as polygon items in display coordinates.
+
+    Only the items of added, removed or changed regions are updated. If the
+    view changes, the outlines are transformed again and they are only
+    simplified again if the level of detail changes. Selecting a region
+    merely changes the style of two items.
+    """
+
+    def __init__(self, canvas: tk.Canvas, state: RegionOverlayState, image: Image):
+        self.canvas = canvas
+        self.widget = canvas
+        self.state = state
+        self.image = image
+
+        self.tag = f"region_overlay_{id(self)}"
+
+        # items and simplified outlines by the id of their region state
+        self.regions: list[RegionState] = []
+        self.items: dict[int, int] = {}
+        self.colors: dict[int, str] = {}
+        self.outlines: dict[int, tuple[int, NDArray]] = {}
+        self.contour_callbacks: dict[int, Callable[[State], None]] = {}
+        self.selected = None
+
+        # contours change in background threads while the GUI thread draws
+        self._lock = threading.Lock()
+        self._changed: set[int] = set()
+        self._transform = None
+
+    def draw(self):
+        regions = list(self.state.regions)
+        with self._lock:
+            changed, self._changed = self._changed, set()
+
+        transform = self.state.display_image.transform()
+        moved = self._transform is None or not np.array_equal(
+            transform, self._transform
+        )
+        self._transform = transform
+        level = lod_level(transform[0, 0])
+        for key in changed:
+            self.outlines.pop(key, None)
+
+        keys = set(map(id, regions))
+        for region in self.regions:
+            if id(region) not in keys:
+                self.remove_item(region)
+
+        for region in regions:
+            key = id(region)
+            if key not in self.items:
+                self.add_item(region)
+            elif not (moved or key in changed):
+                continue
+            self.update_coords(region, transform, level)
+
+        for i, region in enumerate(regions):
+            # colors depend on the index which changes if regions are removed
+            color = to_hex(COLOR_PALETTE[i % len(COLOR_PALETTE)])
+            if self.colors.get(id(region)) != color:
+                self.colors[id(region)] = color
+                self.canvas.itemconfig(self.items[id(region)], fill=color)
+                self.style(id(region), id(region) == self.selected)
+        self.regions = regions
+
+        index = self.state.selected_region_index.value
+        selected = id(regions[index]) if 0 <= index < len(regions) else None
+        if selected != self.selected:
+            if self.selected in self.items:
+                self.style(self.selected, selected=False)
+            if selected is not None:
+                self.style(selected, selected=True)
+                self.canvas.tag_raise(self.items[selected], self.tag)
+            self.selected = selected
+
+    def add_item(self, region: RegionState) -> None:
+        item = self.canvas.create_polygon(
+            0, 0, 0, 0, 0, 0, stipple=STIPPLE, state=tk.HIDDEN, tags=(self.tag,)
+        )
+        # above the image, but below the markers of the selected region
+        self.canvas.tag_raise(item, self.image.img_id)
+        self.items[id(region)] = item
+
+        callback = lambda _, key=id(region): self.on_contour_change(key)
+        region.contour.on_change(callback)
+        self.contour_callbacks[id(region)] = callback
+
+    def remove_item(self, region: RegionState) -> None:
+        self.canvas.delete(self.items.pop(id(region)))
+        self.colors.pop(id(region), None)
+        self.outlines.pop(id(region), None)
+        region.contour.remove_callback(self.contour_callbacks.pop(id(region)))
+
+    def on_contour_change(self, key: int) -> None:
+        # outlines are simplified again in the next frame
+        with self._lock:
+            self._changed.add(key)
+        self.state.notify_change()
+
+    def update_coords(self, region: RegionState, transform: NDArray, level: int):
+        key = id(region)
+        if self.outlines.get(key, (None,))[0] != level:
+            self.outlines[key] = (level, simplify(region.contour.to_numpy(), level))
+        _, outline = self.outlines[key]
+
+        if len(outline) < 3:
+            self.canvas.itemconfig(self.items[key], state=tk.HIDDEN)
+            return
+
+        coords = cv.transform(outline, transform).ravel().tolist()
+        self.canvas.coords(self.items[key], coords)
+        self.canvas.itemconfig(self.items[key], state=tk.NORMAL)
+
+    def style(self, key: int, selected: bool) -> None:
+        if selected:
+            self.canvas.itemconfig(self.items[key], outline="black", width=3)
+        else:
+            self.canvas.itemconfig(self.items[key], outline=self.colors[key], width=1)
@@ -0,0 +1,269 @@
+"""
+Preprocessing of images before segmentation.
+
+A pipeline is a sequence of stages (e.g., normalization followed by CLAHE).
+Each stage is fitted on the working image (e.g., its histogram is computed)
+and the fitted stage can then be applied to any region of the image at full
+resolution. Results of each prefix of a pipeline are cached so that adding or
+undoing a stage computes at most a single stage.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+import weakref
+
+import cv2 as cv
+import numpy as np
+from numpy.typing import NDArray
+
+from ..image_source import ImageSource
+from ..lru_cache import LRUCache
+
+# stain vectors (optical density of red, green and blue) of hematoxylin, eosin
+# and DAB from Ruifrok and Johnston, "Quantification of histochemical staining
+# by color deconvolution", 2001
+STAIN_VECTORS = np.array(
+    [
+        [0.65, 0.70, 0.29],
+        [0.07, 0.99, 0.11],
+        [0.27, 0.57, 0.78],
+    ]
+)
+STAIN_VECTORS = STAIN_VECTORS / np.linalg.norm(STAIN_VECTORS, axis=1, keepdims=True)
+STAINS = ["hematoxylin", "eosin", "dab"]
+
+CHANNELS = ["gray", "red", "green", "blue"]
+
+FittedStage = tuple["Stage", Any]
+
+
+def to_gray(image: NDArray) -> NDArray:
+    return cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+
+
+class Stage:
+    """
+    Base class of preprocessing stages.
+
+    Stages are immutable and hashable so that they can be used as cache keys.
+    """
+
+    label = ""
+
+    def fit(self, image: NDArray) -> Any:
+        """
+        Compute the parameters of the stage (e.g., a lookup table) from an image.
+        """
+        return None
+
+    def apply(self, image: NDArray, params: Any) -> NDArray:
+        """
+        Apply the stage with fitted parameters to an RGB image.
+        """
+        raise NotImplementedError
+
+
+@dataclass(frozen=True)
+class Channel(Stage):
+    """
+    Select a single channel (or the gray value) of an image.
+    """
+
+    channel: str = "gray"
+
+    @property
+    def label(self) -> str:
+        return f"{self.channel.capitalize()} Channel"
+
+    def apply(self, image: NDArray, params: Any) -> NDArray:
+        if self.channel == "gray":
+            channel = to_gray(image)
+        else:
+            channel = image[..., CHANNELS.index(self.channel) - 1]
+        return cv.cvtColor(channel, cv.COLOR_GRAY2RGB)
+
+
+@dataclass(frozen=True)
+class Normalize(Stage):
+    """
+    Stretch the gray values of an image to the full range.
+    """
+
+    label = "Normalize"
+
+    def fit(self, image: NDArray) -> NDArray:
+        gray = to_gray(image)
+        low, high = int(gray.min()), int(gray.max())
+        values = np.arange(256, dtype=np.float32)
+        if high == low:
+            return values.astype(np.uint8)
+        return np.clip((values - low) * 255 / (high - low), 0, 255).astype(np.uint8)
+
+    def apply(self, image: NDArray, params: NDArray) -> NDArray:
+        return cv.cvtColor(cv.LUT(to_gray(image), params), cv.COLOR_GRAY2RGB)
+
+
+@dataclass(frozen=True)
+class EqualizeHistogram(Stage):
+    """
+    Equalize the histogram of the gray values of an image.
+    """
+
+    label = "Equalize Histogram"
+
+    def fit(self, image: NDArray) -> NDArray:
+        histogram = np.bincount(to_gray(image).ravel(), minlength=256)
+        cdf = np.cumsum(histogram)
+        cdf_min = cdf[np.nonzero(histogram)[0][0]]
+        if cdf[-1] == cdf_min:
+            return np.arange(256, dtype=np.uint8)
+        return np.clip(
+            np.rint((cdf - cdf_min) * 255 / (cdf[-1] - cdf_min)), 0, 255
+        ).astype(np.uint8)
+
+    def apply(self, image: NDArray, params: NDArray) -> NDArray:
+        return cv.cvtColor(cv.LUT(to_gray(image), params), cv.COLOR_GRAY2RGB)
+
+
+@dataclass(frozen=True)
+class CLAHE(Stage):
+    """
+    Contrast limited adaptive histogram equalization of the lightness of an image.
+
+    Note: this is a local operation - applied to a region, the region
+    is divided into the same grid of tiles as the whole image.
+    """
+
+    clip_limit: float = 2.0
+    grid_size: int = 8
+
+    label = "CLAHE"
+
+    def apply(self, image: NDArray, params: Any) -> NDArray:
+        clahe = cv.createCLAHE(
+            clipLimit=self.clip_limit, tileGridSize=(self.grid_size, self.grid_size)
+        )
+        lab = cv.cvtColor(image, cv.COLOR_RGB2LAB)
+        lab[..., 0] = clahe.apply(np.ascontiguousarray(lab[..., 0]))
+        return cv.cvtColor(lab, cv.COLOR_LAB2RGB)
+
+
+@dataclass(frozen=True)
+class Stain(Stage):
+    """
+    Extract the amount of a stain by color deconvolution.
+
+    The result is shown as a gray image in which stained areas are dark.
+    """
+
+    stain: str = "hematoxylin"
+
+    @property
+    def label(self) -> str:
+        return f"{self.stain.capitalize()} Stain"
+
+    def concentration(self, image: NDArray) -> NDArray:
+        optical_density = -np.log((image.astype(np.float32) + 1.0) / 256.0)
+        concentrations = optical_density.reshape(-1, 3) @ np.linalg.pinv(
+            STAIN_VECTORS
+        ).astype(np.float32)
+        return concentrations[:, STAINS.index(self.stain)].reshape(image.shape[:2])
+
+    def fit(self, image: NDArray) -> float:
+        # the range of concentrations is fixed by the working image so that
+        # regions of the full resolution image are scaled the same way
+        return max(float(np.percentile(self.concentration(image), 99.5)), 1e-6)
+
+    def apply(self, image: NDArray, params: float) -> NDArray:
+        concentration = np.clip(self.concentration(image) / params, 0.0, 1.0)
+        gray = (255 * (1.0 - concentration)).astype(np.uint8)
+        return cv.cvtColor(gray, cv.COLOR_GRAY2RGB)
+
+
+def apply_stages(image: NDArray, fitted: list[FittedStage]) -> NDArray:
+    for stage, params in fitted:
+        image = stage.apply(image, params)
+    return image
+
+
+class Pipeline:
+    """
+    Run sequences of stages on images and cache the result of each prefix.
+
+    Parameters
+    ----------
+    cache: LRUCache
+        cache for intermediate results
+    """
+
+    def __init__(self, cache: LRUCache) -> None:
+        self.cache = cache
+
+    def run(
+        self, stages: tuple[Stage, ...], image: NDArray
+    ) -> tuple[NDArray, list[FittedStage]]:
+        """
+        Fit and apply stages to an image.
+
+        Returns
+        -------
+        tuple of NDArray, list
+            the preprocessed image and the fitted stages
+        """
+        start, result, fitted = 0, image, []
+        for n in range(len(stages), 0, -1):
+            value = self.cache.get(("preprocessing", id(image), stages[:n]))
+            # a weak reference to the input is part of the value because its id
+            # may be reused (the input itself would count to the memory of each prefix)
+            if value is not None and value[0]() is image:
+                start, result, fitted = n, value[1], value[2]
+                break
+
+        for n in range(start, len(stages)):
+            params = stages[n].fit(result)
+            result = stages[n].apply(result, params)
+            fitted = [*fitted, (stages[n], params)]
+            self.cache.put(
+                ("preprocessing", id(image), stages[: n + 1]),
+                (weakref.ref(image), result, fitted),
+            )
+
+        return result, fitted
+
+
+class PreprocessedImageSource(ImageSource):
+    """
+    Image source that applies fitted stages to all regions read from another source.
+
+    This way, stages fitted on the working image are applied to the full
+    resolution image only where it is needed (e.g., crops for refinement).
+    """
+
+    def __init__(self, image_source: ImageSource, fitted: list[FittedStage]) -> None:
+        super().__init__(image_source.filename)
+
+        self.image_source = image_source
+        self.fitted = fitted
+        self.levels = image_source.levels
+
+    @property
+    def nbytes(self) -> int:
+        return self.image_source.nbytes
+
+    def close(self) -> None:
+        self.image_source.close()
+
+    def read_region(
+        self,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        resolution: Optional[tuple[int, int]] = None,
+    ) -> NDArray:
+        return apply_stages(
+            self.image_source.read_region(x, y, width, height, resolution),
+            self.fitted,
+        )
@@ -8,7 +8,7 @@ from numpy.typing import NDArray
 from ..state import ImageState, DisplayImageState, ResolutionState
 from ..widgets.canvas import Image
 
-from .state import app_state
+from .state import app_state, ALPHA, COLOR_BLACK, COLOR_PALETTE
 
 
 class RegionView(tk.Frame):
@@ -34,7 +34,9 @@ class RegionView(tk.Frame):
         self.canvas.grid(row=0, column=0, sticky="n")
 
         self.image_state.depends_on(
-            [app_state.selected_region_index, app_state.final_image], self.compute_image
+            [app_state.selected_region_index, app_state.image, app_state.contours],
+            self.compute_image,
+            element_wise=True,
         )
 
         self.table = tk.Frame(self, bg="#AEAEAE", borderwidth=2)
@@ -73,14 +75,28 @@ class RegionView(tk.Frame):
             )
 
             cnt = selected_region.contour.to_numpy()
-            bb = cv.boundingRect(cnt)
+            x, y, w, h = cv.boundingRect(cnt)
 
-            base_img = app_state.final_image.value
-            img = base_img[bb[1] : bb[1] + bb[3], bb[0] : bb[0] + bb[2]]
-            return img
+            img = app_state.image.value[y : y + h, x : x + w].copy()
+            return self.draw_regions(img, offset=(-x, -y))
         except:
             return np.zeros((self.res, self.res, 3), np.uint8)
 
+    def draw_regions(self, img: NDArray, offset: tuple[int, int]) -> NDArray:
+        # regions are drawn on the canvas of the app and only into this crop
+        colored = np.zeros_like(img)
+        for i, region in enumerate(app_state.regions):
+            cnt = region.contour.to_numpy()
+            if len(cnt) == 0:
+                continue
+
+            color = COLOR_PALETTE[i % len(COLOR_PALETTE)]
+            cv.drawContours(colored, [cnt], -1, color, -1, offset=offset)
+        img = cv.addWeighted(img, 1.0, colored, ALPHA, 0)
+
+        cnt = app_state.get_selected_region().contour.to_numpy()
+        return cv.drawContours(img, [cnt], -1, COLOR_BLACK, thickness=3, offset=offset)
+
     def read_categories(self):
         default = ["Category 1", "Category 2", "Category 3"]
         cat_file = os.path.join(os.getcwd(), "categories.txt")
@@ -1,6 +1,11 @@
+from contextlib import contextmanager
+from dataclasses import asdict
+import hashlib
 import os
+import queue
 import time
 import threading
+from typing import Any, Hashable, Iterator, Optional
 import urllib
 
 import cv2 as cv
@@ -10,7 +15,12 @@ from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 import torch
 
+from ..image_source import ImageSource, open_image
+from ..lru_cache import LRUCache
 from .contour_util import Contour
+from .jobs import EmbeddingJobs, EmbeddingStatus
+from .preprocessing import FittedStage, PreprocessedImageSource
+from .tiling import Tile, TileGrid, to_tile_prompts
 
 
 URL_WEIGHTS = (
@@ -19,19 +29,53 @@ URL_WEIGHTS = (
 FILE_CHECKPOINT = "./checkpoints/sam2.1_hiera_tiny.pt"
 FILE_MODEL_CFG = "configs/sam2.1/sam2.1_hiera_t.yaml"
 
+# default overlap of tiles in pixels for tiled inference
+TILE_OVERLAP = 256
+# memory budget (in bytes) of cached image, tile and crop embeddings
+EMBEDDING_CACHE_SIZE = 1024**3
+# number of crops embedded together by a single run of the encoder
+REFINE_BATCH_SIZE = 4
+# number of images waiting to be prefetched (further images are skipped)
+PREFETCH_QUEUE_SIZE = 8
+
+
+def image_key(image: NDArray) -> Hashable:
+    """
+    Get the key of the embedding of an image in the embedding cache.
+    """
+    return ("image", hashlib.blake2b(image.tobytes()).hexdigest())
+
+
+def to_image_coords(points: NDArray, scale: NDArray) -> NDArray:
+    """
+    Map points predicted at the native resolution of tiles to the image set.
+    """
+    return np.rint(points / scale).astype(points.dtype)
+
 
 class ImagePredictor:
     """
     Wrapper around the `SAM2ImagePredictor` that wraps its initialization
     and `set_image` into threads so that it does not take place on the
-    main GUI thread.
+    main GUI thread. Only the latest image set is embedded (see `jobs.py`).
+
+    Large images can be processed in tiles at native resolution (see `set_image`).
+
+    Parameters
+    ----------
+    cache_embeddings: bool
+        cache embeddings of images, tiles and crops so that they are reused
+    prefetch: bool
+        start a thread which computes embeddings of prefetched images
     """
 
-    def __init__(self) -> None:
+    def __init__(self, cache_embeddings: bool = True, prefetch: bool = True) -> None:
         self.checkpoint = FILE_CHECKPOINT
         self.model_cfg = FILE_MODEL_CFG
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self._predictor = None
+        # predictor sharing the model to compute prefetched embeddings
+        self._prefetch_predictor = None
 
         self.download_weights_thread = threading.Thread(
             target=self.download_weights,
@@ -44,8 +88,33 @@ class ImagePredictor:
         )
         self.init_thread.start()
 
-        self.embedding_thread = None
-        self.embedding_lock = threading.Lock()
+        self.embedding_jobs = EmbeddingJobs(self._set_image_sync)
+        # serializes the use of the model by predictions and prefetched embeddings
+        self.predictor_lock = threading.RLock()
+
+        # state of tiled inference - tiles are read from the image source at its
+        # native resolution and embedded on demand, while prompts and results are
+        # in the coordinates of the image set (scaled by `tile_scale`)
+        self.image_source: Optional[ImageSource] = None
+        self.image_shape: Optional[tuple[int, int]] = None
+        self.tile_grid: Optional[TileGrid] = None
+        self.tile_scale = np.ones(2)
+        self.image_version = 0
+        self.active_embedding: Optional[Hashable] = None
+        self.image_embedding: Optional[dict[str, Any]] = None
+        # without a budget, embeddings are computed but never cached
+        self.embeddings = LRUCache(EMBEDDING_CACHE_SIZE if cache_embeddings else 0)
+        # regions predicted by bulk jobs whose points are sent in chunks
+        self.bulk_jobs: dict[Hashable, list[Contour]] = {}
+
+        # images are prefetched one after another by a single thread
+        self.prefetch_queue: queue.Queue[NDArray] = queue.Queue(PREFETCH_QUEUE_SIZE)
+        self.prefetch_thread: Optional[threading.Thread] = None
+        if prefetch:
+            self.prefetch_thread = threading.Thread(
+                target=self._prefetch_loop, name="Prefetch Embeddings", daemon=True
+            )
+            self.prefetch_thread.start()
 
     def download_weights(self) -> None:
         if os.path.isfile(FILE_CHECKPOINT):
@@ -64,91 +133,468 @@ class ImagePredictor:
         self._predictor = SAM2ImagePredictor(
             build_sam2(self.model_cfg, self.checkpoint, self.device)
         )
+        self._prefetch_predictor = SAM2ImagePredictor(self._predictor.model)
 
-    def set_image(self, image: NDArray) -> None:
-        with self.embedding_lock:
-            self.embedding_thread = threading.Thread(
-                target=self._set_image_sync, args=(image,)
-            )
-            self.embedding_thread.start()
+    def set_image(
+        self,
+        image: NDArray,
+        tile_size: Optional[int] = None,
+        tile_overlap: int = TILE_OVERLAP,
+        filename: Optional[str] = None,
+        fitted: Optional[list[FittedStage]] = None,
+    ) -> int:
+        """
+        Set the image for which masks are predicted.
+
+        If a `tile_size` and the `filename` of the image are given and the
+        image in the file is larger, it is processed in overlapping tiles at
+        its native resolution. The tiles are read from the file (and
+        preprocessed by the `fitted` stages) when they are needed, so that the
+        image is never held at its native resolution. Prompts and results
+        remain in the coordinates of `image`.
+
+        Returns
+        -------
+        int
+            the version of the image (see `embedding_status`)
+        """
+        return self.embedding_jobs.submit(
+            image, tile_size, tile_overlap, filename, fitted
+        )
 
-    def _set_image_sync(self, image: NDArray) -> None:
-        with self.embedding_lock:
-            if np.all(image == 0):
-                self.embedding_thread = None
+    def wait_for_embedding(self) -> None:
+        """
+        Wait until the embedding of the latest image is done.
+
+        Raises a RuntimeError if computing the embedding failed.
+        """
+        self.embedding_jobs.wait()
+        error = self.embedding_jobs.status().error
+        if error is not None:
+            raise RuntimeError(error)
+
+    def embedding_status(self) -> EmbeddingStatus:
+        """
+        Get the version of the latest image and of the latest embedded image.
+        """
+        return self.embedding_jobs.status()
+
+    def _set_image_sync(
+        self,
+        image: NDArray,
+        tile_size: Optional[int] = None,
+        tile_overlap: int = TILE_OVERLAP,
+        filename: Optional[str] = None,
+        fitted: Optional[list[FittedStage]] = None,
+    ) -> None:
+        self.init_thread.join()
+        # skip the image if another one was set while the model was loading
+        if self.embedding_jobs.superseded:
+            return
+
+        image_source = None
+        if tile_size is not None and filename:
+            image_source = open_image(filename)
+            if max(image_source.resolution) <= tile_size:
+                image_source.close()
+                image_source = None
+
+        with self.predictor_lock:
+            self.image_version += 1
+            self.active_embedding = None
+            # predictions must not use the embedding of the previous image
+            # if computing the new one fails
+            self.image_embedding = None
+
+            if self.image_source is not None:
+                self.image_source.close()
+            self.image_source = None
+            self.image_shape = None
+            self.tile_grid = None
+            self.tile_scale = np.ones(2)
+
+            if image_source is not None:
+                self.image_source = (
+                    PreprocessedImageSource(image_source, fitted)
+                    if fitted
+                    else image_source
+                )
+                self.image_shape = image.shape[:2]
+                self.tile_grid = TileGrid(
+                    *image_source.resolution, tile_size, tile_overlap
+                )
+                self.tile_scale = np.array(image_source.resolution) / np.array(
+                    image.shape[1::-1]
+                )
                 return
 
-            since = time.time()
+            # keep the embedding of the image as the predictor is also used for crops
+            # (an empty image, i.e., no image is opened, has no embedding)
+            self.image_embedding = self._embed_image(image) if image.any() else None
+
+    def _embed_image(self, image: NDArray) -> dict[str, Any]:
+        """
+        Get the embedding of an image from the cache or compute it.
 
-            self.init_thread.join()
+        Afterwards, no embedding is active because the cached one is not
+        restored and computing a new one replaces the active embedding.
+        """
+        key = image_key(image)
+        embedding = self.embeddings.get(key)
+        if embedding is None:
             self._predictor.set_image(image)
+            embedding = self._cache_embedding(key)
 
-    def predict(
-        self, point_coords: NDArray, point_labels: NDArray, box: NDArray
-    ) -> NDArray:
-        if self.embedding_thread is None:
-            raise RuntimeError(
-                "Cannot predict mask without computing the embedding first"
-            )
+        self.active_embedding = None
+        return embedding
 
-        self.embedding_thread.join()
+    def prefetch(self, image: NDArray) -> None:
+        """
+        Compute the embedding of an image in the background so that
+        a later `set_image` of the same image does not run the encoder.
 
-        since = time.time()
+        Images are skipped if too many are already waiting to be prefetched
+        or if prefetching is disabled.
+        """
+        if self.prefetch_thread is None:
+            return
 
-        multi_mask = (
-            False
-            if point_coords is None or len(point_labels) > 1 or box is not None
-            else True
-        )
+        try:
+            self.prefetch_queue.put_nowait(image)
+        except queue.Full:
+            pass
+
+    def _prefetch_loop(self) -> None:
+        self.init_thread.join()
+        while True:
+            self._prefetch_sync(self.prefetch_queue.get())
+
+    def _prefetch_sync(self, image: NDArray) -> None:
+        """
+        Compute the embedding of an image with the prefetch predictor.
+
+        The encoder runs without the `predictor_lock` so that predictions are
+        not blocked by prefetching. The lock is only held to cache the embedding.
+        """
+        key = image_key(image)
+        if not image.any() or key in self.embeddings:
+            return
+
+        self._prefetch_predictor.set_image(image)
+        embedding = self._store_embedding(self._prefetch_predictor)
+        with self.predictor_lock:
+            self.embeddings.put(key, embedding)
+
+    def _store_embedding(
+        self, predictor: Optional[SAM2ImagePredictor] = None
+    ) -> dict[str, Any]:
+        predictor = self._predictor if predictor is None else predictor
+        return {
+            "features": predictor._features,
+            "orig_hw": predictor._orig_hw,
+            "is_batch": predictor._is_batch,
+        }
+
+    def _restore_embedding(self, embedding: dict[str, Any]) -> None:
+        self._predictor._features = embedding["features"]
+        self._predictor._orig_hw = embedding["orig_hw"]
+        self._predictor._is_batch = embedding["is_batch"]
+        self._predictor._is_image_set = True
+
+    def _activate_image(self) -> None:
+        if self.active_embedding != "image":
+            self._restore_embedding(self.image_embedding)
+            self.active_embedding = "image"
+
+    def _activate_tile(self, tile: Tile) -> None:
+        """
+        Make the embedding of a tile the active one.
+
+        Tile embeddings are cached so that prompts in the same
+        tiles do not require to run the encoder again.
+        """
+        key = (self.image_version, tile)
+        if self.active_embedding == key:
+            return
+
+        embedding = self.embeddings.get(key)
+        if embedding is not None:
+            self._restore_embedding(embedding)
+        else:
+            self._predictor.set_image(
+                self.image_source.read_region(tile.x, tile.y, tile.width, tile.height)
+            )
+            self._cache_embedding(key)
+
+        self.active_embedding = key
+
+    def _cache_embedding(self, key: Hashable) -> dict[str, Any]:
+        embedding = self._store_embedding()
+        self.embeddings.put(key, embedding)
+        return embedding
+
+    def cache_stats(self) -> dict[str, Any]:
+        """
+        Get hit/miss and memory statistics of the embedding cache.
+        """
+        return asdict(self.embeddings.stats())
+
+    @contextmanager
+    def _current_embedding(self) -> Iterator[None]:
+        """
+        Lock the predictor with the embedding of the latest image set.
+
+        The embedding cannot be replaced while the lock is held, so that
+        a prediction never uses the embedding of a previous image.
+        """
+        while True:
+            self.embedding_jobs.wait()
+            with self.predictor_lock:
+                # another image may have been set while waiting for the lock
+                status = self.embedding_jobs.status()
+                if not status.done:
+                    continue
+
+                if status.error is not None:
+                    raise RuntimeError(
+                        f"Computing the embedding failed: {status.error}"
+                    )
+
+                if self.tile_grid is None and self.image_embedding is None:
+                    raise RuntimeError(
+                        "Cannot predict mask without computing the embedding first"
+                    )
+                yield
+                return
+
+    def _predict(
+        self,
+        point_coords: Optional[NDArray],
+        point_labels: Optional[NDArray],
+        box: Optional[NDArray],
+        multi_mask: Optional[bool] = None,
+    ) -> tuple[NDArray, float]:
+        """
+        Predict a mask with the active embedding.
+
+        Returns
+        -------
+        tuple of NDArray, float
+            the mask with the highest score and its score
+        """
+        if multi_mask is None:
+            multi_mask = (
+                False
+                if point_coords is None or len(point_labels) > 1 or box is not None
+                else True
+            )
         masks, scores, _ = self._predictor.predict(
             point_coords=point_coords,
             point_labels=point_labels,
             multimask_output=multi_mask,
             box=box,
         )
-        return masks[np.argmax(scores)]
+        index = np.argmax(scores)
+        return masks[index], float(scores[index])
 
-    def predict_as_contour(
+    def _predict_in_tile(
+        self,
+        tile: Tile,
+        point_coords: Optional[NDArray],
+        point_labels: Optional[NDArray],
+        box: Optional[NDArray],
+        multi_mask: Optional[bool] = None,
+    ) -> Optional[tuple[NDArray, float]]:
+        point_coords, point_labels, box = to_tile_prompts(
+            tile, point_coords, point_labels, box
+        )
+        if point_coords is None and box is None:
+            return None
+
+        self._activate_tile(tile)
+        return self._predict(point_coords, point_labels, box, multi_mask=multi_mask)
+
+    def _predict_tiled(
+        self,
+        point_coords: Optional[NDArray],
+        point_labels: Optional[NDArray],
+        box: Optional[NDArray],
+        multi_mask: Optional[bool] = None,
+    ) -> tuple[NDArray, float, tuple[int, int]]:
+        if box is not None:
+            tiles = self.tile_grid.tiles_for_box(box.reshape(-1))
+        else:
+            # route the prompt to the tile in which the foreground point is most central
+            foreground = point_coords[point_labels == 1]
+            point = foreground[0] if len(foreground) > 0 else point_coords[0]
+            tiles = [self.tile_grid.tile_for_point(*point)]
+
+        predictions = {}
+        for tile in tiles:
+            prediction = self._predict_in_tile(
+                tile, point_coords, point_labels, box, multi_mask=multi_mask
+            )
+            if prediction is not None:
+                predictions[tile] = prediction
+
+        # a region segmented by points may continue beyond the border of its tile
+        # thus, it is also segmented in neighbouring tiles with its enlarged bounding box
+        tile = tiles[0]
+        if (
+            box is None
+            and tile in predictions
+            and self.tile_grid.touches_seam(tile, predictions[tile][0])
+        ):
+            x, y, w, h = cv.boundingRect(predictions[tile][0].astype(np.uint8))
+            margin = self.tile_grid.overlap
+            seam_box = np.array(
+                [
+                    max(tile.x + x - margin, 0),
+                    max(tile.y + y - margin, 0),
+                    min(tile.x + x + w + margin, self.tile_grid.width),
+                    min(tile.y + y + h + margin, self.tile_grid.height),
+                ]
+            )
+            for _tile in self.tile_grid.tiles_for_box(seam_box):
+                if _tile in predictions:
+                    continue
+
+                prediction = self._predict_in_tile(
+                    _tile, point_coords, point_labels, seam_box[None]
+                )
+                if prediction is not None:
+                    predictions[_tile] = prediction
+
+        return self._stitch(predictions)
+
+    def _stitch(
+        self, predictions: dict[Tile, tuple[NDArray, float]]
+    ) -> tuple[NDArray, float, tuple[int, int]]:
+        """
+        Stitch masks predicted in several tiles into a single mask.
+
+        Returns
+        -------
+        tuple of NDArray, float, tuple of int
+            the mask covering all tiles, the lowest score and the offset of the mask
+        """
+        bb = None
+        for tile in predictions.keys():
+            bb = tile.bounding_box() if bb is None else bb.union(tile.bounding_box())
+
+        mask = np.zeros((bb.height, bb.width), dtype=bool)
+        for tile, (tile_mask, _) in predictions.items():
+            y, x = tile.y - bb.top, tile.x - bb.left
+            mask[y : y + tile.height, x : x + tile.width] |= tile_mask.astype(bool)
+
+        score = min(map(lambda prediction: prediction[1], predictions.values()))
+        return mask, score, (bb.left, bb.top)
+
+    def _predict_mask(
+        self,
+        point_coords: Optional[NDArray],
+        point_labels: Optional[NDArray],
+        box: Optional[NDArray],
+        multi_mask: Optional[bool] = None,
+    ) -> tuple[NDArray, float, tuple[int, int]]:
+        """
+        Predict a mask in the image or, if tiled, in the required tiles.
+
+        If tiled, the prompts are scaled to the native resolution of the tiles
+        and the mask is predicted at this resolution (see `tile_scale`).
+
+        Returns
+        -------
+        tuple of NDArray, float, tuple of int
+            the mask, its score and its offset (x, y) in the image
+        """
+        if self.tile_grid is None:
+            self._activate_image()
+            return *self._predict(point_coords, point_labels, box, multi_mask), (0, 0)
+
+        if point_coords is not None:
+            point_coords = point_coords * self.tile_scale
+        if box is not None:
+            box = (box.reshape(-1, 2) * self.tile_scale).reshape(box.shape)
+        return self._predict_tiled(point_coords, point_labels, box, multi_mask)
+
+    def predict(
         self, point_coords: NDArray, point_labels: NDArray, box: NDArray
     ) -> NDArray:
-        mask = self.predict(
-            point_coords=point_coords, point_labels=point_labels, box=box
+        with self._current_embedding():
+            mask, _, offset = self._predict_mask(point_coords, point_labels, box)
+            if self.tile_grid is None:
+                return mask
+            shape, scale = self.image_shape, self.tile_scale
+
+        # the mask predicted in tiles is scaled back to the image
+        x, y = np.rint(np.array(offset) / scale).astype(int)
+        width, height = np.maximum(np.rint(mask.shape[1::-1] / scale), 1).astype(int)
+        mask = cv.resize(
+            mask.astype(np.uint8),
+            (int(width), int(height)),
+            interpolation=cv.INTER_NEAREST,
         )
+
+        full_mask = np.zeros(shape, dtype=bool)
+        full_mask[y : y + height, x : x + width] = mask[: shape[0] - y, : shape[1] - x]
+        return full_mask
+
+    def predict_as_contour(
+        self, point_coords: NDArray, point_labels: NDArray, box: NDArray
+    ) -> NDArray:
+        with self._current_embedding():
+            mask, _, offset = self._predict_mask(point_coords, point_labels, box)
+            scale = self.tile_scale
         mask = mask.astype(np.uint8)
         cnts, _ = cv.findContours(mask, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_SIMPLE)
         areas = list(map(lambda cnt: cv.contourArea(cnt), cnts))
         cnt = cnts[np.argmax(areas)]
-        cnt = cnt[:, 0, :]
-        return cnt
+        cnt = cnt[:, 0, :] + np.array(offset, dtype=cnt.dtype)
+        return to_image_coords(cnt, scale)
 
     def predict_multiple_as_contour(
         self,
         point_coords: NDArray,
         score_threshold: float = 0.5,
         overlap_threshold: float = 0.1,
+        job: Optional[Hashable] = None,
     ) -> NDArray:
-        if self.embedding_thread is None:
-            raise RuntimeError(
-                "Cannot predict mask without computing the embedding first"
-            )
-
-        self.embedding_thread.join()
-
+        """
+        Predict a region for each point and skip regions overlapping previous ones.
+
+        If a `job` is given (e.g., if the points are predicted in chunks), its
+        regions are kept so that regions overlapping the ones of previous chunks
+        are skipped, too. Only new regions are returned. The regions of a job
+        are dropped by `end_bulk_job`.
+        """
         fg_points = []
+        previous = self.bulk_jobs.setdefault(job, []) if job is not None else []
         contours = []
+        version = None
         for point_coord in point_coords:
-            mask, score, _ = self._predictor.predict(
-                point_coords=np.array([point_coord]),
-                point_labels=np.array([1]),
-                multimask_output=False,
-                box=None,
-            )
+            with self._current_embedding():
+                # the points belong to an image which is not displayed anymore
+                if version not in (None, self.embedding_jobs.version):
+                    return [], []
+                version = self.embedding_jobs.version
+
+                mask, score, offset = self._predict_mask(
+                    point_coords=np.array([point_coord]),
+                    point_labels=np.array([1]),
+                    box=None,
+                    multi_mask=False,
+                )
+                scale = self.tile_scale
 
             # skip regions where the model reports a low score
             if score < score_threshold:
                 continue
 
-            _contour = Contour.from_mask(mask[0])
+            _contour = Contour.from_mask(mask)
+            _contour.points = _contour.points + np.array(
+                offset, dtype=_contour.points.dtype
+            )
 
             # skip regions where there is significant overlap with existing regions
             if any(
@@ -156,7 +602,7 @@ class ImagePredictor:
                     lambda contour: contour.intersection_count(_contour)
                     / contour.area()
                     > overlap_threshold,
-                    contours,
+                    previous + contours,
                 )
             ):
                 continue
@@ -164,5 +610,103 @@ class ImagePredictor:
             fg_points.append(point_coord)
             contours.append(_contour)
 
-        contours = list(map(lambda contour: contour.points, contours))
+        previous.extend(contours)
+        # regions are compared at the resolution of the tiles, but returned in the image
+        contours = list(
+            map(lambda contour: to_image_coords(contour.points, scale), contours)
+        )
         return fg_points, contours
+
+    def end_bulk_job(self, job: Hashable) -> None:
+        """
+        Drop the regions kept for a bulk job (see `predict_multiple_as_contour`).
+        """
+        self.bulk_jobs.pop(job, None)
+
+    def _embed_crops(self, crops: list[NDArray]) -> list[dict[str, Any]]:
+        """
+        Get the embeddings of crops from the cache or compute them.
+
+        Crops which are not cached are embedded in batches so that a single
+        run of the encoder processes several of them in parallel.
+
+        Returns
+        -------
+        list of dict
+            the embedding of each crop
+        """
+        keys = [("crop", hashlib.blake2b(crop.tobytes()).hexdigest()) for crop in crops]
+        embeddings = list(map(self.embeddings.get, keys))
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        for start in range(0, len(missing), REFINE_BATCH_SIZE):
+            batch = missing[start : start + REFINE_BATCH_SIZE]
+            self._predictor.set_image_batch([crops[i] for i in batch])
+
+            features = self._predictor._features
+            orig_hw = self._predictor._orig_hw
+            for j, i in enumerate(batch):
+                # split the batch into single image embeddings
+                self._restore_embedding(
+                    {
+                        "features": {
+                            "image_embed": features["image_embed"][j : j + 1],
+                            "high_res_feats": [
+                                feat[j : j + 1] for feat in features["high_res_feats"]
+                            ],
+                        },
+                        "orig_hw": [orig_hw[j]],
+                        "is_batch": False,
+                    }
+                )
+                embeddings[i] = self._cache_embedding(keys[i])
+
+        return embeddings
+
+    def refine_as_contours(
+        self,
+        crops: list[NDArray],
+        prompts: list[tuple[Optional[NDArray], Optional[NDArray], Optional[NDArray]]],
+    ) -> list[Optional[NDArray]]:
+        """
+        Predict the contours of regions inside crops of an image.
+
+        This is used to refine regions at the original resolution of an image.
+        Embeddings of the crops are cached so that repeated refinement is cheap.
+
+        Parameters
+        ----------
+        crops: list of NDArray
+            crops around each region
+        prompts: list of tuples
+            point coordinates, point labels and box of each region in crop coordinates
+
+        Returns
+        -------
+        list of NDArray
+            the contour of each region in crop coordinates or None if the mask is empty
+        """
+        self.init_thread.join()
+
+        masks = []
+        with self.predictor_lock:
+            embeddings = self._embed_crops(crops)
+
+            for embedding, (point_coords, point_labels, box) in zip(
+                embeddings, prompts
+            ):
+                self._restore_embedding(embedding)
+                self.active_embedding = None
+
+                mask, _ = self._predict(point_coords, point_labels, box)
+                masks.append(mask)
+
+        contours = []
+        for mask in masks:
+            mask = mask.astype(np.uint8)
+            if not mask.any():
+                contours.append(None)
+                continue
+
+            contours.append(Contour.from_mask(mask).points)
+        return contours
@@ -1,13 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 import json
 import os
 import time
-from threading import Thread
-from typing import Any, Optional
+import weakref
+from typing import Any, Hashable, Optional
 
 import cv2 as cv
-import diplib as dip
 import numpy as np
+from numpy.typing import NDArray
 from widget_state import (
+    BoolState,
     HigherOrderState,
     StringState,
     ListState,
@@ -17,22 +20,32 @@ from widget_state import (
     FloatState,
 )
 
+from ..image_cache import file_key
+from ..image_source import ArrayImageSource, ImageSource, open_image, read_pixel_size
+from ..lru_cache import LRUCache
 from ..state import (
     BoundingBoxState,
     ResolutionState,
     DisplayImageState,
     ImageState,
+    ImageSourceState,
     ContourState,
     PointState,
+    transaction,
 )
-from ..state.processing import asynchron
+from ..state.processing import BLOCKING_SCHEDULER, asynchron, current_token
 from ..state.util import virtual_list
 
-from .sam import ImagePredictor
-from .util import Geometry, get_active_monitor
+from .candidates import detect_vessel_candidates
+from .evaluation import eval_contours
+from .preprocessing import FittedStage, Pipeline, PreprocessedImageSource, Stage
+from .util import Geometry, fit_resolution, get_active_monitor
+from .jobs import BULK
+from .worker import ProcessImagePredictor
 
 
-IMAGE_PREDICTOR = ImagePredictor()
+# the predictor runs in a worker process so that embeddings do not block the GUI
+IMAGE_PREDICTOR = ProcessImagePredictor()
 
 ALPHA = 0.4
 RGB_COLOR = tuple[int, int, int]
@@ -52,10 +65,65 @@ COLOR_PALETTE: list[RGB_COLOR] = [
 
 UNUSED_VALUE = -100
 
+# margin around a region relative to its size when cropping it for refinement
+REFINE_MARGIN = 0.25
+# crops for refinement are downscaled if they are larger
+REFINE_MAX_SIZE = 1024
+# memory budget (in bytes) of decoded images and their working copies
+# kept for recently opened and preloaded documents
+IMAGE_CACHE_SIZE = 1024**3
+
+
+def close_source(key: Hashable, value: Any) -> None:
+    """
+    Close image sources dropped from the `IMAGE_CACHE`.
+
+    Sources of TIFF files only hold a file handle and count as zero bytes, so
+    they are dropped in least recently used order with the images. A closed
+    source is opened again if it is still read, e.g., by the current document.
+    """
+    if isinstance(value, ImageSource):
+        value.close()
+
+
+IMAGE_CACHE = LRUCache(IMAGE_CACHE_SIZE, on_evict=close_source)
+# size of the image cache in memory budget mode
+MEMORY_BUDGET_IMAGE_CACHE_SIZE = 256 * 1024**2
+# preprocessed working images share the memory budget of the image cache
+PREPROCESSING = Pipeline(IMAGE_CACHE)
+
+
+def get_image_source(filename: str) -> ImageSource:
+    """
+    Open an image source or get it from the `IMAGE_CACHE`.
+    """
+    key = ("source", filename, *file_key(filename).values())
+    image_source = IMAGE_CACHE.get(key)
+    if image_source is None:
+        image_source = open_image(filename)
+        IMAGE_CACHE.put(key, image_source)
+    return image_source
+
+
+def get_image(image_source: ImageSource, resolution: tuple[int, int]) -> NDArray:
+    """
+    Read an image from its source at a resolution or get it from the `IMAGE_CACHE`.
+    """
+    # a weak reference to the source is part of the value because its id may be
+    # reused once it is dropped (the source itself would count to its memory)
+    key = ("image", id(image_source), *resolution)
+    value = IMAGE_CACHE.get(key)
+    if value is not None and value[0]() is image_source:
+        return value[1]
+
+    image = image_source.read(resolution)
+    IMAGE_CACHE.put(key, (weakref.ref(image_source), image))
+    return image
+
 
 class RegionState(HigherOrderState):
 
-    def __init__(self, pt=None, bb=None, cnt=None):
+    def __init__(self, pt=None, bb=None, cnt=None, update=True):
         super().__init__()
 
         self._skip_update = False
@@ -77,6 +145,8 @@ class RegionState(HigherOrderState):
             else BoundingBoxState(*bb)
         )
         self.contour = ContourState() if cnt is None else ContourState.from_numpy(cnt)
+        # contour in original image coordinates computed by `AppState.refine_regions`
+        self.full_resolution_contour = ContourState()
 
         """
         Note: this is a workaround because `asynchron` as a decorator had the bug
@@ -87,50 +157,90 @@ class RegionState(HigherOrderState):
         TODO: replace decorator on instance method with `async_once` on new 
         release of reacTk dependency.
         """
-        self._update_contour_async = asynchron(lambda: self.update_contour())
-        if cnt is None:
-            self._update_contour_async()
+        # predictions wait for the worker (and the embedding), so they do not
+        # run on the threads shared with the computations of the GUI
+        self._update_contour_async = asynchron(
+            lambda: self.update_contour(), scheduler=BLOCKING_SCHEDULER
+        )
+        if cnt is None and update:
+            self.request_update()
 
-        self.foreground_point.on_change(lambda _: self._update_contour_async())
+        self.foreground_point.on_change(lambda _: self.request_update())
         self.background_points.on_change(
-            lambda _: self._update_contour_async(), element_wise=True
+            lambda _: self.request_update(), element_wise=True
         )
-        self.foreground_box.on_change(lambda _: self._update_contour_async())
+        self.foreground_box.on_change(lambda _: self.request_update())
 
-    # @asynchron
-    def update_contour(self):
+    def request_update(self) -> None:
+        """
+        Predict the contour from the prompts in the background.
+
+        Updates are skipped while the region is deserialized. This is checked
+        here and not in the background because the flag may already be reset
+        when the update runs.
+        """
         if self._skip_update:
             return
 
-        with self.contour:
-            self.contour.clear()
+        self._update_contour_async()
 
-            input_points = [
-                self.foreground_point.values(),
-                *map(lambda pt: pt.values(), self.background_points),
-            ]
-            input_labels = [1, *([0] * len(self.background_points))]
-            if self.foreground_point.x.value == UNUSED_VALUE:
-                input_points.pop(0)
-                input_labels.pop(0)
+    def prompts(
+        self,
+    ) -> tuple[Optional[NDArray], Optional[NDArray], Optional[NDArray]]:
+        """
+        Get the prompts of this region for the SAM model.
 
-            input_points = np.array(input_points) if len(input_points) > 0 else None
-            input_labels = np.array(input_labels) if input_points is not None else None
+        Returns
+        -------
+        tuple of NDArray
+            the point coordinates, point labels and box (each None if not used)
+        """
+        input_points = [
+            self.foreground_point.values(),
+            *map(lambda pt: pt.values(), self.background_points),
+        ]
+        input_labels = [1, *([0] * len(self.background_points))]
+        if self.foreground_point.x.value == UNUSED_VALUE:
+            input_points.pop(0)
+            input_labels.pop(0)
+
+        input_points = np.array(input_points) if len(input_points) > 0 else None
+        input_labels = np.array(input_labels) if input_points is not None else None
+
+        if self.foreground_box.x1.value == UNUSED_VALUE:
+            input_box = None
+        else:
+            input_box = np.array([self.foreground_box.tlbr()])
 
-            if self.foreground_box.x1.value == UNUSED_VALUE:
-                input_box = None
-            else:
-                input_box = np.array([self.foreground_box.tlbr()])
+        return input_points, input_labels, input_box
 
-            if input_points is None and input_box is None:
-                return
+    # @asynchron
+    def update_contour(self):
+        # a refined contour is outdated as soon as the prompts change
+        if len(self.full_resolution_contour) > 0:
+            self.full_resolution_contour.clear()
+
+        input_points, input_labels, input_box = self.prompts()
+        if input_points is None and input_box is None:
+            # dependents are only notified if there was a contour
+            if len(self.contour) > 0:
+                self.contour.clear()
+            return
 
-            cnt = IMAGE_PREDICTOR.predict_as_contour(
-                point_coords=input_points,
-                point_labels=input_labels,
-                box=input_box,
-            )
+        # a newer update is waiting - it predicts the contour from the latest prompts
+        if current_token().cancelled:
+            return
 
+        cnt = IMAGE_PREDICTOR.predict_as_contour(
+            point_coords=input_points,
+            point_labels=input_labels,
+            box=input_box,
+        )
+        if current_token().cancelled:
+            return
+
+        with self.contour:
+            self.contour.clear()
             self.contour.extend(ContourState.from_numpy(cnt))
 
     def deserialize(self, data):
@@ -149,7 +259,8 @@ class RegionList(ListState):
             self.clear()
 
             for value in data:
-                region_state = RegionState()
+                # the contour is part of the data and is not predicted again
+                region_state = RegionState(update=False)
                 region_state.deserialize(value)
                 self.append(region_state)
 
@@ -166,6 +277,17 @@ class AppState(HigherOrderState):
         self.pixel_size_y = FloatState(1.0)
         self.pixel_unit = StringState("mm")
 
+        # tiled inference predicts masks at native resolution in overlapping tiles
+        # which are read from the image file instead of in the image resized to
+        # 1024 pixels (defined before the filename so that it is restored before
+        # the image and its regions when loading a state)
+        self.tiled_inference = BoolState(False)
+        self.tile_size = IntState(1024)
+
+        # in memory budget mode, fewer images are cached (the display image is
+        # resized in the background and thus without preallocated buffers)
+        self.memory_budget = BoolState(False)
+
         self.filename = StringState("")
         self.filename.on_change(self.update_pixel_size)
 
@@ -177,96 +299,221 @@ class AppState(HigherOrderState):
         self.filename.on_change(lambda _: self.regions.clear())
         self.filename.on_change(lambda _: self.selected_region_index.set(-1))
 
-        self.original_image = self.load_image(self.filename)
+        # open documents - the regions of a document are kept while another one is
+        # shown and its image is restored from `IMAGE_CACHE` (see `open_document`)
+        self.documents = ListState()
+        self._document_regions: dict[str, list[RegionState]] = {}
+
+        # the image is read lazily so that large slides are never decoded completely
+        self.image_source = self.load_image_source(self.filename)
 
         # original image resolution - is needed for evaluation of region stats in original size
         self.original_resolution = ResolutionState(0, 0)
-        self.original_image.on_change(
-            lambda _: self.original_resolution.set(
-                *self.original_image.value.shape[:2][::-1]
-            ),
+        self.image_source.on_change(
+            lambda _: self.original_resolution.set(*self.image_source.value.resolution),
             trigger=True,
         )
 
         # internal resolution is for internal processing
         # it ensures that the image will be smaller than 1024 pixel so that processing
-        # by the SAM model remains fast
+        # by the SAM model remains fast - also with tiled inference, which only
+        # reads the tiles at native resolution (see `update_embedding`)
         self.internal_resolution = ResolutionState(0, 0)
         self.original_resolution.on_change(
-            lambda _: self.internal_resolution.set(
-                *self.compute_internal_resolution(self.original_resolution)
-            ),
-            trigger=True,
+            lambda _: self.update_internal_resolution(), trigger=True
         )
+        # regions are defined in internal coordinates
+        self.internal_resolution.on_change(lambda _: self.clear_regions())
 
         # canvas resolution
         # this resolution determines the size of the displayed canvas/GUI
         self.canvas_resolution = ResolutionState(1600, 900)
 
-        # TODO: internal resolution must depend on the aspect ratio of the image
-        self.image = self.resize_image(self.original_image, self.internal_resolution)
-        self.image.on_change(lambda _: self.clear_regions)
-        self.image.on_change(
-            lambda state: IMAGE_PREDICTOR.set_image(self.image.value), trigger=True
+        # preprocessing stages (see `preprocessing.py`) applied to the image -
+        # they are fitted on the image at internal resolution and applied to crops
+        # of the original image through `_preprocessed_source`
+        self.preprocessing = ObjectState(())
+        self._preprocessed_source = self.image_source.value
+        self._fitted: list[FittedStage] = []
+
+        # the image at internal resolution read from the level of the image source
+        # that fits best
+        self._image_key = (
+            self.image_source.value,
+            self.internal_resolution.values(),
+            self.preprocessing.value,
         )
-
-        self.colored_regions_image = ImageState(self.draw_regions())
-        self.colored_regions_image.depends_on(
-            [self.image, self.contours], self.draw_regions, element_wise=True
+        self.image = ImageState(
+            self.image_source.value.read(self.internal_resolution.values())
         )
-
-        self.final_image = ImageState(self.highlight_selected_region())
-        self.final_image.depends_on(
-            [self.colored_regions_image, self.contours, self.selected_region_index],
-            self.highlight_selected_region,
-            element_wise=True,
+        self.image_source.on_change(lambda _: self.update_image())
+        self.internal_resolution.on_change(lambda _: self.update_image())
+        self.preprocessing.on_change(lambda _: self.update_image())
+        self.image.on_change(lambda _: self.clear_regions)
+        self.image.on_change(lambda _: self.update_embedding(), trigger=True)
+        self.tiled_inference.on_change(lambda _: self.update_embedding())
+        self.tile_size.on_change(
+            lambda _: self.update_embedding() if self.tiled_inference.value else None
         )
 
+        # regions are drawn as canvas items on top of the image (see `overlay.py`)
         self.display_image = DisplayImageState(
-            image_state=self.final_image,
+            image_state=self.image,
             resolution_state=self.canvas_resolution,
+            asynchronous=True,
+            zoomable=True,
         )
+        # a new image is shown completely
+        self.image_source.on_change(lambda _: self.display_image.view.reset())
+        self.memory_budget.on_change(lambda _: self.apply_memory_budget(), trigger=True)
 
     @computed_state
-    def load_image(self, filename: StringState) -> ImageState:
+    def load_image_source(self, filename: StringState) -> ImageSourceState:
         if filename.value == "":
-            image = np.zeros((1024, 1024, 3), np.uint8)
-        else:
-            image = cv.imread(filename.value)
-            image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
-        return ImageState(image)
+            return ImageSourceState(
+                ArrayImageSource(np.zeros((1024, 1024, 3), np.uint8))
+            )
 
-    def update_pixel_size(self, filename: StringState):
-        dip_img = dip.ImageRead(filename.value)
-        pixel_size = dip_img.PixelSize()
+        return ImageSourceState(get_image_source(filename.value))
+
+    def preload(self, filenames: list[str]) -> None:
+        """
+        Decode images and compute their embeddings in advance.
+
+        The images are read at the internal resolution and stored in the
+        `IMAGE_CACHE` so that opening one of them later does not have to
+        decode it or run the encoder.
+        """
+        for filename in filenames:
+            if filename == self.filename.value:
+                continue
+
+            image_source = get_image_source(filename)
+            image = get_image(
+                image_source, self.compute_internal_resolution(image_source.resolution)
+            )
+            image, _ = PREPROCESSING.run(self.preprocessing.value, image)
+
+            # tiles are only embedded on demand
+            if not self.tiled_inference.value:
+                IMAGE_PREDICTOR.prefetch(image)
 
-        physical_q_x = pixel_size[0]
-        self.pixel_size_x.value = physical_q_x.magnitude
-        self.pixel_unit.value = physical_q_x.units
+    def open_document(self, filename: str) -> None:
+        """
+        Open an image as a document.
+
+        The regions of the current document are kept and restored once it
+        is opened again. Its image, working copy and embedding are kept in
+        caches so that switching between documents does not recompute them.
+        """
+        if filename == self.filename.value:
+            return
+
+        if self.filename.value != "":
+            self._document_regions[self.filename.value] = list(self.regions)
+        if filename not in map(lambda document: document.value, self.documents):
+            self.documents.append(StringState(filename))
 
-        physical_q_y = pixel_size[1]
-        self.pixel_size_y.value = physical_q_y.magnitude
+        self.filename.value = filename
+        if filename in self._document_regions:
+            self.regions.extend(self._document_regions[filename])
+
+    def has_regions(self, filename: str) -> bool:
+        """
+        Test if a document contains regions.
+        """
+        if filename == self.filename.value:
+            return len(self.regions) > 0
+        return len(self._document_regions.get(filename, [])) > 0
+
+    def close_document(self, filename: str) -> None:
+        """
+        Close a document and discard its regions.
+
+        If it is the current document, the most recently opened other
+        document is shown.
+        """
+        self._document_regions.pop(filename, None)
+        for document in self.documents:
+            if document.value == filename:
+                self.documents.remove(document)
+                break
+
+        if filename == self.filename.value:
+            self.filename.value = (
+                self.documents[-1].value if len(self.documents) > 0 else ""
+            )
+            if self.filename.value in self._document_regions:
+                self.regions.extend(self._document_regions[self.filename.value])
+
+    def cache_stats(self) -> dict[str, Any]:
+        """
+        Get hit/miss and memory statistics of the image and embedding caches.
+        """
+        return {
+            "images": asdict(IMAGE_CACHE.stats()),
+            "embeddings": IMAGE_PREDICTOR.cache_stats(),
+        }
+
+    def update_pixel_size(self, filename: StringState):
+        pixel_size_x, pixel_size_y, pixel_unit = read_pixel_size(filename.value)
+        self.pixel_size_x.value = pixel_size_x
+        self.pixel_size_y.value = pixel_size_y
+        self.pixel_unit.value = pixel_unit
 
     def compute_internal_resolution(
-        self, original_resolution: ResolutionState
+        self, original_resolution: tuple[int, int]
     ) -> tuple[int, int]:
-        original_resolution = original_resolution.values()
+        return fit_resolution(original_resolution, max_size=1024)
 
-        max_dim = np.argmax(original_resolution)
-        max_res = min(original_resolution[max_dim], 1024)
+    def update_internal_resolution(self) -> None:
+        self.internal_resolution.set(
+            *self.compute_internal_resolution(self.original_resolution.values())
+        )
 
-        scale = max_res / original_resolution[max_dim]
+    def update_embedding(self) -> None:
+        if not self.tiled_inference.value:
+            IMAGE_PREDICTOR.set_image(self.image.value)
+            return
 
-        width = round(original_resolution[0] * scale)
-        height = round(original_resolution[1] * scale)
+        # the predictor reads tiles from the file and preprocesses them like the image
+        IMAGE_PREDICTOR.set_image(
+            self.image.value,
+            tile_size=self.tile_size.value,
+            filename=self.filename.value,
+            fitted=self._fitted,
+        )
 
-        return width, height
+    def update_image(self) -> None:
+        # a new source usually changes the internal resolution as well so that
+        # both notifications arrive - the image is only read once
+        key = (
+            self.image_source.value,
+            self.internal_resolution.values(),
+            self.preprocessing.value,
+        )
+        if key[0] is self._image_key[0] and key[1:] == self._image_key[1:]:
+            return
 
-    @computed_state
-    def resize_image(
-        self, original_image: ImageState, internal_resolution: ResolutionState
-    ) -> ImageState:
-        return ImageState(cv.resize(original_image.value, internal_resolution.values()))
+        self._image_key = key
+        image, fitted = PREPROCESSING.run(key[2], get_image(key[0], key[1]))
+        self._preprocessed_source = (
+            PreprocessedImageSource(key[0], fitted) if len(fitted) > 0 else key[0]
+        )
+        self._fitted = fitted
+
+        # the embedding is only invalidated if the output actually changes
+        # (e.g., not when normalizing an image that is already normalized)
+        if np.array_equal(image, self.image.value):
+            return
+        self.image.value = image
+
+    def add_preprocessing(self, stage: Stage) -> None:
+        self.preprocessing.value = (*self.preprocessing.value, stage)
+
+    def undo_preprocessing(self) -> None:
+        if len(self.preprocessing.value) > 0:
+            self.preprocessing.value = self.preprocessing.value[:-1]
 
     def configure_canvas_resolution(self, geometry_str: str):
         geometry = Geometry.from_str(geometry_str)
@@ -279,63 +526,34 @@ class AppState(HigherOrderState):
         self.regions.clear()
         self.selected_region_index.value = -1
 
-    def draw_regions(self):
-        colored_regions_image = self.image.value.copy()
-
-        for i, region in enumerate(self.regions):
-            contour = region.contour.to_numpy()
-            if len(contour) == 0:
-                return colored_regions_image
-
-            color = COLOR_PALETTE[i % len(COLOR_PALETTE)]
-
-            x1, y1, w, h = cv.boundingRect(contour)
-            x2, y2 = x1 + w, y1 + h
-
-            _image = np.zeros((h, w, 3), np.uint8)
-            cv.drawContours(_image, [contour], -1, color, -1, offset=(-x1, -y1))
-
-            colored_regions_image[y1:y2, x1:x2] = cv.addWeighted(
-                colored_regions_image[y1:y2, x1:x2], 1.0, _image, ALPHA, 0, 0
-            )
-
-        return colored_regions_image
-
-    def highlight_selected_region(self):
-        image = self.colored_regions_image.value.copy()
-        index = self.selected_region_index.value
+    def apply_memory_budget(self) -> None:
+        enabled = self.memory_budget.value
 
-        if index < 0 or index >= len(self.regions):
-            return image
+        self.display_image.use_buffers(enabled)
 
-        image = cv.drawContours(
-            image,
-            [self.regions[index].contour.to_numpy()],
-            -1,
-            COLOR_BLACK,
-            thickness=3,
+        IMAGE_CACHE.resize(
+            MEMORY_BUDGET_IMAGE_CACHE_SIZE if enabled else IMAGE_CACHE_SIZE
         )
-        return image
 
-    @computed_state
-    def final_image(
-        self, image: ImageState, regions: ListState, selected_region_index: IntState
-    ) -> ImageState:
-        image = image.value.copy()
+    def memory_usage(self) -> dict[str, int]:
+        """
+        Get the memory (in bytes) of the images held by the states, buffers and caches.
 
-        if selected_region_index.value < 0 or selected_region_index.value >= len(
-            regions
-        ):
-            return ImageState(image)
-
-        image = cv.drawContours(
-            image,
-            [regions[selected_region_index.value].contour.to_numpy()],
-            -1,
-            (0, 0, 0),
-            thickness=3,
-        )
-        return ImageState(image)
+        Memory-mapped pixels are not counted and arrays shared by several
+        states (e.g., a cached working copy) are counted for each of them.
+        """
+        return {
+            "image_source": self.image_source.value.nbytes,
+            "image": self.image.value.nbytes,
+            "display_image": self.display_image.display_image_state.value.nbytes
+            + self.display_image._pyramid.nbytes,
+            "buffers": (
+                self.display_image._buffer.nbytes
+                if self.display_image._buffer is not None
+                else 0
+            ),
+            "image_cache": IMAGE_CACHE.stats().bytes,
+        }
 
     def get_selected_region(self) -> RegionState:
         return self.regions[self.selected_region_index.value]
@@ -348,92 +566,182 @@ class AppState(HigherOrderState):
         self.regions.remove(region)
         self.selected_region_index.value = -1
 
-    def eval_regions(self):
-        contours = list(map(lambda cnt: cnt.to_numpy(), self.contours))
+    def crop_region(
+        self, region: RegionState
+    ) -> tuple[NDArray, tuple[NDArray, NDArray, NDArray], NDArray, float]:
+        """
+        Crop the original image around a region with a margin.
+
+        Returns
+        -------
+        tuple
+            the crop, the prompts of the region in crop coordinates,
+            the offset of the crop in the original image and the scale
+            of the crop (crops larger than `REFINE_MAX_SIZE` are downscaled)
+        """
+        scale = np.array(
+            [
+                self.original_resolution.width.value / self.image.value.shape[1],
+                self.original_resolution.height.value / self.image.value.shape[0],
+            ]
+        )
 
-        scale_y = self.original_resolution.height.value / self.image.value.shape[0]
-        scale_x = self.original_resolution.width.value / self.image.value.shape[1]
-
-        table = {
-            "index": [],
-            "category": [],
-            "area": [],
-            "perimeter": [],
-            "cut_off": [],
-            "roundness": [],
-            "circularity": [],
-            "feret_max": [],
-            "feret_min": [],
-            "feret_perp_min": [],
-            "feret_max_angle": [],
-            "feret_min_angle": [],
-            "filename": [],
-        }
-        rows = []
-
-        for i, contour in enumerate(contours, start=1):
-            cut_off_min = (contour <= 0).any()
-            cut_off_max_x = (
-                contour[:, 0].max() >= (self.image.value.shape[1] - 1)
-            ).any()
-            cut_off_max_y = (
-                contour[:, 1].max() >= (self.image.value.shape[0] - 1)
-            ).any()
-            cut_off = cut_off_min or cut_off_max_x or cut_off_max_y
-
-            contour[:, 0] = np.rint(contour[:, 0] * scale_x)
-            contour[:, 1] = np.rint(contour[:, 1] * scale_x)
-
-            label = 1
-            label_img = np.zeros(
-                (
-                    self.original_resolution.height.value,
-                    self.original_resolution.width.value,
-                ),
-                dtype=np.uint8,
-            )
-            label_img = cv.drawContours(
-                label_img, [contour], contourIdx=-1, color=label, thickness=-1
-            )
+        x, y, w, h = cv.boundingRect(region.contour.to_numpy())
+        margin = max(w, h) * REFINE_MARGIN
+        x1, y1 = np.floor((np.array([x, y]) - margin) * scale).astype(int)
+        x2, y2 = np.ceil((np.array([x + w, y + h]) + margin) * scale).astype(int)
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2 = min(x2, self.original_resolution.width.value)
+        y2 = min(y2, self.original_resolution.height.value)
+
+        # only the region is read (from the best fitting level of the source)
+        # and preprocessed like the displayed image
+        crop_scale = min(1.0, REFINE_MAX_SIZE / max(x2 - x1, y2 - y1))
+        crop = self._preprocessed_source.read_region(
+            x1,
+            y1,
+            x2 - x1,
+            y2 - y1,
+            resolution=(round((x2 - x1) * crop_scale), round((y2 - y1) * crop_scale)),
+        )
+
+        offset = np.array([x1, y1])
+        point_coords, point_labels, box = region.prompts()
+        if point_coords is not None:
+            point_coords = (point_coords * scale - offset) * crop_scale
+        if box is not None:
+            box = ((box.reshape(-1, 2) * scale - offset) * crop_scale).reshape(1, 4)
+
+        return crop, (point_coords, point_labels, box), offset, crop_scale
 
-            # convert image to dip and configure pixel size
-            _img = dip.Image(label_img)
-            _img.SetPixelSize(
-                dip.PixelSize(
-                    (
-                        app_state.pixel_size_x.value
-                        * dip.PhysicalQuantity(app_state.pixel_unit.value),
-                        app_state.pixel_size_y.value
-                        * dip.PhysicalQuantity(app_state.pixel_unit.value),
+    def refine_regions(self, regions: list[RegionState]) -> None:
+        """
+        Refine regions at the resolution of the original image.
+
+        The prompts of each region are predicted again in a crop of the original
+        image. The result is stored as the full resolution contour of the region
+        (used for evaluation) and replaces its displayed contour.
+        """
+        regions = list(filter(lambda region: len(region.contour) > 0, regions))
+        if len(regions) == 0:
+            return
+
+        with ThreadPoolExecutor() as executor:
+            crops = list(executor.map(self.crop_region, regions))
+
+        contours = IMAGE_PREDICTOR.refine_as_contours(
+            [crop for crop, *_ in crops], [prompts for _, prompts, *_ in crops]
+        )
+
+        scale = np.array(
+            [
+                self.original_resolution.width.value / self.image.value.shape[1],
+                self.original_resolution.height.value / self.image.value.shape[0],
+            ]
+        )
+        for region, (_, _, offset, crop_scale), contour in zip(
+            regions, crops, contours
+        ):
+            if contour is None:
+                continue
+
+            contour = contour / crop_scale + offset
+            with region.full_resolution_contour:
+                region.full_resolution_contour.clear()
+                region.full_resolution_contour.extend(
+                    ContourState.from_numpy(np.rint(contour))
+                )
+
+            with region.contour:
+                region.contour.clear()
+                region.contour.extend(ContourState.from_numpy(np.rint(contour / scale)))
+
+    def add_grid_regions(self, point_coords: list[tuple[int, int]]) -> None:
+        """
+        Segment a region for each point of a grid and add them.
+
+        This is bulk work which can run in the background while regions are edited.
+        """
+        points, contours = IMAGE_PREDICTOR.predict_multiple_as_contour(point_coords)
+        # the regions are drawn once instead of after each added region
+        with transaction():
+            for pt, cnt in zip(points, contours):
+                self.add_region(RegionState(pt=pt, cnt=cnt))
+
+    def detect_regions(self, refine: bool = False) -> None:
+        """
+        Detect vessels automatically and add them as regions.
+
+        A coarse pass proposes vessel candidates so that the SAM model only
+        has to segment a box around each candidate. Candidates inside of
+        existing regions are skipped.
+        """
+        candidates = detect_vessel_candidates(self.image.value)
+
+        existing = list(map(lambda region: region.contour.to_numpy(), self.regions))
+        existing = list(filter(lambda contour: len(contour) > 0, existing))
+
+        regions = []
+        for candidate in candidates:
+            if any(
+                map(
+                    lambda contour: cv.pointPolygonTest(
+                        contour, candidate.point, measureDist=False
                     )
+                    >= 0,
+                    existing,
                 )
-            )
-            label_img = dip.Label(_img > 0)
+            ):
+                continue
 
-            measures = dip.MeasurementTool.Measure(
-                label_img,
-                features=["Size", "Perimeter", "Feret", "Roundness", "Circularity"],
+            # candidates are bulk work so that edits of regions are served first
+            cnt = IMAGE_PREDICTOR.predict_as_contour(
+                point_coords=None,
+                point_labels=None,
+                box=np.array([candidate.box]),
+                priority=BULK,
             )
+            regions.append(RegionState(bb=candidate.box, cnt=cnt))
+            existing.append(cnt)
 
-            table["filename"].append(self.filename.value)
-            table["index"].append(i)
-            table["category"].append(self.regions[i - 1].label.value)
-            table["area"].append(measures[label]["Size"][0])
-            table["perimeter"].append(measures[label]["Perimeter"][0])
-            table["cut_off"].append(cut_off)
-            table["roundness"].append(measures[label]["Roundness"][0])
-            table["circularity"].append(measures[label]["Circularity"][0])
-            table["feret_max"].append(measures[label]["Feret"][0])
-            table["feret_min"].append(measures[label]["Feret"][1])
-            table["feret_perp_min"].append(measures[label]["Feret"][2])
-            table["feret_max_angle"].append(measures[label]["Feret"][3])
-            table["feret_min_angle"].append(measures[label]["Feret"][4])
-
-        return table
+        if len(regions) == 0:
+            return
+
+        self.regions.extend(regions)
+        self.selected_region_index.value = len(self.regions) - 1
+
+        if refine:
+            self.refine_regions(regions)
+
+    def eval_regions(self):
+        contours = list(map(lambda cnt: cnt.to_numpy(), self.contours))
+        return eval_contours(
+            contours,
+            image_shape=self.image.value.shape,
+            original_resolution=self.original_resolution.values(),
+            pixel_size=(
+                self.pixel_size_x.value,
+                self.pixel_size_y.value,
+                self.pixel_unit.value,
+            ),
+            filename=self.filename.value,
+            categories=list(map(lambda region: region.label.value, self.regions)),
+            refined_contours=list(
+                map(
+                    lambda region: (
+                        region.full_resolution_contour.to_numpy()
+                        if len(region.full_resolution_contour) > 0
+                        else None
+                    ),
+                    self.regions,
+                )
+            ),
+        )
 
     def serialize(self) -> dict[str, Any]:
         data = super().serialize()
         del data["contours"]
+        del data["documents"]
         return data
 
     def save(self):
@@ -443,13 +751,19 @@ class AppState(HigherOrderState):
             json.dump(self.serialize(), f, indent=2)
 
     def load(self, filename: str):
-        with self:
-            with open(filename, mode="r") as f:
-                self.deserialize(json.load(f))
-
-        store = self.selected_region_index.value
-        self.selected_region_index.value = store - 1
-        self.selected_region_index.value = store
+        with open(filename, mode="r") as f:
+            data = json.load(f)
+
+        # other states (e.g., the resolution) clear the regions on change so that
+        # the regions are loaded afterwards
+        regions = data.pop("regions", [])
+        self.deserialize(data)
+
+        # all regions are drawn and the selected region (which was set without
+        # notification) is highlighted once when the transaction commits
+        with transaction():
+            self.regions.deserialize(regions)
+            self.selected_region_index.notify_change()
 
 
 app_state = AppState()
@@ -0,0 +1,156 @@
+"""
+Tiling of large images for SAM inference.
+
+Instead of shrinking an image to 1024 pixels, it is split into overlapping
+tiles at native resolution. Prompts are routed to the tile(s) that contain
+them and masks predicted in several tiles are stitched together.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .contour_util import BoundingBox
+
+
+@dataclass(frozen=True)
+class Tile:
+    x: int
+    y: int
+    width: int
+    height: int
+
+    def slice(self) -> tuple[slice, slice]:
+        return (slice(self.y, self.y + self.height), slice(self.x, self.x + self.width))
+
+    def bounding_box(self) -> BoundingBox:
+        return BoundingBox(self.x, self.y, self.width, self.height)
+
+    def contains(self, x: float, y: float) -> bool:
+        return self.x <= x < self.x + self.width and self.y <= y < self.y + self.height
+
+    def margin(self, x: float, y: float) -> float:
+        """
+        Distance of a point to the closest border of the tile.
+        """
+        return min(
+            x - self.x, self.x + self.width - x, y - self.y, self.y + self.height - y
+        )
+
+
+class TileGrid:
+    """
+    Grid of overlapping tiles covering an image.
+
+    Parameters
+    ----------
+    width: int
+        width of the image
+    height: int
+        height of the image
+    tile_size: int
+        size of each (square) tile
+    overlap: int
+        overlap of neighbouring tiles in pixels
+    """
+
+    def __init__(self, width: int, height: int, tile_size: int, overlap: int) -> None:
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = min(overlap, tile_size // 2)
+
+        self.tiles = [
+            Tile(x, y, min(tile_size, width - x), min(tile_size, height - y))
+            for y in self._starts(height)
+            for x in self._starts(width)
+        ]
+
+    def _starts(self, length: int) -> list[int]:
+        if length <= self.tile_size:
+            return [0]
+
+        stride = self.tile_size - self.overlap
+        starts = list(range(0, length - self.tile_size, stride))
+        # the last tile is aligned with the border of the image
+        starts.append(length - self.tile_size)
+        return starts
+
+    def tile_for_point(self, x: float, y: float) -> Tile:
+        """
+        Get the tile in which a point is farthest from the tile border.
+        """
+        return max(self.tiles, key=lambda tile: tile.margin(x, y))
+
+    def tiles_for_box(self, box: NDArray) -> list[Tile]:
+        """
+        Get the tiles needed to segment a box (x1, y1, x2, y2).
+
+        This is a single tile if one contains the box completely and
+        all tiles intersecting the box otherwise.
+        """
+        x1, y1, x2, y2 = box
+        containing = [
+            tile
+            for tile in self.tiles
+            if tile.x <= x1
+            and x2 <= tile.x + tile.width
+            and tile.y <= y1
+            and y2 <= tile.y + tile.height
+        ]
+        if len(containing) > 0:
+            return [
+                max(
+                    containing,
+                    key=lambda tile: min(tile.margin(x1, y1), tile.margin(x2, y2)),
+                )
+            ]
+
+        bb = BoundingBox(x1, y1, max(x2 - x1, 1), max(y2 - y1, 1))
+        return [tile for tile in self.tiles if tile.bounding_box().intersects(bb)]
+
+    def touches_seam(self, tile: Tile, mask: NDArray) -> bool:
+        """
+        Check if a mask predicted in a tile touches a tile border that is not
+        a border of the image. This means that the region may continue
+        in a neighbouring tile.
+        """
+        return bool(
+            (tile.x > 0 and mask[:, 0].any())
+            or (tile.y > 0 and mask[0, :].any())
+            or (tile.x + tile.width < self.width and mask[:, -1].any())
+            or (tile.y + tile.height < self.height and mask[-1, :].any())
+        )
+
+
+def to_tile_prompts(
+    tile: Tile,
+    point_coords: Optional[NDArray],
+    point_labels: Optional[NDArray],
+    box: Optional[NDArray],
+) -> tuple[Optional[NDArray], Optional[NDArray], Optional[NDArray]]:
+    """
+    Translate prompts into the coordinates of a tile.
+
+    Points outside of the tile are dropped and the box is clipped to the tile.
+    """
+    offset = np.array([tile.x, tile.y])
+
+    if point_coords is not None:
+        inside = np.array([tile.contains(*pt) for pt in point_coords], dtype=bool)
+        point_coords = point_coords[inside] - offset
+        point_labels = point_labels[inside]
+        if len(point_coords) == 0:
+            point_coords, point_labels = None, None
+
+    if box is not None:
+        box = box.reshape(-1, 2) - offset
+        box[:, 0] = np.clip(box[:, 0], 0, tile.width - 1)
+        box[:, 1] = np.clip(box[:, 1], 0, tile.height - 1)
+        box = box.reshape(1, 4)
+
+    return point_coords, point_labels, box
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 
+import numpy as np
 import screeninfo
 
 
@@ -28,3 +29,19 @@ def get_active_monitor(geometry: str | Geometry) -> screeninfo.common.Monitor:
         if monitor.x <= geometry.x < monitor.x + monitor.width:
             return monitor
     return screeninfo.get_monitors()[0]
+
+
+def fit_resolution(resolution: tuple[int, int], max_size: int) -> tuple[int, int]:
+    """
+    Scale a resolution (width, height) so that its largest dimension
+    does not exceed `max_size` while keeping the aspect ratio.
+    """
+    max_dim = np.argmax(resolution)
+    max_res = min(resolution[max_dim], max_size)
+
+    scale = max_res / resolution[max_dim]
+
+    width = round(resolution[0] * scale)
+    height = round(resolution[1] * scale)
+
+    return width, height
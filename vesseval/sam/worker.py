@@ -0,0 +1,370 @@
+"""
+Run the SAM predictor in a dedicated worker process.
+
+Computing an embedding keeps the CPU busy for seconds. If this happens in a
+thread of the GUI process, the encoder contends with the GUI for the GIL and
+the interface stutters. Therefore, the `ImagePredictor` is hosted by a worker
+process. Requests and responses are small tuples sent over a pipe:
+
+  request:  (command, args, kwargs)
+  response: ("ok", result) or ("error", message)
+
+Large arrays (images and masks) are not pickled. They are copied into shared
+memory blocks and only a `SharedArrayRef` is sent. The sender of a block owns
+it and releases it once the peer has answered (or sent the next request).
+
+The worker serves one request at a time. Bulk work is sent in chunks with a
+lower priority than interactive requests so that they are not queued behind
+a large job (see `jobs.py`).
+"""
+
+from __future__ import annotations
+
+import itertools
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Any, NamedTuple, Optional
+
+import numpy as np
+from numpy.typing import NDArray
+
+from .jobs import BULK, INTERACTIVE, EmbeddingJobs, EmbeddingStatus, PriorityLock
+from .preprocessing import FittedStage
+
+# arrays with more bytes than this are transferred via shared memory
+SHARED_MEMORY_THRESHOLD = 64 * 1024
+# number of points or crops of a bulk job sent with a single request
+BULK_CHUNK_SIZE = 4
+
+# commands of the `ImagePredictor` that can be requested from the worker
+COMMANDS = {
+    "set_image",
+    "wait_for_embedding",
+    "predict",
+    "predict_as_contour",
+    "predict_multiple_as_contour",
+    "end_bulk_job",
+    "refine_as_contours",
+    "prefetch",
+    "cache_stats",
+}
+
+
+class SharedArrayRef(NamedTuple):
+    """
+    Picklable reference to an array in a shared memory block.
+    """
+
+    name: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+class SharedArray:
+    """
+    Numpy array backed by a shared memory block.
+    """
+
+    def __init__(
+        self, shm: shared_memory.SharedMemory, shape: tuple[int, ...], dtype: str
+    ) -> None:
+        self.shm = shm
+        self.array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    @classmethod
+    def from_array(cls, array: NDArray) -> SharedArray:
+        shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared_array = cls(shm, array.shape, array.dtype.str)
+        shared_array.array[...] = array
+        return shared_array
+
+    @classmethod
+    def attach(cls, ref: SharedArrayRef) -> SharedArray:
+        return cls(shared_memory.SharedMemory(name=ref.name), ref.shape, ref.dtype)
+
+    def ref(self) -> SharedArrayRef:
+        return SharedArrayRef(self.shm.name, self.array.shape, self.array.dtype.str)
+
+    def release(self, unlink: bool = False) -> None:
+        # the array view has to be dropped before the memory can be closed
+        del self.array
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def encode(value: Any, blocks: list[SharedArray]) -> Any:
+    """
+    Replace large arrays in a (nested) value by references to shared memory.
+
+    Created shared memory blocks are appended to `blocks` so that they can be
+    released by the sender.
+    """
+    if isinstance(value, np.ndarray) and value.nbytes > SHARED_MEMORY_THRESHOLD:
+        shared_array = SharedArray.from_array(value)
+        blocks.append(shared_array)
+        return shared_array.ref()
+
+    if isinstance(value, SharedArrayRef):
+        return value
+
+    if isinstance(value, (list, tuple)):
+        return type(value)(encode(_value, blocks) for _value in value)
+
+    if isinstance(value, dict):
+        return {key: encode(_value, blocks) for key, _value in value.items()}
+
+    return value
+
+
+def decode(value: Any) -> Any:
+    """
+    Resolve references to shared memory in a (nested) value into arrays.
+
+    The arrays are copied so that the shared memory can be released by its owner.
+    """
+    if isinstance(value, SharedArrayRef):
+        shared_array = SharedArray.attach(value)
+        array = shared_array.array.copy()
+        shared_array.release()
+        return array
+
+    if isinstance(value, (list, tuple)):
+        return type(value)(decode(_value) for _value in value)
+
+    if isinstance(value, dict):
+        return {key: decode(_value) for key, _value in value.items()}
+
+    return value
+
+
+def release(blocks: list[SharedArray]) -> None:
+    for block in blocks:
+        block.release(unlink=True)
+    blocks.clear()
+
+
+def serve(connection: Connection) -> None:
+    """
+    Main loop of the worker process.
+
+    Requests are handled one after another until the pipe is closed
+    or `None` is received.
+    """
+    # imported here so that only the worker process loads torch and the model
+    from .sam import ImagePredictor
+
+    predictor = ImagePredictor()
+    blocks: list[SharedArray] = []
+
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+
+        # the peer has consumed the previous response
+        release(blocks)
+
+        if request is None:
+            break
+
+        command, args, kwargs = request
+        try:
+            if command not in COMMANDS:
+                raise ValueError(f"Unknown command <{command}>")
+
+            result = getattr(predictor, command)(*decode(args), **decode(kwargs))
+            connection.send(("ok", encode(result, blocks)))
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+
+    release(blocks)
+
+
+class ProcessImagePredictor:
+    """
+    Drop-in replacement of the `ImagePredictor` that runs it in a worker process.
+
+    Requests are serialized by a priority lock so that the methods can be called
+    from multiple threads (e.g., `asynchron` contour updates) and interactive
+    requests are served before queued bulk work.
+    """
+
+    def __init__(self) -> None:
+        # spawn (instead of fork) so that the worker does not inherit the tkinter state
+        context = mp.get_context("spawn")
+
+        self._connection, connection_worker = context.Pipe()
+        self._lock = PriorityLock()
+        # ids of bulk jobs whose regions are kept by the worker
+        self._bulk_jobs = itertools.count()
+
+        self.process = context.Process(
+            target=serve,
+            args=(connection_worker,),
+            name="SAM Worker",
+            daemon=True,
+        )
+        self.process.start()
+        connection_worker.close()
+
+        # images are transferred in a background thread so that the GUI thread is
+        # never blocked by a request that waits for a running embedding
+        self.embedding_jobs = EmbeddingJobs(self._set_image_sync, name="Set Image")
+
+    def request(
+        self, command: str, *args: Any, priority: int = INTERACTIVE, **kwargs: Any
+    ) -> Any:
+        blocks: list[SharedArray] = []
+        try:
+            with self._lock.hold(priority):
+                self._connection.send(
+                    (command, encode(args, blocks), encode(kwargs, blocks))
+                )
+                status, result = self._connection.recv()
+                result = decode(result)
+        finally:
+            release(blocks)
+
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def set_image(
+        self,
+        image: NDArray,
+        tile_size: Optional[int] = None,
+        filename: Optional[str] = None,
+        fitted: Optional[list[FittedStage]] = None,
+    ) -> int:
+        return self.embedding_jobs.submit(
+            image, tile_size=tile_size, filename=filename, fitted=fitted
+        )
+
+    def _set_image_sync(
+        self,
+        image: NDArray,
+        tile_size: Optional[int] = None,
+        filename: Optional[str] = None,
+        fitted: Optional[list[FittedStage]] = None,
+    ) -> None:
+        # tiles are read by the worker from the file, only the image set is sent
+        self.request(
+            "set_image", image, tile_size=tile_size, filename=filename, fitted=fitted
+        )
+        # the job only ends once the worker computed the embedding so that
+        # its status is exact
+        self.request("wait_for_embedding")
+
+    def _wait_for_image(self) -> None:
+        # ensure that a prediction is not requested before the latest image
+        self.embedding_jobs.wait()
+
+    def embedding_status(self) -> EmbeddingStatus:
+        """
+        Get the version of the latest image and of the latest embedded image.
+        """
+        return self.embedding_jobs.status()
+
+    def predict(
+        self,
+        point_coords: NDArray,
+        point_labels: NDArray,
+        box: NDArray,
+        priority: int = INTERACTIVE,
+    ) -> NDArray:
+        self._wait_for_image()
+        return self.request(
+            "predict",
+            point_coords=point_coords,
+            point_labels=point_labels,
+            box=box,
+            priority=priority,
+        )
+
+    def predict_as_contour(
+        self,
+        point_coords: NDArray,
+        point_labels: NDArray,
+        box: NDArray,
+        priority: int = INTERACTIVE,
+    ) -> NDArray:
+        self._wait_for_image()
+        return self.request(
+            "predict_as_contour",
+            point_coords=point_coords,
+            point_labels=point_labels,
+            box=box,
+            priority=priority,
+        )
+
+    def predict_multiple_as_contour(
+        self,
+        point_coords: NDArray,
+        score_threshold: float = 0.5,
+        overlap_threshold: float = 0.1,
+    ) -> NDArray:
+        """
+        Predict a region for each point as bulk work in chunks of points.
+
+        The regions predicted for previous chunks are kept by the worker
+        under the id of the job so that they are not sent with every chunk.
+        """
+        self._wait_for_image()
+        version = self.embedding_jobs.version
+        job = next(self._bulk_jobs)
+
+        fg_points, contours = [], []
+        try:
+            for start in range(0, len(point_coords), BULK_CHUNK_SIZE):
+                # the points belong to an image which is not displayed anymore
+                if self.embedding_jobs.version != version:
+                    return [], []
+
+                _fg_points, _contours = self.request(
+                    "predict_multiple_as_contour",
+                    point_coords[start : start + BULK_CHUNK_SIZE],
+                    score_threshold=score_threshold,
+                    overlap_threshold=overlap_threshold,
+                    job=job,
+                    priority=BULK,
+                )
+                fg_points.extend(_fg_points)
+                contours.extend(_contours)
+        finally:
+            self.request("end_bulk_job", job, priority=BULK)
+        return fg_points, contours
+
+    def refine_as_contours(
+        self,
+        crops: list[NDArray],
+        prompts: list[tuple[Optional[NDArray], Optional[NDArray], Optional[NDArray]]],
+    ) -> list[Optional[NDArray]]:
+        """
+        Refine regions in crops as bulk work in chunks of crops.
+        """
+        contours = []
+        for start in range(0, len(crops), BULK_CHUNK_SIZE):
+            contours.extend(
+                self.request(
+                    "refine_as_contours",
+                    crops[start : start + BULK_CHUNK_SIZE],
+                    prompts[start : start + BULK_CHUNK_SIZE],
+                    priority=BULK,
+                )
+            )
+        return contours
+
+    def prefetch(self, image: NDArray) -> None:
+        # the worker computes the embedding in the background and replies immediately
+        self.request("prefetch", image, priority=BULK)
+
+    def cache_stats(self) -> dict[str, Any]:
+        return self.request("cache_stats")
+
+    def close(self) -> None:
+        with self._lock.hold():
+            self._connection.send(None)
+        self.process.join()
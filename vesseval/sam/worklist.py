@@ -0,0 +1,81 @@
+"""
+A worklist of images that are annotated one after another.
+
+While an image is annotated, the next images of the worklist are decoded
+and embedded in the background (see `AppState.preload`) so that switching
+to the next image does not make the user wait.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from widget_state import HigherOrderState, IntState, StringState
+
+from ..image_source import list_images
+from .state import AppState, app_state
+
+# number of images following the current one which are preloaded
+PREFETCH_DEPTH = 2
+
+
+class WorklistState(HigherOrderState):
+
+    def __init__(self, app_state: AppState, depth: int = PREFETCH_DEPTH):
+        super().__init__()
+
+        self._app_state = app_state
+        self._depth = depth
+        self._filenames: list[str] = []
+        # the document opened by the worklist, closed again when stepping on
+        # unless it was already open or has been annotated
+        self._document: str = ""
+        # a single thread so that preloading never competes with itself
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Preload")
+
+        self.directory = StringState("")
+        self.index = IntState(-1)
+
+        self.directory.on_change(lambda _: self.load_directory())
+        self.index.on_change(lambda _: self.open_current())
+
+    def load_directory(self) -> None:
+        if self.directory.value == "":
+            return
+
+        self._filenames = list_images(self.directory.value)
+
+        index = 0 if len(self._filenames) > 0 else -1
+        if self.index.value == index:
+            self.open_current()
+        else:
+            self.index.value = index
+
+    def open_current(self) -> None:
+        if self.index.value < 0:
+            return
+
+        previous = self._document
+        filename = self._filenames[self.index.value]
+        documents = [document.value for document in self._app_state.documents]
+
+        self._app_state.open_document(filename)
+        self._document = "" if filename in documents else filename
+        if previous not in ("", filename) and not self._app_state.has_regions(previous):
+            self._app_state.close_document(previous)
+        self.prefetch()
+
+    def prefetch(self) -> None:
+        start = self.index.value + 1
+        self._executor.submit(
+            self._app_state.preload, self._filenames[start : start + self._depth]
+        )
+
+    def next(self) -> None:
+        if self.index.value + 1 < len(self._filenames):
+            self.index.value = self.index.value + 1
+
+    def previous(self) -> None:
+        if self.index.value > 0:
+            self.index.value = self.index.value - 1
+
+
+worklist = WorklistState(app_state)
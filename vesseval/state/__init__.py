@@ -4,15 +4,31 @@ States enable a reactive implementation of widgets.
 
 from .bounding_box import BoundingBoxState
 from .contour import ContourState
-from .image import DisplayImageState, ImageState, ResolutionState, ImageConfigState
+from .image import (
+    DisplayImageState,
+    DoubleBuffer,
+    ImageState,
+    ImageSourceState,
+    ResolutionState,
+    ImageConfigState,
+)
+from . import notify
 from .point import PointState
+from .transaction import in_transaction, transaction
+
+# notifications of states are batched in transactions and can be profiled
+notify.install()
 
 __all__ = [
     "BoundingBoxState",
     "ContourState",
     "DisplayImageState",
+    "DoubleBuffer",
     "ImageState",
+    "ImageSourceState",
     "ImageConfigState",
     "ResolutionState",
     "PointState",
+    "in_transaction",
+    "transaction",
 ]
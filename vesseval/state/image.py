@@ -16,6 +16,15 @@ from widget_state import (
     StringState,
 )
 
+from ..image_source import ImageSource
+from .memoize import memoized
+from .processing import async_computed_state
+
+# color of the display outside of a zoomed image
+BACKGROUND = (117, 117, 117)
+# maximal zoom relative to the resolution at which an image fits
+MAX_ZOOM = 32.0
+
 
 class ImageConfigState(HigherOrderState):
     def __init__(self) -> None:
@@ -25,11 +34,104 @@ class ImageConfigState(HigherOrderState):
         self.size_unit = StringState("μm")
 
 
+class DoubleBuffer:
+    """
+    Two preallocated image buffers which are used alternately.
+
+    A computation writes its result into the back buffer which then becomes
+    the front buffer. Thus, the previous result stays valid for its consumers
+    (e.g., a pending redraw) and repeated computations do not allocate memory.
+    """
+
+    def __init__(self) -> None:
+        self._buffers: list[Optional[NDArray]] = [None, None]
+        self._index = 0
+
+    def next(self, shape: Tuple[int, ...], dtype: np.dtype = np.uint8) -> NDArray:
+        """
+        Get the back buffer with the given shape (it is only reallocated if
+        the shape changes).
+        """
+        self._index = 1 - self._index
+        buffer = self._buffers[self._index]
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype)
+            self._buffers[self._index] = buffer
+        return buffer
+
+    def clear(self) -> None:
+        self._buffers = [None, None]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self._buffers if buffer is not None)
+
+
 class ImageState(ObjectState):
     def __init__(self, value: NDArray[np.uint8]) -> None:
         super().__init__(value)
 
 
+class ImageSourceState(ObjectState):
+    def __init__(self, value: ImageSource) -> None:
+        super().__init__(value)
+
+
+class ImagePyramid:
+    """
+    Mipmap pyramid of an image - each level halves the resolution of the previous.
+
+    Levels are computed lazily when they are needed and are kept until the
+    pyramid is cleared (e.g., because the image changed). The levels are
+    replaced at once so that a pyramid can be cleared while levels are
+    computed in the background and they are never mixed with those of
+    another image.
+    """
+
+    def __init__(self) -> None:
+        self._levels: list[NDArray] = []
+
+    def level(self, image: NDArray, scale: float) -> tuple[NDArray, int]:
+        """
+        Get the smallest level of an image which is at least as large as the
+        image scaled by `scale`.
+
+        Returns
+        -------
+        tuple of NDArray and int
+            the level and the factor by which it is downsampled
+        """
+        levels = self._levels
+        if len(levels) == 0 or levels[0] is not image:
+            levels = [image]
+
+        index = 0
+        while scale * 2 ** (index + 1) <= 1.0:
+            level = levels[index]
+            if min(level.shape[:2]) < 2:
+                break
+
+            if index + 1 == len(levels):
+                height, width = level.shape[:2]
+                levels = levels + [
+                    cv.resize(
+                        level, (width // 2, height // 2), interpolation=cv.INTER_AREA
+                    )
+                ]
+            index += 1
+
+        self._levels = levels
+        return levels[index], 2**index
+
+    def clear(self) -> None:
+        self._levels = []
+
+    @property
+    def nbytes(self) -> int:
+        # the first level is the image itself
+        return sum(level.nbytes for level in self._levels[1:])
+
+
 class ResolutionState(DictState):
     def __init__(self, width: int | IntState, height: int | IntState) -> None:
         """
@@ -41,16 +143,61 @@ class ResolutionState(DictState):
         self.height = IntState(height) if isinstance(height, int) else height
 
 
+class ViewState(HigherOrderState):
+    def __init__(self) -> None:
+        """
+        State of the view of a zoomable image.
+
+        The zoom is relative to the resolution at which the image fits and
+        the position of the image at the center of the view is relative to
+        the size of the image.
+        """
+        super().__init__()
+
+        self.zoom = FloatState(1.0)
+        self.x = FloatState(0.5)
+        self.y = FloatState(0.5)
+
+    def reset(self) -> None:
+        with self:
+            self.zoom.value = 1.0
+            self.x.value = 0.5
+            self.y.value = 0.5
+
+
 class DisplayImageState(HigherOrderState):
     def __init__(
         self,
         image_state: ImageState,
         resolution_state: Optional[ResolutionState] = None,
         interpolation: int = cv.INTER_NEAREST,
+        asynchronous: bool = False,
+        memoize: bool = False,
+        zoomable: bool = False,
     ) -> None:
+        """
+        State of an image resized to fit a resolution for display.
+
+        If `asynchronous`, the display image is resized in the background
+        (see `async_computed_state`). If `memoize`, recently resized images
+        are reused (see `memoized`) so that memoized computations depending
+        on the display image hit their cache. In both cases, buffers cannot
+        be used (see `use_buffers`).
+
+        If `zoomable`, the image can be zoomed and panned (see `view`). Then,
+        the display image is rendered from an `ImagePyramid` so that the cost
+        depends on the resolution of the display only. Once zoomed, the
+        display image covers the whole resolution and is rendered from the
+        visible part of the image.
+        """
         super().__init__()
 
         self._interpolation = interpolation
+        self._asynchronous = asynchronous
+        self._memoize = memoize
+        # the display image is resized into preallocated buffers if enabled
+        self._buffer: Optional[DoubleBuffer] = None
+        self._pyramid = ImagePyramid() if zoomable else None
         self.image_state = image_state
         self.resolution_state = (
             resolution_state
@@ -60,10 +207,24 @@ class DisplayImageState(HigherOrderState):
                 height=self.image_state.value.shape[0],
             )
         )
+        self.view = ViewState()
         self.scale_state = self.scale_state(self.image_state, self.resolution_state)
-        self.display_image_state = self.display_image_state(
-            self.image_state, self.scale_state
-        )
+
+        _computed_state = async_computed_state if asynchronous else computed_state
+        _resize = DisplayImageState.resize
+        if memoize:
+            _resize = memoized()(_resize)
+        if zoomable:
+            # registered before the display image is computed so that it is
+            # computed from the new image
+            self.image_state.on_change(lambda _: self._pyramid.clear())
+            self.display_image_state = _computed_state(_resize)(
+                self, self.image_state, self.scale_state, self.view
+            )
+        else:
+            self.display_image_state = _computed_state(_resize)(
+                self, self.image_state, self.scale_state
+            )
 
     @computed_state
     def scale_state(
@@ -77,19 +238,80 @@ class DisplayImageState(HigherOrderState):
         scale = min(scale_x, scale_y)
         return FloatState(scale)
 
-    @computed_state
-    def display_image_state(
-        self, image_state: ImageState, scale_state: FloatState
+    def resize(
+        self,
+        image_state: ImageState,
+        scale_state: FloatState,
+        view: Optional[ViewState] = None,
     ) -> ImageState:
-        scale = scale_state.value
+        image = image_state.value
+        if view is not None:
+            if view.zoom.value > 1.0:
+                return ImageState(self.render_view())
+
+            # the fitted image is resized from the closest level of the pyramid
+            image, _ = self._pyramid.level(image, scale_state.value)
+
+        height, width = image_state.value.shape[:2]
+        size = (
+            max(round(width * scale_state.value), 1),
+            max(round(height * scale_state.value), 1),
+        )
+        dst = (
+            self._buffer.next(size[::-1] + image.shape[2:], image.dtype)
+            if self._buffer is not None
+            else None
+        )
         return ImageState(
-            cv.resize(
-                image_state.value,
-                None,
-                fx=scale,
-                fy=scale,
-                interpolation=self._interpolation,
-            )
+            cv.resize(image, size, dst=dst, interpolation=self._interpolation)
+        )
+
+    def render_view(self) -> NDArray:
+        """
+        Render the visible part of a zoomed image at the resolution of the display.
+        """
+        width, height = self.resolution_state.values()
+        image, factor = self._pyramid.level(
+            self.image_state.value, self.scale_state.value * self.view.zoom.value
+        )
+
+        # the transform is applied to coordinates in the level of the pyramid
+        transform = self.transform()
+        transform[:, :2] = transform[:, :2] * factor
+
+        return cv.warpAffine(
+            image,
+            transform,
+            (width, height),
+            dst=(
+                self._buffer.next((height, width) + image.shape[2:], image.dtype)
+                if self._buffer is not None
+                else None
+            ),
+            # area interpolation is not supported by affine transformations
+            flags=(
+                cv.INTER_LINEAR
+                if self._interpolation == cv.INTER_AREA
+                else self._interpolation
+            ),
+            borderMode=cv.BORDER_CONSTANT,
+            borderValue=BACKGROUND,
+        )
+
+    def use_buffers(self, enabled: bool) -> None:
+        """
+        Enable resizing the display image into preallocated buffers.
+
+        Buffers are not used if the display image is memoized because
+        cached images would be overwritten. They are not used if the display
+        image is resized asynchronously either: the next resize may already
+        run while the displayed image and a published, but not yet delivered
+        image are in use, so that it would overwrite the displayed image.
+        """
+        self._buffer = (
+            DoubleBuffer()
+            if enabled and not (self._memoize or self._asynchronous)
+            else None
         )
 
     def copy(self) -> DisplayImageState:
@@ -98,25 +320,88 @@ class DisplayImageState(HigherOrderState):
             ResolutionState(*self.resolution_state.values()),
         )
 
-    def to_image_coords(self, x, y):
-        shape = self.display_image_state.value.shape
+    @property
+    def zoomed(self) -> bool:
+        return self._pyramid is not None and self.view.zoom.value > 1.0
+
+    def transform(self) -> NDArray:
+        """
+        Get the affine transformation (2x3 matrix) from image to display coordinates.
+        """
+        width, height = self.resolution_state.values()
+        scale = self.scale_state.value
 
-        t_x = (self.resolution_state.width.value - shape[1]) // 2
-        t_y = (self.resolution_state.height.value - shape[0]) // 2
+        if not self.zoomed:
+            # the fitted image is centered - its size is computed like in `resize`
+            # so that it is known before an asynchronous resize is done
+            shape = self.image_state.value.shape
+            t_x = (width - max(round(shape[1] * scale), 1)) // 2
+            t_y = (height - max(round(shape[0] * scale), 1)) // 2
+            return np.array([[scale, 0.0, t_x], [0.0, scale, t_y]])
 
-        x = round((x - t_x) / self.scale_state.value)
-        y = round((y - t_y) / self.scale_state.value)
-        return x, y
+        scale = scale * self.view.zoom.value
+        shape = self.image_state.value.shape
+        t_x = width / 2 - scale * self.view.x.value * shape[1]
+        t_y = height / 2 - scale * self.view.y.value * shape[0]
+        return np.array([[scale, 0.0, t_x], [0.0, scale, t_y]])
+
+    def to_image_coords(self, x, y):
+        x, y = cv.invertAffineTransform(self.transform()) @ np.array([x, y, 1.0])
+        return round(x), round(y)
 
     def to_display(self, x, y):
-        shape = self.display_image_state.value.shape
-        scale = self.scale_state.value
+        x, y = self.transform() @ np.array([x, y, 1.0])
+        return round(x), round(y)
+
+    def zoom_at(self, x: int, y: int, factor: float) -> None:
+        """
+        Zoom by a factor while the image at the display coordinates (x, y) stays in place.
+        """
+        if self._pyramid is None:
+            return
+
+        zoom = min(max(self.view.zoom.value * factor, 1.0), MAX_ZOOM)
+        if zoom == 1.0:
+            self.view.reset()
+            return
 
-        t_x = (self.resolution_state.width.value - shape[1]) // 2
-        t_y = (self.resolution_state.height.value - shape[0]) // 2
+        # the point under the cursor is kept at its position on the display
+        height, width = self.image_state.value.shape[:2]
+        image_x, image_y = cv.invertAffineTransform(self.transform()) @ np.array(
+            [x, y, 1.0]
+        )
+        scale = self.scale_state.value * zoom
+        resolution = self.resolution_state.values()
+        center_x = image_x + (resolution[0] / 2 - x) / scale
+        center_y = image_y + (resolution[1] / 2 - y) / scale
 
-        x = round(x * scale + t_x)
-        y = round(y * scale + t_y)
-        return x, y
+        with self.view:
+            self.view.zoom.value = zoom
+            self.move_to(center_x / width, center_y / height)
 
+    def pan(self, dx: int, dy: int) -> None:
+        """
+        Move the view of a zoomed image by an offset in display coordinates.
+        """
+        if not self.zoomed:
+            return
+
+        height, width = self.image_state.value.shape[:2]
+        scale = self.scale_state.value * self.view.zoom.value
+        with self.view:
+            self.move_to(
+                self.view.x.value - dx / (scale * width),
+                self.view.y.value - dy / (scale * height),
+            )
 
+    def move_to(self, x: float, y: float) -> None:
+        # the view is kept inside of the image
+        resolution = self.resolution_state.values()
+        shape = self.image_state.value.shape
+        scale = self.scale_state.value * self.view.zoom.value
+        for state, value, size, image_size in zip(
+            (self.view.x, self.view.y), (x, y), resolution, (shape[1], shape[0])
+        ):
+            # half of the view relative to the image size
+            half = size / (2 * scale * image_size)
+            state.value = 0.5 if half >= 0.5 else min(max(value, half), 1.0 - half)
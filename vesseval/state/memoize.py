@@ -0,0 +1,146 @@
+"""
+Memoization of computed states.
+
+A computed state is computed anew whenever one of its input states changes,
+even if the inputs return to values for which the result was just computed
+(e.g., a slider is moved back and forth). The `memoized` decorator keeps the
+recent results of a computation in a small LRU cache per node (the instance
+of a state class or the function) keyed by the values of the inputs.
+
+Example:
+    @computed_state
+    @memoized(max_entries=16)
+    def process(self, image: ImageState, size: IntState) -> ImageState:
+        ...
+
+Images (numpy arrays) are keyed by their identity instead of hashing their
+content. A memoized computation returns the identical array for the same
+inputs, so that memoized computations depending on it hit their cache, too.
+Thus, arrays must not be modified in place (e.g., by
+`DisplayImageState.use_buffers`). The cache only keeps weak references to
+input arrays and a result is not used anymore once one of them is gone.
+"""
+
+from __future__ import annotations
+
+import functools
+import weakref
+from typing import Any, Callable, Hashable, ParamSpec, TypeVar
+
+import numpy as np
+from widget_state import BasicState, ListState, State
+
+from ..lru_cache import LRUCache, nbytes
+
+T = TypeVar("T", bound=BasicState)
+P = ParamSpec("P")
+
+# default limits of the cache of a node
+MAX_ENTRIES = 8
+MAX_BYTES = 128 * 1024**2
+
+
+def state_key(state: State, objects: list[Any]) -> Hashable:
+    """
+    Compute a key of the value of a state.
+
+    Values which are keyed by their identity (arrays and unhashable objects)
+    are appended to `objects` (arrays as weak references) so that the key can
+    be validated (see `alive`).
+    """
+    if isinstance(state, BasicState):
+        value = state.value
+        if isinstance(value, np.ndarray):
+            objects.append(weakref.ref(value))
+            return ("array", id(value))
+
+        try:
+            hash(value)
+            return value
+        except TypeError:
+            objects.append(value)
+            return ("object", id(value))
+
+    if isinstance(state, ListState):
+        return tuple(state_key(elem, objects) for elem in state)
+
+    # higher order states are keyed by the values of their attributes
+    return tuple(
+        (name, state_key(value, objects))
+        for name, value in vars(state).items()
+        if name[0] != "_" and isinstance(value, State)
+    )
+
+
+def alive(objects: list[Any]) -> bool:
+    """
+    Check that the objects of a key are alive so that their ids are not reused.
+    """
+    return all(not isinstance(obj, weakref.ref) or obj() is not None for obj in objects)
+
+
+def memoized(
+    max_entries: int = MAX_ENTRIES, max_bytes: int = MAX_BYTES
+) -> Callable[[Callable[P, T]], Callable[P, T]]:
+    """
+    Memoize a function computing a state from other states.
+
+    Parameters
+    ----------
+    max_entries: int
+        maximum number of results cached per node
+    max_bytes: int
+        memory budget of the results cached per node in bytes
+    """
+
+    def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        # the cache of a method is an attribute of the instance
+        attr = f"_memoized_{func.__name__}"
+        _cache = None
+
+        def get_cache(instance: Any) -> LRUCache:
+            nonlocal _cache
+            cache = _cache if instance is None else instance.__dict__.get(attr)
+            if cache is None:
+                # only the result (not the referenced inputs) counts as memory
+                cache = LRUCache(
+                    max_bytes,
+                    size_of=lambda entry: nbytes(entry[2]),
+                    max_entries=max_entries,
+                )
+                if instance is None:
+                    _cache = cache
+                else:
+                    instance.__dict__[attr] = cache
+            return cache
+
+        def compute(instance: Any, args: tuple) -> T:
+            objects: list[Any] = []
+            key = tuple(state_key(arg, objects) for arg in args)
+
+            cache = get_cache(instance)
+            entry = cache.get(key)
+            if entry is not None and alive(entry[0]):
+                _, state_type, value = entry
+                return state_type(value)
+
+            result = func(*args) if instance is None else func(instance, *args)
+            cache.put(key, (objects, type(result), result.value))
+            return result
+
+        # `computed_state` checks whether the first argument is called `self`
+        if func.__code__.co_varnames[0] == "self":
+
+            @functools.wraps(func)
+            def wrapper(self, *args):
+                return compute(self, args)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args):
+                return compute(None, args)
+
+        return wrapper
+
+    return decorator
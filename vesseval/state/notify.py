@@ -0,0 +1,37 @@
+"""
+Notification of state changes.
+
+`widget_state` calls the callbacks of a state directly in
+`State.notify_change`. vesseval replaces it with a single wrapper which
+  * collects notifications inside of transactions (see `transaction.py`)
+  * records recomputes if the profiler is enabled (see `profiler.py`)
+
+The wrapper is installed once by `install` when `vesseval.state` is imported.
+"""
+
+from widget_state import State
+
+from .profiler import PROFILER
+from .transaction import collect
+
+_notify_change = State.notify_change
+
+
+def notify_change(self: State) -> None:
+    if not self._active:
+        return
+
+    if collect(self):
+        return
+
+    if PROFILER.enabled:
+        PROFILER.notify_change(self)
+    else:
+        _notify_change(self)
+
+
+def install() -> None:
+    """
+    Replace `State.notify_change` by the wrapper (repeated calls have no effect).
+    """
+    State.notify_change = notify_change
@@ -1,12 +1,282 @@
+"""
+Run state callbacks in the background without creating a thread per call.
+
+All background work is submitted to a shared `Scheduler` with a bounded
+pool of threads. Tasks are submitted under a key: a task submitted while
+another one with the same key waits replaces it ("latest wins") and tasks
+with the same key never run at the same time. Superseded tasks are signalled
+by a `CancellationToken` so that a long running task can stop early.
+
+Results can be delivered on the GUI thread once the scheduler is attached
+to a tkinter widget (see `Scheduler.attach`).
+
+Tasks which block for long (e.g., waiting for a prediction of the SAM worker)
+are run by the `BLOCKING_SCHEDULER` so that they cannot occupy the threads
+of the `SCHEDULER` and delay the computations of the GUI (e.g., resizing
+the display image).
+"""
+
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 import functools
+import heapq
+import itertools
+import os
+import queue
 import threading
 import time
-from typing import Any, Callable, Generic, Optional, TypeVar, ParamSpec
+import traceback
+from typing import Any, Callable, Generic, Hashable, Optional, TypeVar, ParamSpec
+
+from .profiler import PROFILER
 
 T = TypeVar("T")
 P = ParamSpec("P")
 
+# interval in milliseconds in which results are delivered on the GUI thread
+DELIVERY_INTERVAL = 10
+
+
+class CancellationToken:
+    """
+    Token signalling that a task is superseded by a newer one.
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+_local = threading.local()
+
+
+def current_token() -> CancellationToken:
+    """
+    Get the cancellation token of the task running in the current thread.
+
+    Outside of a task, a token that is never cancelled is returned.
+    """
+    token = getattr(_local, "token", None)
+    return token if token is not None else CancellationToken()
+
+
+@dataclass
+class SchedulerStats:
+    # tasks submitted
+    submitted: int
+    # tasks replaced by a newer task with the same key before they ran
+    dropped: int
+    # tasks that ran (successfully or not)
+    completed: int
+    # tasks that raised an exception
+    failed: int
+
+    def __str__(self) -> str:
+        return (
+            f"{self.submitted} submitted, {self.dropped} dropped,"
+            f" {self.completed} completed, {self.failed} failed"
+        )
+
+
+@dataclass
+class Task:
+    func: Callable[..., Any]
+    args: tuple
+    kwargs: dict[str, Any]
+    token: CancellationToken
+    callback: Optional[Callable[[Any], None]]
+
+
+class Scheduler:
+    """
+    Bounded pool of threads running tasks with per-key latest-wins semantics.
+
+    Parameters
+    ----------
+    max_workers: int
+        maximum number of threads
+    name: str
+        prefix of the names of the threads
+    """
+
+    def __init__(
+        self, max_workers: int = min(4, os.cpu_count() or 1), name: str = "Scheduler"
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._running: dict[Hashable, Task] = {}
+        self._pending: dict[Hashable, Task] = {}
+
+        # delayed calls are started by a single timer thread
+        self._timers: list[tuple[float, int, Callable[[], None]]] = []
+        self._timer_condition = threading.Condition()
+        self._timer_thread: Optional[threading.Thread] = None
+        self._sequence = itertools.count()
+
+        self._deliveries: queue.SimpleQueue = queue.SimpleQueue()
+        self._widget = None
+
+        self._submitted = 0
+        self._dropped = 0
+        self._completed = 0
+        self._failed = 0
+
+    def submit(
+        self,
+        key: Hashable,
+        func: Callable[..., T],
+        *args: Any,
+        callback: Optional[Callable[[T], None]] = None,
+        **kwargs: Any,
+    ) -> CancellationToken:
+        """
+        Run `func` in the background.
+
+        If a task with the same key is running, the new task waits until it
+        is done and replaces an already waiting task. The running task is
+        cancelled so that it can stop early (see `current_token`).
+
+        Parameters
+        ----------
+        key: hashable
+            tasks with the same key run one after another
+        func: callable
+            function to run with `args` and `kwargs`
+        callback: callable, optional
+            called with the result of `func` - on the GUI thread if the
+            scheduler is attached to a widget
+
+        Returns
+        -------
+        CancellationToken
+            the token of the new task
+        """
+        task = Task(func, args, kwargs, CancellationToken(), callback)
+        with self._lock:
+            self._submitted += 1
+
+            if key not in self._running:
+                self._running[key] = task
+                self._executor.submit(self._run, key)
+                return task.token
+
+            self._running[key].token.cancel()
+            if key in self._pending:
+                self._pending[key].token.cancel()
+                self._dropped += 1
+            self._pending[key] = task
+            return task.token
+
+    def _run(self, key: Hashable) -> None:
+        # pending tasks of the key are run by the same thread so that they
+        # never run at the same time
+        while True:
+            with self._lock:
+                task = self._running[key]
+
+            _local.token = task.token
+            try:
+                result = task.func(*task.args, **task.kwargs)
+                if task.callback is not None:
+                    self.deliver(task.callback, result)
+            except Exception:
+                traceback.print_exc()
+                with self._lock:
+                    self._failed += 1
+            finally:
+                _local.token = None
+
+            with self._lock:
+                self._completed += 1
+                if key not in self._pending:
+                    del self._running[key]
+                    return
+                self._running[key] = self._pending.pop(key)
+
+    def call_later(self, delay: float, func: Callable[[], None]) -> None:
+        """
+        Run `func` on the pool of threads after `delay` seconds.
+        """
+        with self._timer_condition:
+            heapq.heappush(
+                self._timers, (time.time() + delay, next(self._sequence), func)
+            )
+            self._timer_condition.notify()
+
+            if self._timer_thread is None or not self._timer_thread.is_alive():
+                self._timer_thread = threading.Thread(
+                    target=self._run_timers, name="Scheduler Timer", daemon=True
+                )
+                self._timer_thread.start()
+
+    def _run_timers(self) -> None:
+        while True:
+            with self._timer_condition:
+                while len(self._timers) == 0 or self._timers[0][0] > time.time():
+                    timeout = (
+                        self._timers[0][0] - time.time()
+                        if len(self._timers) > 0
+                        else None
+                    )
+                    self._timer_condition.wait(timeout)
+                _, _, func = heapq.heappop(self._timers)
+
+            self._executor.submit(func)
+
+    def attach(self, widget) -> None:
+        """
+        Deliver results on the GUI thread by polling from the event loop of a widget.
+        """
+        self._widget = widget
+        self._deliver_pending()
+
+    def _deliver_pending(self) -> None:
+        while True:
+            try:
+                callback, args = self._deliveries.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+        self._widget.after(DELIVERY_INTERVAL, self._deliver_pending)
+
+    def deliver(self, callback: Callable[..., None], *args: Any) -> None:
+        """
+        Call `callback` on the GUI thread or, if not attached, immediately.
+        """
+        if self._widget is None:
+            callback(*args)
+            return
+
+        self._deliveries.put((callback, args))
+
+    def stats(self) -> SchedulerStats:
+        with self._lock:
+            return SchedulerStats(
+                submitted=self._submitted,
+                dropped=self._dropped,
+                completed=self._completed,
+                failed=self._failed,
+            )
+
+
+# shared by all background computations of the application
+SCHEDULER = Scheduler()
+# shared by background tasks which block for long
+BLOCKING_SCHEDULER = Scheduler(max_workers=2, name="Blocking Scheduler")
+
 
 @dataclass
 class RecurrencyData(Generic[P]):
@@ -14,7 +284,7 @@ class RecurrencyData(Generic[P]):
     def __init__(self, interval: float) -> None:
         self.interval = interval
         self.lock = threading.Lock()
-        self.pending_call: Optional[threading.Thread] = None
+        self.pending_call = False
 
         self.last_call = 0.0
         self.last_args: Optional[P.args] = None
@@ -25,10 +295,9 @@ def _recurrency_filter(func: Callable[P, None], interval: float) -> Callable[P,
     recurrency_data = RecurrencyData[P](interval=interval)
 
     def trigger_pending() -> None:
-        # print("Trigger pending")
         with recurrency_data.lock:
             recurrency_data.last_call = time.time()
-            recurrency_data.pending_call = None
+            recurrency_data.pending_call = False
         assert recurrency_data.last_args is not None
         assert recurrency_data.last_kwargs is not None
         func(*recurrency_data.last_args, **recurrency_data.last_kwargs)
@@ -42,18 +311,15 @@ def _recurrency_filter(func: Callable[P, None], interval: float) -> Callable[P,
                 recurrency_data.last_call = current_time
                 func(*args, **kwargs)
             else:
-                # print("Schedule")
+                # calls during the interval only update the arguments of
+                # a single delayed call
                 recurrency_data.last_args = args
-                # print(recurrency_data)
                 recurrency_data.last_kwargs = kwargs
-                # print(recurrency_data)
-                if recurrency_data.pending_call is None:
-                    # print(f"Create pending")
-                    remaining_time = recurrency_data.interval - passed_time
-                    recurrency_data.pending_call = threading.Timer(
-                        remaining_time, trigger_pending
+                if not recurrency_data.pending_call:
+                    recurrency_data.pending_call = True
+                    SCHEDULER.call_later(
+                        recurrency_data.interval - passed_time, trigger_pending
                     )
-                    recurrency_data.pending_call.start()
 
     return wrapper
 
@@ -62,46 +328,78 @@ def recurrency_filter(interval: float) -> functools.partial[Callable[P, None]]:
     return functools.partial(_recurrency_filter, interval=interval)
 
 
-@dataclass
-class AsyncData(Generic[P]):
+def asynchron(
+    func: Callable[P, None], scheduler: Optional[Scheduler] = None
+) -> Callable[P, None]:
+    """
+    Run a function in the background.
 
-    def __init__(self) -> None:
-        self.lock = threading.Lock()
-        self.current_call: Optional[threading.Thread] = None
-        self.pending_call: Optional[threading.Thread] = None
+    While a call is running, only the latest of further calls is run afterwards.
+    The running call is cancelled (see `current_token`) so that it can skip
+    outdated work. Functions which block for long should be run by the
+    `BLOCKING_SCHEDULER` instead of the default `SCHEDULER`.
+    """
+    # each decorated function is a key of its own
+    key = object()
 
-        self.last_args: Optional[P.args] = None
-        self.last_kwargs: Optional[P.kwargs] = None
-
-
-def asynchron(func: Callable[P, None]) -> Callable[P, None]:
-    async_data = AsyncData()
+    @functools.wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> None:
+        (SCHEDULER if scheduler is None else scheduler).submit(
+            key, func, *args, **kwargs
+        )
 
-    def trigger_pending() -> None:
-        async_data.current_call.join()
+    return wrapper
 
-        with async_data.lock:
-            async_data.pending_call = None
 
-            async_data.current_call = threading.Thread(target=func, args=async_data.last_args, kwargs=async_data.last_kwargs)
-            async_data.current_call.start()
+def async_computed_state(func: Callable[P, T]) -> Callable[P, T]:
+    """
+    Variant of `computed_state` which recomputes the value in the background.
 
+    The initial value is computed immediately. On a change of a state it
+    depends on, the value is recomputed by the `SCHEDULER` and the state keeps
+    its last value until then. A result is discarded if the states changed
+    again in the meantime and the new value is set on the GUI thread.
+    """
 
     @functools.wraps(func)
-    def wrapper(*args: P.args, **kwargs: P.kwargs) -> None:
-        with async_data.lock:
-            if async_data.current_call is None:
-                async_data.current_call = threading.Thread(target=func, args=args, kwargs=kwargs)
-                async_data.current_call.start()
+    def wrapped(*args: P.args, **kwargs: P.kwargs) -> T:
+        computed_value = func(*args, **kwargs)
+
+        key = object()
+        latest = 0
+
+        def compute(
+            version: int, trigger: Any
+        ) -> Optional[tuple[int, Any, Any, float]]:
+            since = time.perf_counter()
+            value = func(*args, **kwargs).value
+            # a superseded value is not delivered to the GUI thread
+            if current_token().cancelled:
+                return None
+            return version, value, trigger, time.perf_counter() - since
+
+        def publish(result: Optional[tuple[int, Any, Any, float]]) -> None:
+            if result is None:
                 return
 
-            async_data.last_args = args
-            async_data.last_kwargs = kwargs
-            if async_data.pending_call is None or async_data.pending_call.is_alive() is False:
-                async_data.pending_call = threading.Thread(target=trigger_pending)
-                async_data.pending_call.start()
+            version, value, trigger, duration = result
+            if version == latest:
+                # recorded by the profiler because it is set outside of callbacks
+                PROFILER.publish(computed_value, value, trigger, duration)
 
-    return wrapper
+        def _on_change(trigger: Any) -> None:
+            nonlocal latest
+            latest += 1
+            SCHEDULER.submit(key, compute, latest, trigger, callback=publish)
+
+        # handling of computed states as values of higher states
+        _args = args[1:] if func.__code__.co_varnames[0] == "self" else args
+        for _arg in _args:
+            _arg.on_change(_on_change)
+
+        return computed_value
+
+    return wrapped
 
 
 if __name__ == "__main__":
@@ -125,3 +423,6 @@ if __name__ == "__main__":
     time.sleep(0.2)
 
     x.value = 20
+
+    time.sleep(0.2)
+    print(SCHEDULER.stats())
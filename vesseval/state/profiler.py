@@ -0,0 +1,269 @@
+"""
+Profiler of the reactive state graph.
+
+Derived states (e.g., the display image of a `DisplayImageState` or the
+colored regions of the SAM app) are recomputed in callbacks of the states
+they depend on. The profiler records for each state that is set while a
+callback of another state runs (a "recompute" - a higher order state which
+only notifies because one of its children changed is not recomputed):
+  * how often it was recomputed
+  * the time spent (total and 95th percentile)
+  * which states triggered it
+
+States computed in the background (see `async_computed_state`) are set
+outside of callbacks. They are recorded with `publish` instead, as
+recomputed by the state whose change started the computation and with the
+time of the computation.
+
+The edges between triggers and recomputed states form the dependency graph
+which can be dumped as text or in the DOT format of graphviz.
+
+The profiler is disabled by default and costs nothing then. It is enabled
+with `PROFILER.enable()`, e.g. by starting the app with `--profile`.
+
+Example:
+    PROFILER.enable()
+    ...
+    print(PROFILER.report())
+    with open("graph.dot", mode="w") as f:
+        f.write(PROFILER.to_dot())
+
+Note: states are instrumented by the wrapper of `State.notify_change` (see
+`notify.py`). The time of a recompute is measured from the start
+of the triggering callback (or the end of the previous recompute in the same
+callback) so that the recomputes further down the graph are not included.
+"""
+
+from __future__ import annotations
+
+from collections import Counter, deque
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Any, Callable
+
+import numpy as np
+from widget_state import ListState, State
+
+# number of durations kept per node to compute percentiles
+SAMPLES = 1000
+
+
+@dataclass
+class NodeStats:
+    name: str
+    # number of recomputes
+    count: int = 0
+    # total time in seconds
+    total: float = 0.0
+    durations: deque = field(default_factory=lambda: deque(maxlen=SAMPLES))
+    triggers: Counter = field(default_factory=Counter)
+
+    @property
+    def p95(self) -> float:
+        if len(self.durations) == 0:
+            return 0.0
+        return float(np.percentile(self.durations, 95))
+
+    def __str__(self) -> str:
+        triggers = ", ".join(
+            f"{name} ({count})" for name, count in self.triggers.most_common(3)
+        )
+        return (
+            f"{self.name}: {self.count} recomputes, {self.total * 1000:.1f} ms total,"
+            f" p95 {self.p95 * 1000:.2f} ms, triggered by {triggers}"
+        )
+
+
+@dataclass
+class _Frame:
+    # state whose callbacks run
+    state: State
+    # start of the current measurement
+    start: float
+
+
+def node_name(state: State) -> str:
+    """
+    Name a state by the path of attributes from its root state
+    (e.g., "AppState.display_image.display_image_state").
+    """
+    parts = []
+    while state._parent is not None:
+        parent = state._parent
+        if isinstance(parent, ListState):
+            index = next(i for i, elem in enumerate(parent) if elem is state)
+            parts.append(f"[{index}]")
+        else:
+            key = next(
+                (key for key, value in vars(parent).items() if value is state), "?"
+            )
+            parts.append(f".{key}")
+        state = parent
+
+    return type(state).__name__ + "".join(reversed(parts))
+
+
+class GraphProfiler:
+    """
+    Record recomputes of states and the dependency graph between them.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._nodes: list[NodeStats] = []
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            for node in self._nodes:
+                node.count = 0
+                node.total = 0.0
+                node.durations.clear()
+                node.triggers.clear()
+
+    def _stack(self) -> list[_Frame]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _node(self, state: State) -> NodeStats:
+        # stats are attached to the state (private attributes are not tracked)
+        # because ids of states are reused
+        node = state.__dict__.get("_profile")
+        if node is None:
+            node = state.__dict__["_profile"] = NodeStats(node_name(state))
+            self._nodes.append(node)
+        return node
+
+    def record(self, state: State, trigger: State, duration: float) -> None:
+        with self._lock:
+            node = self._node(state)
+            node.count += 1
+            node.total += duration
+            node.durations.append(duration)
+            node.triggers[self._node(trigger).name] += 1
+
+    def call(self, callback: Callable[[State], None], state: State) -> None:
+        """
+        Call a callback of a state and attribute the states it sets to it.
+        """
+        if not self.enabled:
+            callback(state)
+            return
+
+        stack = self._stack()
+        stack.append(_Frame(state, time.perf_counter()))
+        try:
+            callback(state)
+        finally:
+            stack.pop()
+
+    def notify_change(self, state: State) -> None:
+        """
+        Call the callbacks of a state and record it as recomputed if it
+        is set in a callback of another state.
+        """
+        stack = self._stack()
+        # the propagation of a change from a child to its parent is no recompute
+        if len(stack) > 0 and stack[-1].state._parent is not state:
+            frame = stack[-1]
+            self.record(state, frame.state, time.perf_counter() - frame.start)
+
+        for callback in state._callbacks:
+            self.call(callback, state)
+
+        # recomputes following in the same callback do not include this cascade
+        if len(stack) > 0:
+            stack[-1].start = time.perf_counter()
+
+    def publish(self, state: State, value: Any, trigger: State, duration: float):
+        """
+        Set the value of a state computed in the background and record it
+        as recomputed by `trigger` in `duration` seconds.
+        """
+        if self.enabled:
+            self.record(state, trigger, duration)
+
+        # the value is not attributed to a callback which happens to run
+        stack = self._stack()
+        self._local.stack = []
+        try:
+            state.value = value
+        finally:
+            self._local.stack = stack
+
+    def stats(self) -> list[NodeStats]:
+        """
+        Get the stats of all recomputed states - the most expensive first.
+
+        States with the same name (e.g., the display images of different
+        `DisplayImageState`s without parent) are aggregated.
+        """
+        nodes: dict[str, NodeStats] = {}
+        with self._lock:
+            for node in filter(lambda node: node.count > 0, self._nodes):
+                if node.name not in nodes:
+                    nodes[node.name] = NodeStats(node.name)
+
+                aggregate = nodes[node.name]
+                aggregate.count += node.count
+                aggregate.total += node.total
+                aggregate.durations.extend(node.durations)
+                aggregate.triggers.update(node.triggers)
+        return sorted(nodes.values(), key=lambda node: -node.total)
+
+    def report(self, n: int = 10) -> str:
+        """
+        Dump the `n` most expensive states and the dependency graph as text.
+        """
+        nodes = self.stats()
+        lines = ["Hot states:"]
+        lines.extend(f"  {node}" for node in nodes[:n])
+        lines.append("Dependencies:")
+        for node in sorted(nodes, key=lambda node: node.name):
+            for trigger, count in node.triggers.most_common():
+                lines.append(f"  {trigger} -> {node.name} ({count})")
+        return "\n".join(lines)
+
+    def to_dot(self, n: int = 10) -> str:
+        """
+        Dump the dependency graph in the DOT format - the `n` most expensive
+        states are highlighted.
+        """
+        nodes = self.stats()
+        hot = set(node.name for node in nodes[:n] if node.total > 0)
+
+        lines = ["digraph states {", "  node [shape=box];"]
+        for node in nodes:
+            color = ', color="red"' if node.name in hot else ""
+            lines.append(
+                f'  "{node.name}" [label="{node.name}\\n{node.count}x,'
+                f' {node.total * 1000:.1f} ms"{color}];'
+            )
+        for node in nodes:
+            for trigger, count in node.triggers.items():
+                lines.append(f'  "{trigger}" -> "{node.name}" [label="{count}"];')
+        lines.append("}")
+        return "\n".join(lines)
+
+    def dump(self, prefix: str) -> None:
+        """
+        Write the text report to `<prefix>.txt` and the graph to `<prefix>.dot`.
+        """
+        with open(f"{prefix}.txt", mode="w") as f:
+            f.write(self.report() + "\n")
+        with open(f"{prefix}.dot", mode="w") as f:
+            f.write(self.to_dot() + "\n")
+
+
+PROFILER = GraphProfiler()
@@ -0,0 +1,93 @@
+"""
+Transactions batch mutations of states so that dependents are notified once.
+
+A bulk mutation (e.g., loading hundreds of regions) notifies the callbacks
+of states for every single change. Thus, derived states such as the image
+of colored regions are recomputed again and again. Inside of a transaction,
+callbacks are not called but collected and each callback is called once
+when the transaction commits - in the order of the first notification and
+with the state that notified it last. Notifications caused by these callbacks
+(e.g., the propagation from the children of a higher order state to their
+parent) are collected as well until there are no pending callbacks left. This
+also suspends the recomputation of derived states until the commit.
+
+Example:
+    with transaction():
+        for region in regions:
+            app_state.add_region(region)
+
+Transactions are per thread: notifications of other threads are not delayed.
+Nested transactions commit with the outermost one.
+
+Note: `widget_state` does not support batching, so notifications are
+collected by the wrapper of `State.notify_change` (see `notify.py`).
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+import threading
+from typing import Callable, Iterator
+
+from widget_state import State
+
+from .profiler import PROFILER
+
+_local = threading.local()
+
+
+def _pending() -> dict[Callable[[State], None], State] | None:
+    return getattr(_local, "pending", None)
+
+
+def collect(state: State) -> bool:
+    """
+    Collect the callbacks of a notifying state if a transaction is active.
+
+    Returns
+    -------
+    bool
+        if the callbacks were collected and must not be called now
+    """
+    pending = _pending()
+    if pending is None:
+        return False
+
+    for callback in state._callbacks:
+        # re-inserting keeps the position so that callbacks run in the order of
+        # their first notification
+        pending[callback] = state
+    return True
+
+
+def in_transaction() -> bool:
+    """
+    Check if a transaction is active in the current thread.
+    """
+    return _pending() is not None
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """
+    Collect notifications of states and notify each callback once on exit.
+    """
+    if in_transaction():
+        yield
+        return
+
+    pending: dict[Callable[[State], None], State] = {}
+    _local.pending = pending
+    try:
+        yield
+    finally:
+        # dependents are notified even if the transaction failed so that they
+        # reflect the partial change - notifications of the callbacks are still
+        # collected until a fixpoint is reached, so that, e.g., a higher order
+        # state with several changed children notifies its dependents once
+        try:
+            while len(pending) > 0:
+                callback = next(iter(pending))
+                PROFILER.call(callback, pending.pop(callback))
+        finally:
+            _local.pending = None
@@ -3,7 +3,7 @@ from typing import Tuple
 import cv2 as cv
 import numpy as np
 
-from .state import ContourState, DisplayImageState
+from .state import DisplayImageState
 
 
 def compute_contours(mask: np.ndarray, angle_step: int = 10):
@@ -47,15 +47,10 @@ def compute_contours(mask: np.ndarray, angle_step: int = 10):
 def transform_contour(
     contour: np.ndarray, display_image_state: DisplayImageState
 ) -> np.ndarray:
-    shape = display_image_state.display_image_state.value.shape
-
-    t_x = (display_image_state.resolution_state.width.value - shape[1]) // 2
-    t_y = (display_image_state.resolution_state.height.value - shape[0]) // 2
-
-    contour[:, 0] = contour[:, 0] - t_x
-    contour[:, 1] = contour[:, 1] - t_y
-    contour = np.rint(contour / display_image_state.scale_state.value).astype(int)
-    return contour
+    # invert the transformation from image to display coordinates
+    transform = cv.invertAffineTransform(display_image_state.transform())
+    contour = cv.transform(contour.reshape(-1, 1, 2).astype(float), transform)
+    return np.rint(contour.reshape(-1, 2)).astype(int)
 
 
 def compute_area(
@@ -73,24 +68,6 @@ def compute_area(
     return contour_mask.sum() // 255
 
 
-def mask_image(
-    display_image: DisplayImageState,
-    contour: ContourState,
-):
-    image = display_image.image_state.value
-    contour = transform_contour(contour.to_numpy(), display_image)
-
-    mask = np.zeros(image.shape[:2], np.uint8)
-    mask = cv.drawContours(mask, [contour], 0, 255, -1)
-
-    l, t, w, h = cv.boundingRect(contour)
-    mask = mask[t : t + h, l : l + w]
-    image = image[t : t + h, l : l + w]
-
-    image = cv.bitwise_and(image, image, mask=mask)
-    return image
-
-
 def compute_thickness(contour_inner: np.ndarray, contour_outer: np.ndarray) -> float:
     """
     Compute the thickness of a cell layer of a vessel.
@@ -1,12 +1,11 @@
 import cv2 as cv
-import numpy as np
 import tkinter as tk
 
 from ...state import PointState
+from ...state.processing import SCHEDULER
 
-from ...widgets.canvas import Image, Rectangle, RectangleState
+from ...widgets.canvas import Image, Rectangle, RectangleState, ZoomPan
 from ...widgets.canvas import Contour, DisplayContourState
-from ...util import mask_image
 
 from ..preprocessing import PreprocessingView, PreprocessingViewState
 
@@ -21,6 +20,8 @@ class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.configure(bg="#757575")
+        # results of background computations are delivered on the GUI thread
+        SCHEDULER.attach(self)
 
         self.state = app_state
 
@@ -49,10 +50,16 @@ class App(tk.Tk):
 
         self.image = Image(self.canvas, app_state.display_image_state)
         print(app_state.display_image_state.resolution_state)
+        # the contour is defined in image coordinates and follows the view
         self.contour = Contour(
             self.canvas,
-            DisplayContourState(self.state.contour_state, rectangle_color="white"),
+            DisplayContourState(
+                self.state.contour_state,
+                rectangle_color="white",
+                display_image=app_state.display_image_state,
+            ),
         )
+        self.zoom_pan = ZoomPan(self.canvas, app_state.display_image_state)
 
         self.bind("<Key-q>", lambda event: exit(0))
         self.bind("<Return>", self.on_return)
@@ -66,9 +73,7 @@ class App(tk.Tk):
         _, radius = cv.minEnclosingCircle(contour)
         diameter = radius * 2
         diameter = (
-            diameter
-            * self.state.image_config.pixel_size.value
-            / self.state.display_image_state.scale_state.value
+            diameter * self.state.image_scale * self.state.image_config.pixel_size.value
         )
 
         self.footer.state.info_text.value = (
@@ -76,11 +81,7 @@ class App(tk.Tk):
         )
 
     def on_return(self, *args):
-        PreprocessingView(
-            PreprocessingViewState(
-                mask_image(self.state.display_image_state, self.state.contour_state)
-            )
-        )
+        PreprocessingView(PreprocessingViewState(self.state.crop()))
 
     def on_erase_mode(self, state):
         if state.value:
@@ -113,32 +114,17 @@ class App(tk.Tk):
         self.on_erase_motion(event)
 
         display_image_state = self.state.display_image_state
-        image_state = display_image_state.image_state
-
-        resolution_state = display_image_state.resolution_state
-        display_shape = display_image_state.display_image_state.value.shape
-
-        t_x = (resolution_state.width.value - display_shape[1]) // 2
-        t_y = (resolution_state.height.value - display_shape[0]) // 2
 
         # transform mouse position into image coordinates
-        pt = np.array([event.x, event.y])
-        pt[0] = pt[0] - t_x
-        pt[1] = pt[1] - t_y
-        pt = np.rint(pt / display_image_state.scale_state.value).astype(int)
-        pt = tuple(pt.tolist())
+        pt = display_image_state.to_image_coords(event.x, event.y)
 
         # transform size into image size
         size = self.erase_mode["rectangle"].state.size_state.value
-        size = round(size / display_image_state.scale_state.value)
+        size = round(size / display_image_state.transform()[0, 0])
 
         # translate pt rectangle top-left
         size_h = size // 2
-        pt = (pt[0] - size_h, pt[1] - size_h)
-
-        image_state.value = cv.rectangle(
-            image_state.value, pt, (pt[0] + size, pt[1] + size), (0, 0, 0), -1
-        )
+        self.state.erase(pt[0] - size_h, pt[1] - size_h, size)
 
     def on_bb_mode(self, state):
         if state.value:
@@ -161,7 +147,7 @@ class App(tk.Tk):
         if len(self.state.contour_state) > 0:
             self.state.contour_state.clear()
 
-        x, y = event.x, event.y
+        x, y = self.state.display_image_state.to_image_coords(event.x, event.y)
         self.state.contour_state.extend(
             [
                 PointState(x, y),
@@ -172,7 +158,7 @@ class App(tk.Tk):
         )
 
     def bb_mode_init_contour(self, event):
-        x, y = event.x, event.y
+        x, y = self.state.display_image_state.to_image_coords(event.x, event.y)
 
         self.state.contour_state[1].x.set(x)
         self.state.contour_state[2].x.set(x)
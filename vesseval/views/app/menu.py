@@ -8,7 +8,6 @@ import tkinter as tk
 from tkinter import filedialog
 from widget_state import StringState
 
-from ...util import mask_image
 from ..preprocessing import PreprocessingView, PreprocessingViewState
 from ..dialog.open import OpenFileDialog, OpenDirectoryDialog
 from .state import app_state
@@ -69,12 +68,7 @@ class MenuTools(tk.Menu):
         self.add_command(
             label="Process Contour",
             command=lambda *args: PreprocessingView(
-                PreprocessingViewState(
-                    mask_image(
-                        app_state.display_image_state,
-                        app_state.contour_state,
-                    )
-                )
+                PreprocessingViewState(app_state.crop())
             ),
         )
         app_state.contour_state.on_change(self.on_contour, trigger=True)
@@ -5,6 +5,7 @@ import cv2 as cv
 import numpy as np
 from widget_state import computed_state, FloatState, HigherOrderState, StringState, ObjectState
 
+from ...image_source import ArrayImageSource, ImageSource, open_image
 from ...state import (
     ContourState,
     DisplayImageState,
@@ -14,6 +15,10 @@ from ...state import (
 )
 
 placeholder_image = np.zeros((512, 512, 3), np.uint8)
+# images are read at most at this multiple of the display resolution - crops
+# of contours are read from the image source at full resolution
+WORKING_ZOOM = 4
+
 
 class AppState(HigherOrderState):
 
@@ -31,22 +36,90 @@ class AppState(HigherOrderState):
             ImageState(placeholder_image),
             self.display_resolution_state,
             interpolation=cv.INTER_AREA,
+            asynchronous=True,
+            zoomable=True,
         )
 
+        # source of the image - the displayed image is read from it at the
+        # working resolution (see `working_resolution`)
+        self._source: ImageSource = ArrayImageSource(placeholder_image)
+        # erased squares (x, y, size) in working image coordinates
+        self._erased: list[tuple[int, int, int]] = []
+
         self.filename_state.on_change(self.on_filename)
         self.save_directory.on_change(lambda _: self.save())
 
     def on_filename(self, state: StringState):
         filename = state.value
+        # a new image is shown completely
+        self.display_image_state.view.reset()
+
+        self._source.close()
+        self._erased.clear()
+        self._source = (
+            ArrayImageSource(placeholder_image)
+            if filename == ""
+            else open_image(filename)
+        )
 
-        if filename == "":
-            self.display_image_state.image_state.set(placeholder_image)
-            return
-
-        image = cv.imread(filename)
-        image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
+        # TIFF files are read lazily so that only the working resolution
+        # (or the closest level of a pyramid) is decoded
+        image = self._source.read(self.working_resolution())
         self.display_image_state.image_state.set(image)
 
+    def working_resolution(self) -> tuple[int, int]:
+        """
+        Get the resolution at which the image is read - images are not upscaled.
+        """
+        width, height = self._source.resolution
+        max_width, max_height = self.display_resolution_state.values()
+        scale = min(
+            WORKING_ZOOM * max_width / width, WORKING_ZOOM * max_height / height, 1.0
+        )
+        return max(round(width * scale), 1), max(round(height * scale), 1)
+
+    @property
+    def image_scale(self) -> float:
+        """
+        Factor from working image coordinates to full resolution coordinates.
+        """
+        working_width = self.display_image_state.image_state.value.shape[1]
+        return self._source.resolution[0] / working_width
+
+    def erase(self, x: int, y: int, size: int) -> None:
+        """
+        Erase a square (top-left corner and size in working image coordinates).
+        """
+        image_state = self.display_image_state.image_state
+        image_state.value = cv.rectangle(
+            image_state.value, (x, y), (x + size, y + size), (0, 0, 0), -1
+        )
+        self._erased.append((x, y, size))
+
+    def crop(self) -> np.ndarray:
+        """
+        Crop the region inside of the contour from the image at full resolution.
+
+        Pixels outside of the contour and erased pixels are black.
+        """
+        scale = self.image_scale
+        contour = np.rint(self.contour_state.to_numpy() * scale).astype(np.int32)
+
+        width, height = self._source.resolution
+        x, y, w, h = cv.boundingRect(contour)
+        x1, y1 = min(max(x, 0), width - 1), min(max(y, 0), height - 1)
+        x2, y2 = max(min(x + w, width), x1 + 1), max(min(y + h, height), y1 + 1)
+        image = self._source.read_region(x1, y1, x2 - x1, y2 - y1)
+
+        mask = np.zeros(image.shape[:2], np.uint8)
+        mask = cv.drawContours(mask, [contour], 0, 255, -1, offset=(-x1, -y1))
+        for e_x, e_y, size in self._erased:
+            e_x, e_y = round(e_x * scale) - x1, round(e_y * scale) - y1
+            size = round(size * scale)
+            mask = cv.rectangle(mask, (e_x, e_y), (e_x + size, e_y + size), 0, -1)
+
+        return cv.bitwise_and(image, image, mask=mask)
+
     def save(self):
         _dir = self.save_directory.value
 
@@ -2,12 +2,14 @@ import cv2 as cv
 import numpy as np
 import tkinter as tk
 from tktooltip import ToolTip
-from widget_state import computed_state, HigherOrderState, IntState, BoolState
+from widget_state import HigherOrderState, IntState, BoolState
 
 from ...state import (
     DisplayImageState,
     ImageState,
 )
+from ...state.memoize import memoized
+from ...state.processing import async_computed_state
 from ...widgets.canvas import Image
 from ...widgets import Scale, ScaleState, Checkbox, CheckboxState
 
@@ -24,6 +26,15 @@ class MorphOpsState(HigherOrderState):
 
 
 class MaskingState(HigherOrderState):
+    """
+    State of a mask thresholded from a channel of an image and processed by
+    morphological operations.
+
+    Masks are computed in the background so that moving a slider never
+    blocks the GUI - the last computed mask is shown in the meantime.
+    Recent masks are memoized so that toggling an operation or moving a
+    slider back to a previous value reuses them.
+    """
 
     def __init__(
         self,
@@ -46,12 +57,16 @@ class MaskingState(HigherOrderState):
                 self.display_image_state.display_image_state, self.threshold_state
             ),
             resolution_state=self.display_image_state.resolution_state,
+            asynchronous=True,
+            memoize=True,
         )
         self.processed_mask = DisplayImageState(
             image_state=self.process_mask(
                 self.mask.display_image_state, self.morph_ops
             ),
             resolution_state=self.display_image_state.resolution_state,
+            asynchronous=True,
+            memoize=True,
         )
         self.colored_mask = DisplayImageState(
             image_state=self.color_mask(
@@ -59,15 +74,18 @@ class MaskingState(HigherOrderState):
                 self.display_image_state.display_image_state,
             ),
             resolution_state=self.display_image_state.resolution_state,
+            asynchronous=True,
         )
 
-    @computed_state
+    @async_computed_state
+    @memoized(max_entries=16)
     def threshold_image(self, image: ImageState, threshold: IntState) -> ImageState:
         mask = image.value[:, :, self._channel] > threshold.value
         mask = (mask * 255).astype(np.uint8)
         return ImageState(mask)
 
-    @computed_state
+    @async_computed_state
+    @memoized(max_entries=16)
     def process_mask(self, mask: ImageState, morph_ops: MorphOpsState) -> ImageState:
         processed_mask = mask.value
 
@@ -85,7 +103,8 @@ class MaskingState(HigherOrderState):
 
         return ImageState(processed_mask)
 
-    @computed_state
+    @async_computed_state
+    @memoized(max_entries=16)
     def color_mask(self, mask: ImageState, image: ImageState) -> ImageState:
         colored_mask = cv.bitwise_and(image.value, image.value, mask=mask.value)
         return ImageState(colored_mask)
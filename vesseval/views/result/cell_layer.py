@@ -163,13 +163,19 @@ class CellLayerView(tk.Frame):
         self.contour_inner = Contour(
             self.canvas,
             DisplayContourState(
-                self.state.inner_contour, rectangle_color="blue", rectangle_size=7
+                self.state.inner_contour,
+                rectangle_color="blue",
+                rectangle_size=7,
+                polyline=True,
             ),
         )
         self.contour_outer = Contour(
             self.canvas,
             DisplayContourState(
-                self.state.outer_contour, rectangle_color="red", rectangle_size=7
+                self.state.outer_contour,
+                rectangle_color="red",
+                rectangle_size=7,
+                polyline=True,
             ),
         )
 
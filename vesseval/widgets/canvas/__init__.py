@@ -4,6 +4,7 @@ from .circle import Circle, CircleState
 from .image import Image
 from .line import Line, LineState
 from .rectangle import Rectangle, RectangleState
+from .zoom import ZoomPan
 
 __all__ = [
     "BoundingBox",
@@ -16,4 +17,5 @@ __all__ = [
     "RectangleState",
     "Circle",
     "CircleState",
+    "ZoomPan",
 ]
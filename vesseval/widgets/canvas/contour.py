@@ -1,12 +1,12 @@
-from typing import List
+from typing import Callable, Optional
 
+import cv2 as cv
 import numpy as np
 import tkinter as tk
-from widget_state import HigherOrderState
+from widget_state import HigherOrderState, State
 
-from ...state import ContourState, PointState
-from .line import Line, LineState
-from .rectangle import Rectangle, RectangleState
+from ...state import ContourState, DisplayImageState, PointState
+from ..util import stateful
 
 
 class DisplayContourState(HigherOrderState):
@@ -17,69 +17,262 @@ class DisplayContourState(HigherOrderState):
         rectangle_size: int = 9,
         rectangle_color: str = "blue",
         line_color: str = "white",
+        polyline: bool = False,
+        display_image: Optional[DisplayImageState] = None,
     ):
+        """
+        State of a contour drawn as rectangles at its vertices connected by lines.
+
+        If `polyline`, the outline is drawn as a single canvas item instead
+        of a line per edge, which is faster for contours with many vertices.
+
+        If a `display_image` is given, the contour is defined in the coordinates
+        of its image and projected into display coordinates when drawn, so that
+        it follows zooming and panning without losing precision.
+        """
         super().__init__()
 
         self.contour = contour
         self.rectangle_size = rectangle_size
         self.rectangle_color = rectangle_color
         self.line_color = line_color
+        self.polyline = polyline
+        if display_image is not None:
+            self.display_image = display_image
+
+    def to_display(self, contour: np.ndarray) -> np.ndarray:
+        """
+        Project points of the contour (array of shape (n, 2)) into display coordinates.
+        """
+        if not hasattr(self, "display_image") or len(contour) == 0:
+            return contour.reshape(-1, 2).astype(int)
+
+        transform = self.display_image.transform()
+        contour = cv.transform(contour.reshape(-1, 1, 2).astype(float), transform)
+        return np.rint(contour.reshape(-1, 2)).astype(int)
 
+    def to_contour(self, x: int, y: int) -> tuple[int, int]:
+        """
+        Map display coordinates to the coordinates of the contour.
+        """
+        if not hasattr(self, "display_image"):
+            return x, y
+        return self.display_image.to_image_coords(x, y)
 
+
+@stateful
 class Contour:
+    """
+    Editable contour on a canvas.
+
+    Canvas items are updated incrementally: only the items of inserted or
+    removed vertices are created or deleted and only the items of vertices
+    whose display position changed are moved. Vertices are plain canvas items
+    which share their bindings through tags instead of being widgets with
+    states of their own.
+    """
 
     def __init__(self, canvas: tk.Canvas, state: DisplayContourState):
         self.canvas = canvas
+        self.widget = canvas
         self.state = (
             state if type(state) == DisplayContourState else DisplayContourState(state)
         )
 
-        self.canvas_items = []
+        # tags shared by the vertices and edges of this contour
+        self.vertex_tag = f"contour_{id(self)}_vertex"
+        self.edge_tag = f"contour_{id(self)}_edge"
+
+        # vertices and their display positions by the id of their point state
+        self.points: list[PointState] = []
+        self.positions: dict[int, tuple[int, int]] = {}
+        self.vertices: dict[int, int] = {}
+        self.point_callbacks: dict[int, Callable[[State], None]] = {}
+        self.points_by_item: dict[int, PointState] = {}
+        # edges by the ids of their point states (or a single polyline)
+        self.edges: dict[tuple[int, int], int] = {}
+        self.end_points_by_item: dict[int, PointState] = {}
+        self.polyline: Optional[int] = None
+
+        self._style: Optional[tuple] = None
+
+        self.canvas.tag_bind(self.vertex_tag, "<B1-Motion>", self.move_vertex)
+        self.canvas.tag_bind(self.vertex_tag, "<Button-3>", self.delete_vertex)
+        self.canvas.tag_bind(self.edge_tag, "<Double-Button-1>", self.insert_vertex)
+
+    def draw(self):
+        points = list(self.state.contour)
+
+        # points are moved if they changed or the view of the display changed
+        positions = self.state.to_display(self.state.contour.to_numpy())
+        positions = dict(zip(map(id, points), map(tuple, positions.tolist())))
+        moved = set(
+            key
+            for key, position in positions.items()
+            if self.positions.get(key) != position
+        )
+        self.positions = positions
+
+        self.update_vertices(points, moved)
+        if self.state.polyline.value:
+            self.update_polyline(points, moved)
+        else:
+            self.update_edges(points, moved)
+        self.points = points
+
+        style = (
+            self.state.rectangle_size.value,
+            self.state.rectangle_color.value,
+            self.state.line_color.value,
+        )
+        if style != self._style:
+            self._style = style
+            self.canvas.itemconfig(
+                self.vertex_tag, fill=self.state.rectangle_color.value
+            )
+            self.canvas.itemconfig(self.edge_tag, fill=self.state.line_color.value)
+            for point in points:
+                self.canvas.coords(self.vertices[id(point)], *self.ltbr(point))
+
+    def ltbr(self, point: PointState) -> list[int]:
+        size_h = self.state.rectangle_size.value // 2
+        x, y = self.positions[id(point)]
+        return [x - size_h, y - size_h, x + size_h, y + size_h]
+
+    def on_point_change(self, point: PointState) -> None:
+        # moved points are drawn in the next frame
+        self.state.notify_change()
+
+    def update_vertices(self, points: list[PointState], moved: set[int]) -> None:
+        keys = set(map(id, points))
+        for point in self.points:
+            if id(point) not in keys:
+                self.remove_vertex(point)
+
+        for point in points:
+            if id(point) not in self.vertices:
+                self.add_vertex(point)
+            elif id(point) in moved:
+                self.canvas.coords(self.vertices[id(point)], *self.ltbr(point))
+
+    def add_vertex(self, point: PointState) -> None:
+        item = self.canvas.create_rectangle(
+            *self.ltbr(point),
+            fill=self.state.rectangle_color.value,
+            outline="black",
+            tags=(self.vertex_tag,),
+        )
+        self.vertices[id(point)] = item
+        self.points_by_item[item] = point
+
+        callback = lambda state: self.on_point_change(state)
+        point.on_change(callback)
+        self.point_callbacks[id(point)] = callback
 
-        self.redraw()
-        self.state.on_change(lambda *args: self.redraw())
+    def remove_vertex(self, point: PointState) -> None:
+        item = self.vertices.pop(id(point))
+        del self.points_by_item[item]
+        self.canvas.delete(item)
+        point.remove_callback(self.point_callbacks.pop(id(point)))
 
-    def redraw(self):
-        self.clear()
+    def update_edges(self, points: list[PointState], moved: set[int]) -> None:
+        if self.polyline is not None:
+            self.canvas.delete(self.polyline)
+            self.polyline = None
 
-        if len(self.state.contour) == 0:
+        pairs = list(zip(points, [*points[1:], *points[:1]])) if len(points) > 1 else []
+        keys = set((id(start), id(end)) for start, end in pairs)
+        for key in list(self.edges.keys()):
+            if key not in keys:
+                item = self.edges.pop(key)
+                del self.end_points_by_item[item]
+                self.canvas.delete(item)
+
+        for start, end in pairs:
+            key = (id(start), id(end))
+            coords = (*self.positions[key[0]], *self.positions[key[1]])
+            if key not in self.edges:
+                item = self.canvas.create_line(
+                    *coords,
+                    fill=self.state.line_color.value,
+                    tags=(self.edge_tag,),
+                )
+                self.canvas.tag_lower(item, self.vertex_tag)
+                self.edges[key] = item
+                self.end_points_by_item[item] = end
+            elif key[0] in moved or key[1] in moved:
+                self.canvas.coords(self.edges[key], *coords)
+
+    def update_polyline(self, points: list[PointState], moved: set[int]) -> None:
+        for item in self.edges.values():
+            self.canvas.delete(item)
+        self.edges.clear()
+        self.end_points_by_item.clear()
+
+        if len(points) < 2:
+            if self.polyline is not None:
+                self.canvas.delete(self.polyline)
+                self.polyline = None
             return
 
-        for point_state in self.state.contour:
-            rectangle = Rectangle(
-                self.canvas,
-                RectangleState(
-                    point_state,
-                    color_state=self.state.rectangle_color,
-                    size_state=self.state.rectangle_size,
-                ),
+        # the outline is closed by repeating the first vertex
+        coords = [
+            value
+            for point in [*points, points[0]]
+            for value in self.positions[id(point)]
+        ]
+        if self.polyline is None:
+            self.polyline = self.canvas.create_line(
+                *coords, fill=self.state.line_color.value, tags=(self.edge_tag,)
             )
-            rectangle.tag_bind("<B1-Motion>", self.move_rectangle)
-            rectangle.tag_bind("<Button-3>", self.delete_rectangle)
-            self.canvas_items.append(rectangle)
-        lowest_rectanlge = self.canvas_items[0]
-
-        for pt_1, pt_2 in zip(
-            self.state.contour, [*self.state.contour[1:], self.state.contour[0]]
-        ):
-            line = Line(self.canvas, LineState(pt_1, pt_2, self.state.line_color))
-            line.tag_bind("<Double-Button-1>", self.create_rectangle)
-            self.canvas.tag_lower(line.id, lowest_rectanlge.id)
-            self.canvas_items.append(line)
+            self.canvas.tag_lower(self.polyline, self.vertex_tag)
+        elif len(moved) > 0 or list(map(id, points)) != list(map(id, self.points)):
+            self.canvas.coords(self.polyline, *coords)
 
     def clear(self):
-        for obj in self.canvas_items:
-            obj.delete()
+        for point in self.points:
+            self.remove_vertex(point)
+        self.canvas.delete(self.edge_tag)
+        self.points = []
+        self.positions = {}
+        self.edges.clear()
+        self.end_points_by_item.clear()
+        self.polyline = None
 
-        self.canvas_items = []
+    def current_item(self) -> int:
+        return self.canvas.find_withtag(tk.CURRENT)[0]
 
-    def move_rectangle(self, event, rectangle):
+    def move_vertex(self, event):
         # TODO: validate that not moved outside of canvas
-        rectangle.state.center_state.set(event.x, event.y)
+        point = self.points_by_item[self.current_item()]
+        point.set(*self.state.to_contour(event.x, event.y))
+
+    def delete_vertex(self, event):
+        self.state.contour.remove(self.points_by_item[self.current_item()])
+
+    def insert_vertex(self, event):
+        if self.polyline is None:
+            end = self.end_points_by_item[self.current_item()]
+            idx = self.state.contour.index(end)
+        else:
+            positions = np.array([self.positions[id(point)] for point in self.points])
+            idx = nearest_edge(positions, (event.x, event.y)) + 1
+        self.state.contour.insert(
+            idx, PointState(*self.state.to_contour(event.x, event.y))
+        )
+
 
-    def delete_rectangle(self, event, rectangle):
-        self.state.contour.remove(rectangle.state.center_state)
+def nearest_edge(contour: np.ndarray, point: tuple[int, int]) -> int:
+    """
+    Get the index of the vertex at which the edge of a closed contour closest
+    to a point starts.
+    """
+    start = contour.astype(float)
+    direction = np.roll(start, -1, axis=0) - start
+    offset = np.array(point, dtype=float) - start
 
-    def create_rectangle(self, event, line):
-        idx = self.state.contour.index(line.state.end_state)
-        self.state.contour.insert(idx, PointState(event.x, event.y))
+    # project the point onto each edge
+    length = np.maximum(np.sum(direction**2, axis=1), 1e-9)
+    t = np.clip(np.sum(offset * direction, axis=1) / length, 0.0, 1.0)
+    distance = np.linalg.norm(offset - t[:, None] * direction, axis=1)
+    return int(np.argmin(distance))
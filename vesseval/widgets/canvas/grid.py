@@ -1,11 +1,9 @@
+import numpy as np
+from numpy.typing import NDArray
 import tkinter as tk
 from widget_state import HigherOrderState, IntState
 
-from ...state import BoundingBoxState, PointState
 from ..util import stateful
-from .bounding_box import BoundingBox
-from .circle import Circle, CircleState
-from .lib import CanvasItem
 
 
 class GridState(HigherOrderState):
@@ -20,65 +18,74 @@ class GridState(HigherOrderState):
         self.n_points_x = IntState(3)
         self.n_points_y = IntState(3)
 
+    def coords(self) -> NDArray:
+        """
+        Compute the coordinates of the grid points.
+
+        The grid is divided into `n_points_x` times `n_points_y` cells and
+        there is a point at each corner of a cell.
+
+        Returns
+        -------
+        NDArray
+            the coordinates as an array of shape (n_points, 2)
+        """
+        xs = np.linspace(0, self.width.value, self.n_points_x.value + 1)
+        ys = np.linspace(0, self.height.value, self.n_points_y.value + 1)
+        xs, ys = self.x.value + xs, self.y.value + ys
+        return np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+
 
 @stateful
 class Grid:
+    """
+    Preview of a grid of points.
 
-    def __init__(self, canvas: tk.Canvas, state: GridState):
+    The canvas items of the points are kept in a pool and moved if the grid
+    changes. Items are only created or deleted if the number of points changes.
+    """
+
+    def __init__(self, canvas: tk.Canvas, state: GridState, radius: int = 3):
         self.widget = canvas
         self.canvas = canvas
         self.state = state
+        self.radius = radius
 
         self.bounding_box = None
-        self.points = []
+        self.points: list[int] = []
 
     def draw(self):
-        self.delete()
-
         state = self.state
 
-        # draw bounding box
-        self.bounding_box = BoundingBox(
-            self.canvas,
-            BoundingBoxState(
-                state.x,
-                state.y,
-                state.x.value + state.width.value,
-                state.y.value + state.height.value,
-            ),
+        bbox = (
+            state.x.value,
+            state.y.value,
+            state.x.value + state.width.value,
+            state.y.value + state.height.value,
         )
-        self.bounding_box.style.rectangle_size.value = 0
-        self.bounding_box.style.line_color.value = "white"
-
-        # draw points
-        t, l = self.bounding_box.state.top_left()
-        b, r = self.bounding_box.state.bottom_right()
-
-        n_rows = self.state.n_points_x.value
-        n_cols = self.state.n_points_y.value
-        step_x = (r.value - l.value) / n_rows
-        step_y = (b.value - t.value) / n_cols
-        for i in range(n_rows + 1):
-            t_x = step_x * i
-            for j in range(n_cols + 1):
-                t_y = step_y * j
-
-                pt = Circle(
-                    self.canvas,
-                    CircleState(
-                        PointState(t.value + t_y, l.value + t_x),
-                        color="white",
-                        radius=3,
-                        outline="black",
-                    ),
-                )
-                self.points.append(pt)
+        if self.bounding_box is None:
+            self.bounding_box = self.canvas.create_rectangle(*bbox, outline="white")
+        else:
+            self.canvas.coords(self.bounding_box, *bbox)
+
+        coords = state.coords()
+        while len(self.points) < len(coords):
+            self.points.append(
+                self.canvas.create_oval(0, 0, 0, 0, fill="white", outline="black")
+            )
+        while len(self.points) > len(coords):
+            self.canvas.delete(self.points.pop())
+
+        # left, top, right and bottom of all points at once
+        ltrb = np.rint(np.hstack([coords - self.radius, coords + self.radius]))
+        for item, _ltrb in zip(self.points, ltrb.astype(int).tolist()):
+            self.canvas.coords(item, *_ltrb)
 
     def delete(self) -> None:
         if self.bounding_box is not None:
-            self.bounding_box.delete()
+            self.canvas.delete(self.bounding_box)
             self.bounding_box = None
 
-        for pt in self.points:
-            pt.delete()
+        for item in self.points:
+            self.canvas.delete(item)
         self.points.clear()
@@ -1,5 +1,4 @@
 from typing import Optional
-import threading
 
 import cv2 as cv
 import numpy as np
@@ -11,12 +10,43 @@ from ...state import DisplayImageState
 from ..util import stateful
 from .lib import CanvasItem
 
+# if the changed area exceeds this fraction of the image, the whole image is uploaded
+FULL_UPLOAD_FRACTION = 0.5
+
 
 def img_to_tk(img: np.ndarray) -> ImageTk:
     return ImageTk.PhotoImage(PILImage.fromarray(img))
 
+
+def dirty_rect(
+    img: np.ndarray, previous: np.ndarray
+) -> Optional[tuple[int, int, int, int]]:
+    """
+    Compute the bounding rectangle (x, y, width, height) of the pixels in which
+    two images of the same shape differ or None if they are equal.
+    """
+    height, width = img.shape[:2]
+    channels = img.size // (height * width)
+
+    # the channels are treated as columns so that the difference is a 2D image
+    diff = cv.absdiff(img, previous).reshape(height, width * channels)
+    x, y, w, h = cv.boundingRect(diff)
+    if w == 0 or h == 0:
+        return None
+
+    x1, x2 = x // channels, -(-(x + w) // channels)
+    return x1, y, x2 - x1, h
+
+
 @stateful
 class Image(CanvasItem):
+    """
+    Canvas image of a `DisplayImageState`.
+
+    The photo image and the canvas item are kept and updated in place.
+    Only the rectangle in which the image changed is uploaded to Tk and
+    nothing is uploaded if the image did not change.
+    """
 
     def __init__(self, canvas: tk.Canvas, state: DisplayImageState):
         super().__init__(canvas, state)
@@ -24,17 +54,53 @@ class Image(CanvasItem):
         self.img_tk = None
         self.img_id = None
 
+        # copy of the image shown by `img_tk` to detect changes
+        self._shown: Optional[np.ndarray] = None
+        self._resolution: Optional[tuple[int, int]] = None
+
     def draw(self):
-        self.canvas.event_generate
-        if self.img_id is not None:
-            self.canvas.delete(self.img_id)
-
-        width, height = self.state.resolution_state.values()
-        self.canvas.config(width=width, height=height)
-        self.img_tk = img_to_tk(self.state.display_image_state.value)
-        self.img_id = self.canvas.create_image(
-            width // 2,
-            height // 2,
-            image=self.img_tk,
-        )
-        self.canvas.tag_lower(self.img_id)
+        img = self.state.display_image_state.value
+        if self._shown is None or self._shown.shape != img.shape:
+            self.create_photo(img)
+        else:
+            self.update_photo(img)
+
+        resolution = tuple(self.state.resolution_state.values())
+        if resolution != self._resolution:
+            self._resolution = resolution
+            width, height = resolution
+            self.canvas.config(width=width, height=height)
+            self.canvas.coords(self.img_id, width // 2, height // 2)
+
+    def create_photo(self, img: np.ndarray):
+        """
+        Create a photo image for a new shape of the image.
+        """
+        self.img_tk = img_to_tk(img)
+        self._shown = img.copy()
+
+        if self.img_id is None:
+            self.img_id = self.canvas.create_image(0, 0, image=self.img_tk)
+            self.canvas.tag_lower(self.img_id)
+            self._resolution = None
+        else:
+            self.canvas.itemconfigure(self.img_id, image=self.img_tk)
+
+    def update_photo(self, img: np.ndarray):
+        """
+        Upload the changed rectangle of the image into the photo image.
+        """
+        rect = dirty_rect(img, self._shown)
+        if rect is None:
+            return
+
+        x, y, w, h = rect
+        if w * h > FULL_UPLOAD_FRACTION * img.shape[0] * img.shape[1]:
+            self.img_tk.paste(PILImage.fromarray(img))
+        else:
+            # the rectangle is converted into a small photo image and copied into
+            # place by Tk because PIL can only paste complete images
+            patch = img_to_tk(np.ascontiguousarray(img[y : y + h, x : x + w]))
+            self.canvas.tk.call(str(self.img_tk), "copy", str(patch), "-to", x, y)
+
+        self._shown[y : y + h, x : x + w] = img[y : y + h, x : x + w]
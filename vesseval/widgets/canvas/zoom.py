@@ -0,0 +1,44 @@
+import tkinter as tk
+
+from ...state import DisplayImageState
+
+# factor by which one step of the mouse wheel zooms
+ZOOM_STEP = 1.25
+
+
+class ZoomPan:
+    """
+    Zoom and pan a zoomable `DisplayImageState` shown on a canvas.
+
+      * the mouse wheel zooms at the cursor
+      * dragging with the middle mouse button pans
+      * double-clicking the middle mouse button resets the view
+    """
+
+    def __init__(self, canvas: tk.Canvas, state: DisplayImageState):
+        self.canvas = canvas
+        self.state = state
+
+        self._last = (0, 0)
+
+        # bindings are added so that bindings of modes are kept
+        self.canvas.bind("<MouseWheel>", self.on_wheel, add="+")
+        self.canvas.bind("<Button-4>", self.on_wheel, add="+")
+        self.canvas.bind("<Button-5>", self.on_wheel, add="+")
+        self.canvas.bind("<Button-2>", self.on_press, add="+")
+        self.canvas.bind("<B2-Motion>", self.on_drag, add="+")
+        self.canvas.bind(
+            "<Double-Button-2>", lambda _: self.state.view.reset(), add="+"
+        )
+
+    def on_wheel(self, event: tk.Event) -> None:
+        # X11 reports the wheel as buttons 4 and 5, other systems with a delta
+        zoom_in = event.num == 4 or event.delta > 0
+        self.state.zoom_at(event.x, event.y, ZOOM_STEP if zoom_in else 1 / ZOOM_STEP)
+
+    def on_press(self, event: tk.Event) -> None:
+        self._last = (event.x, event.y)
+
+    def on_drag(self, event: tk.Event) -> None:
+        self.state.pan(event.x - self._last[0], event.y - self._last[1])
+        self._last = (event.x, event.y)
@@ -1,8 +1,127 @@
+from dataclasses import dataclass
 import functools
+import threading
+import time
+import traceback
 
 import tkinter as tk
 from widget_state import State
 
+# default maximum number of frames (redraws of a widget) per second
+MAX_FPS = 60
+
+
+@dataclass
+class RedrawStats:
+    # state changes that requested a redraw
+    requested: int
+    # redraws executed
+    drawn: int
+    # requests merged into a redraw which was already pending
+    suppressed: int
+
+    def __str__(self) -> str:
+        return (
+            f"{self.requested} requested, {self.drawn} drawn,"
+            f" {self.suppressed} suppressed"
+        )
+
+
+class FrameScheduler:
+    """
+    Coalesce redraws of stateful widgets into frames.
+
+    Widgets whose state changes are marked as dirty and all dirty widgets
+    are drawn once in the next frame. Thus, a widget is drawn at most once
+    per frame regardless of how many changes its state received and frames
+    are limited to `max_fps`.
+
+    Parameters
+    ----------
+    max_fps: int
+        maximum number of frames per second
+    """
+
+    def __init__(self, max_fps: int = MAX_FPS) -> None:
+        self.max_fps = max_fps
+
+        self._lock = threading.Lock()
+        self._dirty: dict[int, object] = {}
+        self._frame_pending = False
+        self._last_frame = 0.0
+
+        self._requested = 0
+        self._drawn = 0
+        self._suppressed = 0
+
+    def request(self, stateful_widget) -> bool:
+        """
+        Mark a widget as dirty (can be called from any thread).
+
+        Returns
+        -------
+        bool
+            if a frame has to be scheduled because none is pending
+        """
+        with self._lock:
+            self._requested += 1
+            if id(stateful_widget) in self._dirty:
+                self._suppressed += 1
+            self._dirty[id(stateful_widget)] = stateful_widget
+
+            if self._frame_pending:
+                return False
+            self._frame_pending = True
+            return True
+
+    def schedule(self, widget: tk.Widget) -> None:
+        """
+        Schedule the next frame on the event loop of a widget (GUI thread only).
+        """
+        # scheduled on the root window because the widget may be destroyed before
+        root = widget._root()
+        delay = self._last_frame + 1.0 / self.max_fps - time.time()
+        if delay > 0:
+            root.after(round(delay * 1000), self.draw_frame)
+        else:
+            root.after_idle(self.draw_frame)
+
+    def cancel(self) -> None:
+        """
+        Reset a pending frame if it could not be scheduled.
+        """
+        with self._lock:
+            self._frame_pending = False
+
+    def draw_frame(self) -> None:
+        with self._lock:
+            dirty = list(self._dirty.values())
+            self._dirty.clear()
+            self._frame_pending = False
+            self._last_frame = time.time()
+            self._drawn += len(dirty)
+
+        for stateful_widget in dirty:
+            try:
+                stateful_widget.draw()
+            except tk.TclError:
+                # the widget was destroyed in the meantime
+                pass
+            except Exception:
+                # the remaining widgets of the frame are still drawn
+                traceback.print_exc()
+
+    def stats(self) -> RedrawStats:
+        with self._lock:
+            return RedrawStats(
+                requested=self._requested,
+                drawn=self._drawn,
+                suppressed=self._suppressed,
+            )
+
+
+FRAME_SCHEDULER = FrameScheduler()
+
 
 def stateful(cls):
     """
@@ -22,6 +141,8 @@ def stateful(cls):
     tkinter event. The reason for this is that state changes may
     occur in separate threads. Firing a tkinter event means that the
     GUI thread is responsible for executing the `draw` function.
+    Redraws are coalesced into frames by the `FRAME_SCHEDULER` so that
+    the event is only fired for the first change until the next frame.
     """
     orig_init = cls.__init__
 
@@ -50,8 +171,16 @@ def stateful(cls):
 
         widget = self if isinstance(self, tk.Widget) else self.widget
 
-        self.state.on_change(lambda _: widget.event_generate(self.event_id))
-        widget.bind(self.event_id, lambda _: self.draw())
+        def on_change(_):
+            if FRAME_SCHEDULER.request(self):
+                try:
+                    widget.event_generate(self.event_id)
+                except tk.TclError:
+                    FRAME_SCHEDULER.cancel()
+                    raise
+
+        self.state.on_change(on_change)
+        widget.bind(self.event_id, lambda _: FRAME_SCHEDULER.schedule(widget))
 
         self.draw()
 